@@ -0,0 +1,234 @@
+"""
+Offline benchmark suite for the Lambda functions' hot paths.
+
+Runs find_detached_volumes, get_cost_data, get_service_breakdown,
+get_storage_costs, forecast_costs, get_hourly_costs, send_email_alert and send_cost_report
+against FakeAws at increasing sizes and records wall time, peak traced
+memory and API calls for each. Peak memory includes the synthetic responses, as it
+would include the parsed responses from AWS. Results are written as JSON
+so runs from different commits can be compared without network access.
+
+Usage:
+    python benchmarks/benchmark_suite.py [--volumes 1000,20000,200000] [--days 30,90,365]
+                                         [--services 200] [--cost-pages 4]
+                                         [--output benchmark.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+import aws_common
+import cost_explorer_dashboard
+import detached_ebs_monitor
+from fake_aws import FakeAws
+
+def measure(name, params, fake_aws, func):
+    """
+    Run func once for wall time and once under tracemalloc for peak memory.
+
+    Caches are cleared before each run so every run makes the same API
+    calls, which are counted on the first run. Returns the result record
+    and the value returned by func.
+    """
+    aws_common.api_cache.clear()
+    fake_aws.calls.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        value = func()
+        wall_time = time.perf_counter() - start
+    api_calls = dict(fake_aws.calls)
+
+    aws_common.api_cache.clear()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    record = {
+        'benchmark': name,
+        'params': params,
+        'wall_time_s': round(wall_time, 4),
+        'peak_memory_mb': round(peak / 1024 ** 2, 2),
+        'api_calls': sum(api_calls.values()),
+        'api_calls_by_operation': api_calls
+    }
+    print(f"{name:<24} {json.dumps(params):<44} {record['wall_time_s']:>10.3f} s {record['peak_memory_mb']:>10.1f} MB {record['api_calls']:>8} calls")
+    return record, value
+
+def volume_benchmarks(volume_count):
+    fake_aws = FakeAws(
+        volume_count=volume_count,
+        instance_count=volume_count // 10,
+        address_count=volume_count // 100,
+        load_balancer_count=volume_count // 100,
+        attached_volume_count=volume_count // 2
+    )
+    ec2_client = fake_aws.client('ec2')
+    ses_client = fake_aws.client('ses')
+    params = {'volumes': volume_count}
+
+    record, volumes = measure(
+        'find_detached_volumes', params, fake_aws,
+        lambda: detached_ebs_monitor.find_detached_volumes(ec2_client, 7)
+    )
+    records = [record]
+
+    record, (findings, _) = measure(
+        'find_waste', params, fake_aws,
+        lambda: detached_ebs_monitor.find_waste(
+            fake_aws, [None], [ec2_client.meta.region_name], list(detached_ebs_monitor.DETECTORS), 7, 90, 8, 2
+        )
+    )
+    records.append(record)
+
+    record, _ = measure(
+        'send_email_alert', params, fake_aws,
+        lambda: detached_ebs_monitor.send_email_alert(
+            ses_client, volumes, 'sender@example.com', ['recipient@example.com'], 'us-east-1', findings=findings
+        )
+    )
+    records.append(record)
+    return records
+
+def cost_benchmarks(days, service_count, cost_pages):
+    fake_aws = FakeAws(service_count=service_count, cost_pages=cost_pages)
+    ce_client = fake_aws.client('ce')
+    ses_client = fake_aws.client('ses')
+    params = {'days': days, 'services': service_count, 'pages': cost_pages}
+
+    record, cost_data = measure(
+        'get_cost_data', params, fake_aws,
+        lambda: cost_explorer_dashboard.get_cost_data(ce_client, days, comparisons=['wow', 'mom'])
+    )
+    records = [record]
+
+    record, service_costs = measure(
+        'get_service_breakdown', params, fake_aws,
+        lambda: cost_explorer_dashboard.get_service_breakdown(cost_data)
+    )
+    records.append(record)
+
+    record, storage_costs = measure(
+        'get_storage_costs', params, fake_aws,
+        lambda: cost_explorer_dashboard.get_storage_costs(cost_data)
+    )
+    records.append(record)
+
+    record, cost_cube = measure(
+        'get_cost_cube', params, fake_aws,
+        lambda: cost_explorer_dashboard.get_cost_cube(
+            ce_client, cost_data['start_date'], cost_data['end_date'],
+            cost_explorer_dashboard.CUBE_DIMENSIONS, 'Team', {'api_calls': 0}, max_workers=3
+        )
+    )
+    records.append(record)
+
+    record, forecast = measure(
+        'forecast_costs', params, fake_aws,
+        lambda: cost_explorer_dashboard.forecast_costs(
+            cost_data['cost_matrix'], cost_explorer_dashboard.plan_cost_queries(days)['open_from']
+        )
+    )
+    records.append(record)
+
+    record, hourly_costs = measure(
+        'get_hourly_costs', params, fake_aws,
+        lambda: cost_explorer_dashboard.get_hourly_costs(
+            ce_client, cost_explorer_dashboard.MAX_HOURLY_DAYS, {'api_calls': 0}, max_workers=8
+        )
+    )
+    records.append(record)
+
+    budget_alerts = cost_explorer_dashboard.check_budget_alerts(cost_data, cost_data['current_total'] / 2, forecast)
+    record, _ = measure(
+        'send_cost_report', params, fake_aws,
+        lambda: cost_explorer_dashboard.send_cost_report(
+            ses_client, cost_data, service_costs, storage_costs, budget_alerts,
+            'sender@example.com', ['recipient@example.com'], 'us-east-1', cost_cube, forecast=forecast,
+            hourly_costs=hourly_costs
+        )
+    )
+    records.append(record)
+    return records
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """
+    Print the change of each benchmark against a baseline results file.
+    """
+    previous = {
+        (record['benchmark'], json.dumps(record['params'], sort_keys=True)): record
+        for record in baseline['results']
+    }
+
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for record in results:
+        old = previous.get((record['benchmark'], json.dumps(record['params'], sort_keys=True)))
+        if old is None:
+            continue
+        changes = []
+        for key in ('wall_time_s', 'peak_memory_mb'):
+            if old[key]:
+                changes.append(f"{key} {(record[key] - old[key]) / old[key] * 100:+.1f}%")
+        changes.append(f"api_calls {record['api_calls'] - old['api_calls']:+d}")
+        print(f"{record['benchmark']:<24} {json.dumps(record['params']):<44} {', '.join(changes)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Lambda hot paths against synthetic AWS responses')
+    parser.add_argument('--volumes', default='1000,20000,200000', help='comma-separated volume counts')
+    parser.add_argument('--days', default='30,90,365', help='comma-separated report periods in days')
+    parser.add_argument('--services', type=int, default=200, help='services in the cost data')
+    parser.add_argument('--cost-pages', type=int, default=4, help='pages per Cost Explorer query')
+    parser.add_argument('--output', default='benchmark.json', help='JSON results file')
+    parser.add_argument('--compare', help='baseline JSON results file to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for volume_count in (int(value) for value in args.volumes.split(',') if value):
+        results.extend(volume_benchmarks(volume_count))
+    for days in (int(value) for value in args.days.split(',') if value):
+        results.extend(cost_benchmarks(days, args.services, args.cost_pages))
+
+    output = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
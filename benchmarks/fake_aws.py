@@ -0,0 +1,314 @@
+"""
+Synthetic AWS responses for the offline benchmarks.
+
+FakeAws answers API calls from botocore's before-call event, so requests
+never leave the process while the handlers still build their clients,
+paginate and parse results as they do against AWS. Responses are
+generated page by page on demand, so large inventories are never held in
+memory all at once.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+
+class FakeAws:
+    """
+    In-process fake of the EC2, Cost Explorer and SES calls the Lambda functions make.
+
+    volume_count detached volumes are returned by describe_volumes, and
+    get_cost_and_usage returns service_count services for every day of the
+    requested period, split over cost_pages pages (with each page boundary
+    falling inside a day, as Cost Explorer does). Requests grouped by a
+    second dimension or tag return member_count members per service. Every
+    fourth of the instance_count instances is stopped with a volume attached,
+    every other of the address_count Elastic IPs is unassociated, and every
+    other of the load_balancer_count load balancers has no healthy targets.
+    describe_volumes filtered on the in-use status returns attached_volume_count
+    attached volumes, and GetMetricData reports every fifth of them as idle.
+    API calls are counted per operation in calls.
+    """
+
+    def __init__(self, volume_count=1000, service_count=50, cost_pages=1, snapshot_ratio=0.1, member_count=20,
+                 instance_count=0, address_count=0, load_balancer_count=0, attached_volume_count=0):
+        self.volume_count = volume_count
+        self.attached_volume_count = attached_volume_count
+        self.service_count = service_count
+        self.member_count = member_count
+        self.instance_count = instance_count
+        self.address_count = address_count
+        self.load_balancer_count = load_balancer_count
+        self.cost_pages = cost_pages
+        self.snapshot_ratio = snapshot_ratio
+        self.now = datetime.now(timezone.utc)
+        self.calls = {}
+        self._clients = {}
+
+    @property
+    def api_calls(self):
+        return sum(self.calls.values())
+
+    def client(self, service, region='us-east-1'):
+        """
+        Create a client whose calls are answered by this fake.
+        """
+        client = boto3.client(
+            service,
+            region_name=region,
+            aws_access_key_id='benchmark',
+            aws_secret_access_key='benchmark'
+        )
+        self.attach(client)
+        return client
+
+    def get_client(self, account_id, service, region='us-east-1'):
+        """
+        Return a cached fake client, so the fake can stand in for AccountClients.
+        """
+        key = (service, region)
+        if key not in self._clients:
+            self._clients[key] = self.client(service, region)
+        return self._clients[key]
+
+    def attach(self, client):
+        client.meta.events.register_first('before-call.*.*', self._before_call, unique_id='fake-aws')
+        return client
+
+    def _before_call(self, model, params, **kwargs):
+        from botocore.awsrequest import AWSResponse
+
+        self.calls[model.name] = self.calls.get(model.name, 0) + 1
+        handler = getattr(self, f'_{model.name}', None)
+        if handler is None:
+            raise NotImplementedError(f'No synthetic response for {model.name}')
+        return AWSResponse(None, 200, {}, None), handler(params['body'])
+
+    def _page(self, body, total, default_size):
+        """
+        Return the [start, end) item range and the next token for a paginated EC2 request.
+        """
+        start = int(body.get('NextToken') or 0)
+        end = min(total, start + int(body.get('MaxResults') or default_size))
+        return start, end, (str(end) if end < total else None)
+
+    def _filter_values(self, body, name):
+        """
+        Return the values of a named filter in an EC2 query request, or None.
+        """
+        for key, value in body.items():
+            if key.startswith('Filter.') and key.endswith('.Name') and value == name:
+                prefix = key[:-len('Name')] + 'Value.'
+                return [value for key, value in body.items() if key.startswith(prefix)]
+        return None
+
+    def _DescribeVolumes(self, body):
+        instance_ids = self._filter_values(body, 'attachment.instance-id')
+        if instance_ids is not None:
+            # Volumes attached to the requested instances
+            return {'Volumes': [
+                {
+                    'VolumeId': f'vol-i{instance_id[2:]}',
+                    'Size': 100,
+                    'VolumeType': 'gp3',
+                    'State': 'in-use',
+                    'CreateTime': self.now - timedelta(days=400),
+                    'AvailabilityZone': 'us-east-1a',
+                    'Attachments': [{'InstanceId': instance_id, 'State': 'attached'}]
+                }
+                for instance_id in instance_ids
+            ]}
+
+        if self._filter_values(body, 'status') == ['in-use']:
+            return self._attached_volumes(body)
+
+        start, end, next_token = self._page(body, self.volume_count, 500)
+        volumes = [
+            {
+                'VolumeId': f'vol-{i:017x}',
+                'Size': (8, 20, 100, 500, 1000)[i % 5],
+                'VolumeType': ('gp2', 'gp3', 'io1', 'io2', 'st1', 'sc1')[i % 6],
+                'Iops': 3000 + (i % 10) * 1000 if i % 6 in (1, 2, 3) else None,
+                'Throughput': 125 + (i % 4) * 125 if i % 6 == 1 else None,
+                'State': 'available',
+                'CreateTime': self.now - timedelta(days=i % 400),
+                'AvailabilityZone': 'us-east-1' + 'abc'[i % 3],
+                'Tags': [
+                    {'Key': 'Name', 'Value': f'volume-{i}'},
+                    {'Key': 'Team', 'Value': f'team-{i % 20}'}
+                ]
+            }
+            for i in range(start, end)
+        ]
+        for volume in volumes:
+            for key in ('Iops', 'Throughput'):
+                if volume[key] is None:
+                    del volume[key]
+
+        response = {'Volumes': volumes}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def _attached_volumes(self, body):
+        start, end, next_token = self._page(body, self.attached_volume_count, 500)
+        response = {'Volumes': [
+            {
+                'VolumeId': f'vol-a{i:016x}',
+                'Size': (8, 100, 500, 1000)[i % 4],
+                'VolumeType': ('gp3', 'gp2', 'io2')[i % 3],
+                'Iops': (3000, 300, 10000)[i % 3],
+                'State': 'in-use',
+                'CreateTime': self.now - timedelta(days=30 + i % 300),
+                'AvailabilityZone': 'us-east-1a',
+                'Attachments': [{'InstanceId': f'i-{i:017x}', 'State': 'attached'}],
+                'Tags': [{'Key': 'Team', 'Value': f'team-{i % 20}'}]
+            }
+            for i in range(start, end)
+        ]}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def _GetMetricData(self, body):
+        results = []
+        index = 1
+        while f'MetricDataQueries.member.{index}.Id' in body:
+            prefix = f'MetricDataQueries.member.{index}.'
+            volume_id = body[prefix + 'MetricStat.Metric.Dimensions.member.1.Value']
+            # Every fifth attached volume sees a handful of operations, the rest are busy
+            busy = int(volume_id[5:], 16) % 5 != 0
+            results.append({
+                'Id': body[prefix + 'Id'],
+                'Label': body[prefix + 'MetricStat.Metric.MetricName'],
+                'Timestamps': [self.now],
+                'Values': [500000.0 if busy else 20.0],
+                'StatusCode': 'Complete'
+            })
+            index += 1
+        return {'MetricDataResults': results}
+
+    def _DescribeSnapshots(self, body):
+        snapshot_count = int(self.volume_count * self.snapshot_ratio)
+        start, end, next_token = self._page(body, snapshot_count, 1000)
+        response = {'Snapshots': [
+            {
+                'SnapshotId': f'snap-{i:017x}',
+                'VolumeId': f'vol-{i * 7 % self.volume_count:017x}',
+                'VolumeSize': 100,
+                'FullSnapshotSizeInBytes': (i % 90 + 10) * 1024 ** 3,
+                'StartTime': self.now - timedelta(days=i % 365)
+            }
+            for i in range(start, end)
+        ]}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def _DescribeAddresses(self, body):
+        return {'Addresses': [
+            dict(
+                {'AllocationId': f'eipalloc-{i:017x}', 'PublicIp': f'198.51.100.{i % 256}', 'Domain': 'vpc'},
+                **({'AssociationId': f'eipassoc-{i:017x}'} if i % 2 else {})
+            )
+            for i in range(self.address_count)
+        ]}
+
+    def _DescribeInstances(self, body):
+        start, end, next_token = self._page(body, self.instance_count, 1000)
+        instances = []
+        for i in range(start, end):
+            stopped = i % 4 == 0
+            instances.append({
+                'InstanceId': f'i-{i:017x}',
+                'State': {'Name': 'stopped' if stopped else 'running'},
+                'StateTransitionReason': (self.now - timedelta(days=i % 60)).strftime('User initiated (%Y-%m-%d %H:%M:%S GMT)') if stopped else '',
+                'BlockDeviceMappings': [{'DeviceName': '/dev/xvda', 'Ebs': {'VolumeId': f'vol-i{i:017x}'}}]
+            })
+
+        response = {'Reservations': [{'ReservationId': f'r-{start:017x}', 'Instances': instances}]}
+        if next_token:
+            response['NextToken'] = next_token
+        return response
+
+    def _DescribeLoadBalancers(self, body):
+        return {'LoadBalancers': [
+            {
+                'LoadBalancerArn': f'arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/app/lb-{i}/{i:016x}',
+                'LoadBalancerName': f'lb-{i}',
+                'Type': 'application',
+                'State': {'Code': 'active'},
+                'CreatedTime': self.now - timedelta(days=100)
+            }
+            for i in range(self.load_balancer_count)
+        ]}
+
+    def _DescribeTargetGroups(self, body):
+        return {'TargetGroups': [
+            {
+                'TargetGroupArn': f'arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/tg-{i}/{i:016x}',
+                'TargetGroupName': f'tg-{i}',
+                'LoadBalancerArns': [f'arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/app/lb-{i}/{i:016x}']
+            }
+            for i in range(self.load_balancer_count)
+        ]}
+
+    def _DescribeTargetHealth(self, body):
+        index = int(body['TargetGroupArn'].rsplit('/', 1)[1], 16)
+        state = 'unhealthy' if index % 2 == 0 else 'healthy'
+        return {'TargetHealthDescriptions': [
+            {'Target': {'Id': f'i-{index:017x}', 'Port': 80}, 'TargetHealth': {'State': state}}
+        ]}
+
+    def _DescribeRegions(self, body):
+        return {'Regions': [{'RegionName': 'us-east-1'}]}
+
+    def _GetCostAndUsage(self, body):
+        request = json.loads(body)
+        period_format = '%Y-%m-%dT%H:%M:%SZ' if request.get('Granularity') == 'HOURLY' else '%Y-%m-%d'
+        start = datetime.strptime(request['TimePeriod']['Start'], period_format)
+        end = datetime.strptime(request['TimePeriod']['End'], period_format)
+
+        # MONTHLY requests are answered as one period; a second GroupBy adds members per service
+        if request.get('Granularity') == 'MONTHLY':
+            period_days, period_count = (end - start).days, 1
+        elif request.get('Granularity') == 'HOURLY':
+            period_days, period_count = 1 / 24, (end - start) // timedelta(hours=1)
+        else:
+            period_days, period_count = 1, (end - start).days
+        groups = request.get('GroupBy', [])
+        member_key = groups[1]['Key'] if len(groups) > 1 else None
+        member_count = self.member_count if member_key else 1
+        groups_per_period = self.service_count * member_count
+        group_count = period_count * groups_per_period
+
+        # Split the period x service groups evenly across pages, regrouping each page by period
+        page = int(request.get('NextPageToken') or 0)
+        page_size = max(1, -(-group_count // self.cost_pages))
+        results = []
+        for index in range(page * page_size, min(group_count, (page + 1) * page_size)):
+            period_index, group_index = divmod(index, groups_per_period)
+            service, member = divmod(group_index, member_count)
+            if group_index == 0 or not results:
+                day = start + timedelta(days=period_index * period_days)
+                period = {'Start': day.strftime(period_format), 'End': (day + timedelta(days=period_days)).strftime(period_format)}
+                results.append({'TimePeriod': period, 'Total': {}, 'Groups': [], 'Estimated': False})
+
+            amount = (service % 17 + 1) * (1 + (period_index % 7) / 10) * period_days / member_count
+            keys = [f'Service {service:03d}']
+            if member_key:
+                keys.append(f'{member_key}$member-{member}' if groups[1]['Type'] == 'TAG' else f'{member_key}-{member:03d}')
+            results[-1]['Groups'].append({
+                'Keys': keys,
+                'Metrics': {'UnblendedCost': {'Amount': f'{amount:.4f}', 'Unit': 'USD'}}
+            })
+
+        response = {'ResultsByTime': results}
+        if (page + 1) * page_size < group_count:
+            response['NextPageToken'] = str(page + 1)
+        return response
+
+    def _GetSendQuota(self, body):
+        return {'Max24HourSend': 50000.0, 'MaxSendRate': 14.0, 'SentLast24Hours': 0.0}
+
+    def _SendRawEmail(self, body):
+        return {'MessageId': f'benchmark-{self.calls["SendRawEmail"]}'}
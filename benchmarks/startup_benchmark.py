@@ -0,0 +1,151 @@
+"""
+Cold-start benchmark for the Lambda handlers.
+
+Each handler runs in a fresh interpreter, like a new Lambda container,
+and the benchmark reports the module import time, the first (cold)
+invocation and a second (warm) invocation. AWS calls are answered by
+FakeAws before they reach the network, so no credentials or AWS access
+are needed.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5] [--output startup.json]
+                                           [--baseline startup.json] [--max-regression 0.25]
+
+With --baseline, the run fails if any median timing is more than
+--max-regression slower than the baseline file.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda')
+
+HANDLERS = {
+    'detached_ebs_monitor': {
+        'DAYS_THRESHOLD': '7'
+    },
+    'cost_explorer_dashboard': {
+        'REPORT_PERIOD_DAYS': '30',
+        'BUDGET_THRESHOLD': '100'
+    }
+}
+
+# Size of the synthetic account
+VOLUME_COUNT = 500
+SERVICE_COUNT = 40
+
+TIMINGS = ['import_ms', 'first_call_ms', 'second_call_ms']
+
+class MockContext:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:benchmark'
+
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+def run_child(module_name):
+    """
+    Import and invoke one handler twice in this process and print its timings as JSON.
+    """
+    start = time.perf_counter()
+    sys.path.insert(0, LAMBDA_DIR)
+    module = __import__(module_name)
+    import_ms = (time.perf_counter() - start) * 1000
+
+    import aws_common
+    from fake_aws import FakeAws
+
+    # Answer every call from the clients the handlers build, keeping client construction in the timings
+    fake_aws = FakeAws(VOLUME_COUNT, SERVICE_COUNT)
+    get_client = aws_common.AccountClients.get_client
+
+    def stubbed_get_client(self, account_id, service, region=None):
+        return fake_aws.attach(get_client(self, account_id, service, region))
+
+    aws_common.AccountClients.get_client = stubbed_get_client
+
+    timings = {'import_ms': import_ms}
+    for name in ('first_call_ms', 'second_call_ms'):
+        start = time.perf_counter()
+        result = module.lambda_handler({}, MockContext())
+        timings[name] = (time.perf_counter() - start) * 1000
+        if result['statusCode'] != 200:
+            raise RuntimeError(f"{module_name} failed: {result['body']}")
+
+    print(json.dumps(timings))
+
+def run_cold(module_name, work_dir):
+    """
+    Run one handler in a fresh interpreter and return its timings.
+    """
+    env = dict(os.environ)
+    env.update(HANDLERS[module_name])
+    env.update({
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'SENDER_EMAIL': 'sender@example.com',
+        'RECIPIENT_EMAILS': 'recipient@example.com',
+        'COST_STORE_PATH': os.path.join(work_dir, f'cost_history-{time.time_ns()}.db')
+    })
+
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', module_name],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True
+    ).stdout
+
+    # Handler logging goes to stdout too, the timings are the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure Lambda handler import and first-call times')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts per handler')
+    parser.add_argument('--output', help='write the median timings to this JSON file')
+    parser.add_argument('--baseline', help='fail if slower than the timings in this JSON file')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='allowed slowdown against the baseline')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return 0
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for module_name in HANDLERS:
+            runs = [run_cold(module_name, work_dir) for _ in range(args.runs)]
+            results[module_name] = {name: round(statistics.median(run[name] for run in runs), 1) for name in TIMINGS}
+
+    print(f"{'handler':<26}" + ''.join(f'{name:>16}' for name in TIMINGS))
+    for module_name, timings in results.items():
+        print(f'{module_name:<26}' + ''.join(f'{timings[name]:>16.1f}' for name in TIMINGS))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = [
+            f'{module_name} {name}: {timings[name]:.1f} ms vs {baseline[module_name][name]:.1f} ms'
+            for module_name, timings in results.items() if module_name in baseline
+            for name in TIMINGS
+            if timings[name] > baseline[module_name][name] * (1 + args.max_regression)
+        ]
+        if regressions:
+            print('Cold-start regressions:\n  ' + '\n  '.join(regressions))
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,8 +3,22 @@
 # Create a zip file for Lambda deployment
 data "archive_file" "cost_explorer_zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda/cost_explorer_dashboard.py"
   output_path = "${path.module}/lambda/cost_explorer_dashboard.zip"
+
+  source {
+    content  = file("${path.module}/lambda/cost_explorer_dashboard.py")
+    filename = "cost_explorer_dashboard.py"
+  }
+
+  source {
+    content  = file("${path.module}/lambda/aws_common.py")
+    filename = "aws_common.py"
+  }
+
+  source {
+    content  = file("${path.module}/lambda/report_email.py")
+    filename = "report_email.py"
+  }
 }
 
 # IAM role for the Cost Explorer Lambda function
@@ -38,18 +52,52 @@ resource "aws_iam_policy" "cost_explorer_policy" {
 
   policy = jsonencode({
     Version = "2012-10-17"
-    Statement = [
+    Statement = concat([
       {
         Effect = "Allow"
         Action = [
           "ce:GetCostAndUsage",
           "ce:GetDimensionValues",
           "ce:GetTags",
-          "ses:SendEmail"
+          "ses:SendEmail",
+          "ses:SendRawEmail",
+          "ses:GetSendQuota"
         ]
         Resource = "*"
       }
-    ]
+    ], length(var.target_accounts) > 0 ? [
+      {
+        Effect = "Allow"
+        Action = [
+          "sts:AssumeRole"
+        ]
+        Resource = "arn:aws:iam::*:role/${var.assume_role_name}"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "organizations:ListAccounts"
+        ]
+        Resource = "*"
+      }
+    ] : [], var.state_bucket != "" ? [
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject"
+        ]
+        Resource = "arn:aws:s3:::${var.state_bucket}/*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        # Built from the name, since the function itself depends on this policy
+        Resource = "arn:aws:lambda:*:*:function:${var.project_name}-cost-explorer-${var.environment}"
+      }
+    ] : [])
   })
 }
 
@@ -75,6 +123,17 @@ resource "aws_lambda_function" "cost_explorer" {
       RECIPIENT_EMAILS  = join(",", var.recipient_emails)
       REPORT_PERIOD_DAYS = var.report_period_days
       BUDGET_THRESHOLD  = var.budget_threshold
+      STATE_BUCKET      = var.state_bucket
+      TARGET_ACCOUNTS   = join(",", var.target_accounts)
+      ASSUME_ROLE_NAME  = var.assume_role_name
+      OWNER_TAG_KEYS    = join(",", var.owner_tag_keys)
+      OWNER_RECIPIENTS  = jsonencode(var.owner_recipients)
+      COST_CUBE_DIMENSIONS = join(",", var.cost_cube_dimensions)
+      COST_COMPARISONS     = join(",", var.cost_comparisons)
+      HOURLY_COST_DAYS     = var.hourly_cost_days
+      REPORT_CHANGES_ONLY  = var.report_changes_only
+      REPORT_CHANGE_TOLERANCE = var.report_change_tolerance
+      MAX_CONTINUATIONS    = var.max_continuations
     }
   }
 
@@ -2,8 +2,36 @@
 # Create a zip file for Lambda deployment
 data "archive_file" "lambda_zip" {
   type        = "zip"
-  source_file = "${path.module}/lambda/detached_ebs_monitor.py"
   output_path = "${path.module}/lambda/detached_ebs_monitor.zip"
+
+  source {
+    content  = file("${path.module}/lambda/detached_ebs_monitor.py")
+    filename = "detached_ebs_monitor.py"
+  }
+
+  source {
+    content  = file("${path.module}/lambda/aws_common.py")
+    filename = "aws_common.py"
+  }
+
+  source {
+    content  = file("${path.module}/lambda/report_email.py")
+    filename = "report_email.py"
+  }
+
+  source {
+    content  = file("${path.module}/lambda/resource_inventory.py")
+    filename = "resource_inventory.py"
+  }
+
+  # Offline EBS price list, generated with `task fetch-ebs-prices`
+  dynamic "source" {
+    for_each = fileexists("${path.module}/lambda/ebs_price_list.json") ? [1] : []
+    content {
+      content  = file("${path.module}/lambda/ebs_price_list.json")
+      filename = "ebs_price_list.json"
+    }
+  }
 }
 
 # IAM role for the Lambda function
@@ -37,17 +65,66 @@ resource "aws_iam_policy" "lambda_policy" {
 
   policy = jsonencode({
     Version = "2012-10-17"
-    Statement = [
+    Statement = concat([
       {
         Effect = "Allow"
         Action = [
           "ec2:DescribeVolumes",
           "ec2:DescribeInstances",
-          "ses:SendEmail"
+          "ec2:DescribeRegions",
+          "ec2:DescribeSnapshots",
+          "ec2:DescribeAddresses",
+          "elasticloadbalancing:DescribeLoadBalancers",
+          "elasticloadbalancing:DescribeTargetGroups",
+          "elasticloadbalancing:DescribeTargetHealth",
+          "cloudwatch:GetMetricData",
+          "ses:SendEmail",
+          "ses:SendRawEmail",
+          "ses:GetSendQuota"
         ]
         Resource = "*"
       }
-    ]
+    ], length(var.target_accounts) > 0 ? [
+      {
+        Effect = "Allow"
+        Action = [
+          "sts:AssumeRole"
+        ]
+        Resource = "arn:aws:iam::*:role/${var.assume_role_name}"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "organizations:ListAccounts"
+        ]
+        Resource = "*"
+      }
+    ] : [], var.state_bucket != "" ? [
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject"
+        ]
+        Resource = "arn:aws:s3:::${var.state_bucket}/*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "lambda:InvokeFunction"
+        ]
+        # Built from the name, since the function itself depends on this policy
+        Resource = "arn:aws:lambda:*:*:function:${var.project_name}-${var.environment}"
+      }
+    ] : [], var.track_detach_events ? [
+      {
+        Effect = "Allow"
+        Action = [
+          "cloudtrail:LookupEvents"
+        ]
+        Resource = "*"
+      }
+    ] : [])
   })
 }
 
@@ -67,11 +144,29 @@ resource "aws_lambda_function" "detached_ebs_monitor" {
   timeout          = 60
   memory_size      = 128
 
+  # Volume events update a shared state store, so they are applied one at a time
+  reserved_concurrent_executions = var.track_detach_events ? 1 : -1
+
   environment {
     variables = {
       SENDER_EMAIL     = var.sender_email
       RECIPIENT_EMAILS = join(",", var.recipient_emails)
       DAYS_THRESHOLD   = var.days_threshold
+      SCAN_REGIONS     = join(",", var.scan_regions)
+      TARGET_ACCOUNTS  = join(",", var.target_accounts)
+      ASSUME_ROLE_NAME = var.assume_role_name
+      INCLUDE_SNAPSHOT_COSTS = var.include_snapshot_costs
+      TRACK_DETACH_EVENTS    = var.track_detach_events
+      RECONCILE_DAYS         = var.reconcile_days
+      STATE_BUCKET           = var.state_bucket
+      OWNER_TAG_KEYS         = join(",", var.owner_tag_keys)
+      OWNER_RECIPIENTS       = jsonencode(var.owner_recipients)
+      VOLUME_TYPES           = join(",", var.volume_types)
+      VOLUME_TAG_KEYS        = join(",", var.volume_tag_keys)
+      WASTE_DETECTORS        = join(",", var.waste_detectors)
+      SNAPSHOT_AGE_DAYS      = var.snapshot_age_days
+      REPORT_CHANGES_ONLY    = var.report_changes_only
+      MAX_CONTINUATIONS      = var.max_continuations
     }
   }
 
@@ -103,3 +198,37 @@ resource "aws_lambda_permission" "allow_cloudwatch" {
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.schedule.arn
 }
+
+# EventBridge rule for EC2 volume API calls recorded by CloudTrail
+resource "aws_cloudwatch_event_rule" "volume_events" {
+  count       = var.track_detach_events ? 1 : 0
+  name        = "${var.project_name}-volume-events-${var.environment}"
+  description = "EC2 volume create, attach, detach and delete calls for detach tracking"
+
+  event_pattern = jsonencode({
+    source        = ["aws.ec2"]
+    "detail-type" = ["AWS API Call via CloudTrail"]
+    detail = {
+      eventSource = ["ec2.amazonaws.com"]
+      eventName   = ["CreateVolume", "AttachVolume", "DetachVolume", "DeleteVolume"]
+    }
+  })
+}
+
+# Target for the volume events rule
+resource "aws_cloudwatch_event_target" "volume_events_target" {
+  count     = var.track_detach_events ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.volume_events[0].name
+  target_id = "TrackVolumeEvents"
+  arn       = aws_lambda_function.detached_ebs_monitor.arn
+}
+
+# Permission to allow the volume events rule to invoke the Lambda function
+resource "aws_lambda_permission" "allow_volume_events" {
+  count         = var.track_detach_events ? 1 : 0
+  statement_id  = "AllowExecutionFromVolumeEvents"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.detached_ebs_monitor.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.volume_events[0].arn
+}
@@ -0,0 +1,653 @@
+"""
+Helpers shared by the cost optimization Lambda functions.
+"""
+import boto3
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone, timedelta
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Starting request rates (requests per second) for each API of a service
+API_RATE_LIMITS = {
+    'ce': 5,
+    'cloudtrail': 2,
+    'cloudwatch': 10,
+    'ec2': 20,
+    'elbv2': 10,
+    'ses': 10
+}
+
+# Error codes AWS services use to signal throttling
+THROTTLE_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'LimitExceededException',
+    'SlowDown'
+}
+
+# Botocore's standard retry mode backs off exponentially with jitter on throttling
+RETRY_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 8})
+
+# Cost Explorer charges $0.01 for each API request
+CE_REQUEST_COST = 0.01
+
+# CloudWatch namespace of the metrics emitted at the end of each invocation
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AwsCostOptimization')
+
+# Seconds that API results stay cached for warm invocations of the same container
+API_CACHE_TTL = int(os.environ.get('API_CACHE_TTL', '900'))
+
+# Seconds kept at the end of an invocation to save a checkpoint and start the continuation
+CONTINUATION_RESERVE_SECONDS = 20
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when an AWS call would start after the invocation deadline.
+    """
+
+def get_deadline(context, reserve_seconds=10):
+    """
+    Return a time.monotonic() deadline that leaves reserve_seconds of the Lambda's remaining time.
+    """
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining is None:
+        return None
+
+    return time.monotonic() + max(0, get_remaining() / 1000 - reserve_seconds)
+
+def get_continuation(event):
+    """
+    Return the run an invocation belongs to, as (run_id, count, state).
+
+    An event sent by start_continuation carries on its run, and count is the
+    number of invocations of the run before this one. Any other event starts
+    a new run, with a count of 0 and an empty state.
+    """
+    continuation = event.get('continuation') if isinstance(event, dict) else None
+    if not isinstance(continuation, dict) or not continuation.get('run_id'):
+        return uuid.uuid4().hex, 0, {}
+
+    return continuation['run_id'], int(continuation.get('count', 0)), continuation.get('state') or {}
+
+def start_continuation(lambda_client, context, run_id, count, state=None):
+    """
+    Invoke this function again asynchronously to carry on a run from its saved checkpoint.
+
+    The new invocation gets a fresh timeout and reads the run's progress from
+    the state store, so only small values belong in state.
+    """
+    payload = {'continuation': {'run_id': run_id, 'count': count + 1, 'state': state or {}}}
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(payload).encode('utf-8')
+    )
+    print(f"Run {run_id} continues in invocation {count + 2}")
+
+class AdaptiveTokenBucket:
+    """
+    Thread-safe token bucket whose rate halves on throttling and recovers slowly on success.
+    """
+
+    def __init__(self, rate, min_rate=0.5):
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self.tokens = self.max_rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """
+        Block until a token is available, raising DeadlineExceeded if that would pass the deadline.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # Below 1 request per second the bucket still holds one whole token
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                # Jitter spreads out threads that are waiting on the same bucket
+                wait_time = (1 - self.tokens) / self.rate * random.uniform(1, 1.5)
+
+            if deadline is not None and now + wait_time > deadline:
+                raise DeadlineExceeded('Deadline exceeded while waiting for the rate limiter')
+            time.sleep(wait_time)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+class ApiThrottle:
+    """
+    Shared rate limiting and deadline for every client attached to it.
+
+    Each API (service and operation) of each account and region gets its own
+    adaptive token bucket, shared by all clients and threads calling it, as
+    AWS applies its request limits per account and region. Scans fanned out
+    to many accounts therefore run at each account's own limit, and a
+    throttle in one account does not slow down the others. A token is taken before every HTTP attempt,
+    including retries and paginator pages, and the bucket slows down when
+    AWS answers with a throttling error. Attempts that would start after the
+    deadline raise DeadlineExceeded.
+    """
+
+    def __init__(self, rates=None, deadline=None):
+        self.rates = API_RATE_LIMITS if rates is None else rates
+        self.deadline = deadline
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, account_id, region, service, operation):
+        if service not in self.rates:
+            return None
+
+        with self._lock:
+            key = (account_id, region, service, operation)
+            if key not in self._buckets:
+                self._buckets[key] = AdaptiveTokenBucket(self.rates[service])
+            return self._buckets[key]
+
+    def attach(self, client, service, account_id=None):
+        """
+        Register the rate limiting hooks on a client's own event system.
+
+        account_id is None for the Lambda's own account; the region is the client's.
+        """
+        region = client.meta.region_name
+
+        def before_send(event_name, **kwargs):
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                raise DeadlineExceeded(f'Deadline exceeded before calling {event_name.split(".")[-1]}')
+
+            bucket = self._bucket(account_id, region, service, event_name.split('.')[-1])
+            if bucket is not None:
+                bucket.acquire(self.deadline)
+
+        def needs_retry(event_name, response=None, **kwargs):
+            bucket = self._bucket(account_id, region, service, event_name.split('.')[-1])
+            if bucket is None or response is None:
+                return None
+
+            http_response, parsed = response
+            error_code = parsed.get('Error', {}).get('Code')
+            if http_response.status_code == 429 or error_code in THROTTLE_ERROR_CODES:
+                bucket.on_throttle()
+            elif http_response.status_code < 300:
+                bucket.on_success()
+
+            # Leave the retry decision to botocore
+            return None
+
+        client.meta.events.register('before-send', before_send)
+        client.meta.events.register('needs-retry', needs_retry)
+        return client
+
+class InvocationMetrics:
+    """
+    Per-invocation telemetry for AWS calls and processing phases, emitted as a CloudWatch EMF log line.
+
+    Attached clients record, per service and operation, the calls made,
+    their latency, the retries and throttles botocore went through, the
+    responses (pages) returned and their size. Phases are timed with
+    phase() in wall-clock time: while threads run the same phase at once,
+    the time is only counted once, so phase times never add up to more than
+    the invocation's duration. Separate runs of a phase are added up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new invocation, dropping everything recorded so far.
+        """
+        with self._lock:
+            self.started = time.monotonic()
+            self.operations = {}
+            self.phases = {}
+            # Threads currently in each phase, and when the first of them entered it
+            self._active_phases = {}
+
+    def _operation(self, service, operation):
+        return self.operations.setdefault((service, operation), {
+            'Calls': 0,
+            'Errors': 0,
+            'Retries': 0,
+            'Throttles': 0,
+            'Pages': 0,
+            'Bytes': 0,
+            'LatencyMs': 0.0,
+            'MaxLatencyMs': 0.0
+        })
+
+    def attach(self, client, service):
+        """
+        Register the recording hooks on a client's own event system.
+        """
+        def before_parameter_build(model, context, **kwargs):
+            context['metrics_started'] = time.monotonic()
+            context['metrics_operation'] = model.name
+
+        def record(context, http_response=None, parsed=None, exception=None):
+            if 'metrics_started' not in context:
+                return
+            latency = (time.monotonic() - context['metrics_started']) * 1000
+            metadata = (parsed or getattr(exception, 'response', None) or {}).get('ResponseMetadata', {})
+            try:
+                size = len(http_response.content) if http_response is not None else 0
+            except Exception:
+                size = 0
+
+            with self._lock:
+                stats = self._operation(service, context['metrics_operation'])
+                stats['Calls'] += 1
+                stats['Retries'] += metadata.get('RetryAttempts', 0)
+                stats['LatencyMs'] += latency
+                stats['MaxLatencyMs'] = max(stats['MaxLatencyMs'], latency)
+                stats['Bytes'] += size
+                if exception is None and http_response is not None and http_response.status_code < 300:
+                    stats['Pages'] += 1
+                else:
+                    stats['Errors'] += 1
+
+        def after_call(http_response, parsed, context, **kwargs):
+            record(context, http_response, parsed)
+
+        def after_call_error(exception, context, **kwargs):
+            record(context, exception=exception)
+
+        def needs_retry(event_name, response=None, **kwargs):
+            if response is None:
+                return None
+
+            http_response, parsed = response
+            error_code = parsed.get('Error', {}).get('Code')
+            if http_response.status_code == 429 or error_code in THROTTLE_ERROR_CODES:
+                with self._lock:
+                    self._operation(service, event_name.split('.')[-1])['Throttles'] += 1
+            return None
+
+        client.meta.events.register('before-parameter-build', before_parameter_build)
+        client.meta.events.register('after-call', after_call)
+        client.meta.events.register('after-call-error', after_call_error)
+        client.meta.events.register('needs-retry', needs_retry)
+        return client
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time a processing phase such as fetch, aggregate, render or send.
+        """
+        with self._lock:
+            count, started = self._active_phases.get(name, (0, None))
+            self._active_phases[name] = (count + 1, time.monotonic() if count == 0 else started)
+        try:
+            yield
+        finally:
+            with self._lock:
+                count, started = self._active_phases.pop(name)
+                if count > 1:
+                    self._active_phases[name] = (count - 1, started)
+                else:
+                    elapsed = (time.monotonic() - started) * 1000
+                    self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def emit(self, function_name, namespace=METRICS_NAMESPACE):
+        """
+        Print the invocation's metrics as one CloudWatch Embedded Metric Format JSON line.
+
+        Totals and phase times become metrics with a FunctionName dimension;
+        the per-operation breakdown is logged alongside them for Logs Insights.
+        """
+        with self._lock:
+            operations = {
+                f"{service}:{operation}": {name: round(value, 2) for name, value in stats.items()}
+                for (service, operation), stats in self.operations.items()
+            }
+            phases = dict(self.phases)
+            duration = (time.monotonic() - self.started) * 1000
+
+        ce_calls = sum(stats['Calls'] for key, stats in operations.items() if key.startswith('ce:'))
+        values = {
+            'ApiCalls': (sum(stats['Calls'] for stats in operations.values()), 'Count'),
+            'ApiErrors': (sum(stats['Errors'] for stats in operations.values()), 'Count'),
+            'ApiRetries': (sum(stats['Retries'] for stats in operations.values()), 'Count'),
+            'ApiThrottles': (sum(stats['Throttles'] for stats in operations.values()), 'Count'),
+            'ApiPages': (sum(stats['Pages'] for stats in operations.values()), 'Count'),
+            'ApiBytes': (sum(stats['Bytes'] for stats in operations.values()), 'Bytes'),
+            'ApiLatency': (sum(stats['LatencyMs'] for stats in operations.values()), 'Milliseconds'),
+            'CostExplorerCalls': (ce_calls, 'Count'),
+            'CostExplorerCost': (round(ce_calls * CE_REQUEST_COST, 2), 'None'),
+            'Duration': (duration, 'Milliseconds')
+        }
+        for name, elapsed in phases.items():
+            values[f"{name.capitalize()}Time"] = (elapsed, 'Milliseconds')
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': namespace,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in values.items()]
+                }]
+            },
+            'FunctionName': function_name,
+            'Operations': operations
+        }
+        record.update((name, round(value, 2) if isinstance(value, float) else value) for name, (value, _) in values.items())
+
+        print(json.dumps(record))
+        return record
+
+# Telemetry of the current invocation, shared by every client and module
+metrics = InvocationMetrics()
+
+class TtlCache:
+    """
+    Thread-safe in-process cache whose entries expire ttl seconds after they were loaded.
+
+    Module-level instances survive between warm invocations of a Lambda
+    container, so repeated runs within the TTL skip the API calls. Expired
+    entries are dropped whenever a value is stored, so keys that are never
+    read again do not pile up across invocations.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() to refresh it when missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+        # Load outside the lock so slow API calls for other keys are not serialized
+        value = loader()
+        with self._lock:
+            now = time.monotonic()
+            for stale_key in [stale_key for stale_key, entry in self._entries.items() if entry[0] <= now]:
+                del self._entries[stale_key]
+            self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# API results shared by every invocation of this container
+api_cache = TtlCache(API_CACHE_TTL)
+
+def download_state_file(s3_client, bucket, path):
+    """
+    Refresh a local state file from S3, skipping the download when the local copy is already current.
+
+    The object key is the file name. The ETag of the last synced copy is kept
+    next to the file, so a warm container only downloads after another
+    container has written a newer version.
+    """
+    key = os.path.basename(path)
+    etag_path = f"{path}.etag"
+
+    try:
+        remote_etag = s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+    except ClientError as e:
+        # A missing object just means this is the first run
+        print(f"No state downloaded from s3://{bucket}/{key}: {e}")
+        return
+
+    if os.path.exists(path) and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            if f.read() == remote_etag:
+                return
+
+    s3_client.download_file(bucket, key, path)
+    with open(etag_path, 'w') as f:
+        f.write(remote_etag)
+
+def upload_state_file(s3_client, bucket, path):
+    """
+    Push a local state file to S3 and remember its ETag.
+    """
+    with open(path, 'rb') as f:
+        response = s3_client.put_object(Bucket=bucket, Key=os.path.basename(path), Body=f)
+
+    with open(f"{path}.etag", 'w') as f:
+        f.write(response['ETag'])
+
+def list_target_accounts(target_accounts, org_client=None):
+    """
+    Resolve the accounts to fan out to, expanding 'organization' to every active member account.
+    """
+    if target_accounts != ['organization']:
+        return target_accounts
+
+    def load():
+        client = org_client or metrics.attach(boto3.client('organizations', config=RETRY_CONFIG), 'organizations')
+        accounts = []
+
+        for page in client.get_paginator('list_accounts').paginate():
+            for account in page.get('Accounts', []):
+                if account.get('Status') == 'ACTIVE':
+                    accounts.append(account['Id'])
+
+        return accounts
+
+    return api_cache.get_or_load(('organization_accounts',), load)
+
+class AccountClients:
+    """
+    Hand out AWS clients per (account, service, region), assuming role_name in member accounts.
+
+    Assumed-role credentials are cached until shortly before they expire, and
+    clients are reused for as long as their credentials are valid. Passing
+    None as the account uses the Lambda's own credentials. Every client is
+    built with RETRY_CONFIG, attached to the shared throttle (if any) and
+    recorded in the invocation metrics.
+    """
+
+    def __init__(self, role_name=None, throttle=None, session_name='aws-cost-optimization', refresh_margin=300):
+        self.role_name = role_name
+        self.throttle = throttle
+        self.session_name = session_name
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._lock = threading.Lock()
+        self._account_locks = {}
+        self._sessions = {}
+        self._expirations = {}
+        self._clients = {}
+        self._sts_client = metrics.attach(boto3.client('sts', config=RETRY_CONFIG), 'sts') if role_name else None
+
+    def _account_lock(self, account_id):
+        with self._lock:
+            return self._account_locks.setdefault(account_id, threading.Lock())
+
+    def _get_session(self, account_id):
+        """
+        Return a session for the account, assuming the role again if the cached credentials are about to expire.
+        """
+        expiration = self._expirations.get(account_id)
+        if account_id in self._sessions and (expiration is None or datetime.now(timezone.utc) < expiration - self.refresh_margin):
+            return self._sessions[account_id]
+
+        if account_id is None:
+            session = boto3.session.Session()
+        else:
+            response = self._sts_client.assume_role(
+                RoleArn=f"arn:aws:iam::{account_id}:role/{self.role_name}",
+                RoleSessionName=self.session_name
+            )
+            credentials = response['Credentials']
+            session = boto3.session.Session(
+                aws_access_key_id=credentials['AccessKeyId'],
+                aws_secret_access_key=credentials['SecretAccessKey'],
+                aws_session_token=credentials['SessionToken']
+            )
+            self._expirations[account_id] = credentials['Expiration']
+
+        # New credentials invalidate every client built from the old ones
+        with self._lock:
+            self._clients[account_id] = {}
+        self._sessions[account_id] = session
+        return session
+
+    def get_client(self, account_id, service, region=None):
+        """
+        Return a cached client for the account, service and region.
+        """
+        # Sessions are not thread-safe, so each account's session is used under its own lock
+        with self._account_lock(account_id):
+            session = self._get_session(account_id)
+            # Each account has its own client dict, only touched under that account's lock
+            with self._lock:
+                account_clients = self._clients[account_id]
+            key = (service, region)
+            if key not in account_clients:
+                client = session.client(service, region_name=region, config=RETRY_CONFIG)
+                if self.throttle is not None:
+                    self.throttle.attach(client, service, account_id)
+                metrics.attach(client, service)
+                account_clients[key] = client
+            return account_clients[key]
+
+# AccountClients kept for warm invocations, keyed by role name
+_account_clients = {}
+
+def get_account_clients(role_name=None, deadline=None):
+    """
+    Return the container-wide AccountClients for role_name, moving its throttle to this invocation's deadline.
+
+    Clients, assumed-role credentials and learned request rates are reused
+    by every warm invocation instead of being rebuilt on each run.
+    """
+
+    account_clients = _account_clients.get(role_name)
+    if account_clients is None:
+        account_clients = AccountClients(role_name, ApiThrottle())
+        _account_clients[role_name] = account_clients
+
+    account_clients.throttle.deadline = deadline
+    return account_clients
+
+def run_task_graph(tasks, max_workers=4):
+    """
+    Run a dependency graph of tasks on a thread pool, starting each one as soon as its dependencies finish.
+
+    tasks maps a name to (func, dependencies); func is called with the
+    results of its dependencies as keyword arguments. Returns the results by
+    name. The first failure stops tasks that have not started yet and is
+    raised once the running ones finish.
+    """
+    pending = dict(tasks)
+    futures = {}
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while pending or futures:
+            for name, (func, dependencies) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    kwargs = {dependency: results[dependency] for dependency in dependencies}
+                    futures[executor.submit(func, **kwargs)] = name
+                    del pending[name]
+
+            if not futures:
+                raise ValueError(f"Tasks with unmet dependencies: {', '.join(sorted(pending))}")
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                error = future.exception()
+                if error is not None:
+                    pending.clear()
+                    for other in futures:
+                        other.cancel()
+                    raise error
+                results[name] = future.result()
+
+    return results
+
+def run_scheduled(tasks, worker, max_workers=8, per_account_limit=2, deadline=None):
+    """
+    Run (account_id, item) tasks with a global and a per-account concurrency cap.
+
+    Accounts are served round-robin so one large account cannot starve the
+    rest. Returns (results, errors) dicts keyed by task; a failing task only
+    records its exception, and tasks still queued or running when the
+    deadline (a time.monotonic() value) passes are reported as timed out
+    instead of holding up the report.
+    """
+    queues = {}
+    for task in tasks:
+        queues.setdefault(task[0], deque()).append(task)
+
+    running = {account_id: 0 for account_id in queues}
+    futures = {}
+    results = {}
+    errors = {}
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        while True:
+            # Hand out work one task per account per pass until a cap is hit
+            submitted = True
+            while submitted and len(futures) < max_workers:
+                submitted = False
+                for account_id, queue in queues.items():
+                    if queue and running[account_id] < per_account_limit and len(futures) < max_workers:
+                        task = queue.popleft()
+                        futures[executor.submit(worker, *task)] = task
+                        running[account_id] += 1
+                        submitted = True
+
+            if not futures:
+                break
+
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+
+            for future in done:
+                task = futures.pop(future)
+                running[task[0]] -= 1
+                try:
+                    results[task] = future.result()
+                except Exception as e:
+                    errors[task] = e
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for task in list(futures.values()) + [task for queue in queues.values() for task in queue]:
+        errors[task] = TimeoutError('Deadline exceeded before the task finished')
+
+    return results, errors
@@ -1,18 +1,160 @@
-import boto3
+import calendar
 import os
 import json
-from datetime import datetime, timedelta
+import heapq
+import operator
+import queue
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from html import escape
+from itertools import accumulate
 from botocore.exceptions import ClientError
+from aws_common import (CONTINUATION_RESERVE_SECONDS, DeadlineExceeded, api_cache, download_state_file,
+                        get_account_clients, get_continuation, get_deadline, list_target_accounts, metrics,
+                        run_scheduled, run_task_graph, start_continuation, upload_state_file)
+from report_email import INLINE_ROWS, ReportSnapshot, deliver_reports, fingerprint_records, html_row_template, render_rows
+
+# Storage services tracked in the storage costs breakdown
+STORAGE_SERVICES = ['Amazon Elastic Block Store', 'Amazon Simple Storage Service',
+                    'Amazon RDS Service', 'Amazon DynamoDB', 'AWS Backup']
+
+# Recent days that Cost Explorer may still revise and are always fetched again
+OPEN_DAYS = 3
+
+# Period string format and length of each Cost Explorer granularity
+PERIODS = {
+    'DAILY': ('%Y-%m-%d', timedelta(days=1)),
+    'HOURLY': ('%Y-%m-%dT%H:%M:%SZ', timedelta(hours=1))
+}
+
+# Periods per request: long ranges are split into windows fetched in parallel.
+# A default 30-day report (60 days with the previous window) stays one request.
+DAILY_WINDOW_DAYS = 60
+HOURLY_WINDOW_HOURS = 24
+
+# Cost Explorer keeps hourly costs for the last 14 days only
+MAX_HOURLY_DAYS = 14
+
+# EWMA anomaly detector settings: smoothing factor, z-score and dollar
+# thresholds for an alert, and days of history needed before alerting
+ANOMALY_ALPHA = 0.3
+ANOMALY_Z_THRESHOLD = 3.0
+ANOMALY_MIN_INCREASE = 1.0
+ANOMALY_WARMUP_DAYS = 7
+
+# Local forecast: closed days fitted, minimum history, per-day trend damping and
+# the z-score of the confidence band (90%)
+FORECAST_FIT_DAYS = 56
+FORECAST_MIN_DAYS = 7
+FORECAST_TREND_DAMPING = 0.95
+FORECAST_Z = 1.645
+
+# Precompiled templates for the report tables and alert boxes
+COST_ROW = html_row_template('{name}', '${cost:.2f}')
+USAGE_ROW = html_row_template('{name}', '{service}', '${cost:.2f}')
+FORECAST_ROW = html_row_template('{name}', '${month_to_date:.2f}', '${month_end:.2f}', '${next_month:.2f}')
+HOURLY_ROW = html_row_template('{hour}', '${cost:.2f}', '{service}', '${service_cost:.2f}')
+ALERT_BOX = (
+    '<div style="background-color: {color}; color: white; padding: 10px; margin: 10px 0; border-radius: 5px;">'
+    '<strong>{type}:</strong> {message}</div>\n'
+).format
+
+# Report attachments
+SERVICES_CSV_NAME = 'service-costs.csv.gz'
+DAILY_CSV_NAME = 'daily-costs.csv.gz'
+ACCOUNTS_CSV_NAME = 'account-costs.csv.gz'
+CUBE_CSV_NAME = 'cost-cube.csv.gz'
+FORECAST_CSV_NAME = 'cost-forecast.csv.gz'
+COMPARISONS_CSV_NAME = 'cost-comparisons.csv.gz'
+HOURLY_CSV_NAME = 'hourly-costs.csv.gz'
+
+# Built-in period comparisons; a whole number N compares the last N days with the N days before
+COMPARISONS = {
+    'wow': 'Week over Week',
+    'mom': 'Month over Month',
+    'yoy': 'Year over Year'
+}
+
+# Year over year compares with the same weekdays 52 weeks earlier
+YEAR_SHIFT_DAYS = 364
+
+# Smallest move in a service's cost that counts as a change for REPORT_CHANGES_ONLY
+CHANGE_MIN_COST = 1.0
+CHANGE_ROW = html_row_template('{name}', '${previous:.2f}', '${cost:.2f}', '{change}')
+CHANGES_CSV_NAME = 'cost-changes.csv.gz'
+
+# Dimensions the cost cube can be built from, each pulled grouped by SERVICE and itself
+CUBE_DIMENSIONS = ('LINKED_ACCOUNT', 'USAGE_TYPE', 'TAG')
+
+# Cube member holding the costs without the owner tag
+UNTAGGED = '(untagged)'
+
+def load_config():
+    """
+    Read the function configuration from the environment variables.
+    """
+    return {
+        'sender_email': os.environ.get('SENDER_EMAIL'),
+        'recipient_emails': os.environ.get('RECIPIENT_EMAILS', '').split(','),
+        'report_period_days': int(os.environ.get('REPORT_PERIOD_DAYS', '30')),
+        'budget_threshold': float(os.environ.get('BUDGET_THRESHOLD', '0')),
+        'cost_store_path': os.environ.get('COST_STORE_PATH', '/tmp/cost_history.db'),
+        'state_bucket': os.environ.get('STATE_BUCKET', ''),
+        'target_accounts': [account.strip() for account in os.environ.get('TARGET_ACCOUNTS', '').split(',') if account.strip()],
+        'assume_role_name': os.environ.get('ASSUME_ROLE_NAME', 'aws-cost-optimization-read'),
+        'max_workers': int(os.environ.get('MAX_WORKERS', '8')),
+        'max_per_account': int(os.environ.get('MAX_PER_ACCOUNT', '2')),
+        'owner_tag_keys': [key.strip() for key in os.environ.get('OWNER_TAG_KEYS', 'Team,Owner').split(',') if key.strip()],
+        'owner_recipients': json.loads(os.environ.get('OWNER_RECIPIENTS') or '{}'),
+        'cube_dimensions': [
+            dimension.strip().upper()
+            for dimension in os.environ.get('COST_CUBE_DIMENSIONS', '').split(',')
+            if dimension.strip().upper() in CUBE_DIMENSIONS
+        ],
+        'comparisons': [
+            name.strip().lower()
+            for name in os.environ.get('COST_COMPARISONS', 'wow,mom').split(',')
+            if name.strip().lower() in COMPARISONS or name.strip().isdigit() and int(name) > 0
+        ],
+        'report_changes_only': os.environ.get('REPORT_CHANGES_ONLY', 'false').lower() == 'true',
+        'report_snapshot_path': os.environ.get('REPORT_SNAPSHOT_PATH', '/tmp/cost_report.snapshot.gz'),
+        'report_change_tolerance': float(os.environ.get('REPORT_CHANGE_TOLERANCE', '5')) / 100,
+        'max_continuations': int(os.environ.get('MAX_CONTINUATIONS', '3')),
+        'hourly_cost_days': min(int(os.environ.get('HOURLY_COST_DAYS', '0')), MAX_HOURLY_DAYS)
+    }
+
+# Configuration is read once per container and reused by warm invocations
+CONFIG = load_config()
 
 def lambda_handler(event, context):
     """
     Lambda function to generate AWS cost analysis reports and send email alerts.
+
+    Every invocation ends with one CloudWatch EMF log line of API and phase metrics.
+    """
+    metrics.reset()
+    try:
+        return generate_cost_report(event, context)
+    finally:
+        metrics.emit(getattr(context, 'function_name', None) or context.invoked_function_arn.split(':')[6])
+
+def generate_cost_report(event, context):
     """
-    # Environment variables
-    sender_email = os.environ.get('SENDER_EMAIL')
-    recipient_emails = os.environ.get('RECIPIENT_EMAILS', '').split(',')
-    report_period_days = int(os.environ.get('REPORT_PERIOD_DAYS', '30'))
-    budget_threshold = float(os.environ.get('BUDGET_THRESHOLD', '0'))
+    Fetch, analyze and send the cost report for one invocation.
+    """
+    sender_email = CONFIG['sender_email']
+    recipient_emails = CONFIG['recipient_emails']
+    report_period_days = CONFIG['report_period_days']
+    comparisons = CONFIG['comparisons']
+    budget_threshold = CONFIG['budget_threshold']
+    cost_store_path = CONFIG['cost_store_path']
+    state_bucket = CONFIG['state_bucket']
+    target_accounts = CONFIG['target_accounts']
 
     # Get the AWS region from the Lambda context
     aws_region = context.invoked_function_arn.split(':')[3]
@@ -24,36 +166,181 @@ def lambda_handler(event, context):
             'body': 'Missing required environment variables'
         }
 
-    # Initialize AWS clients
-    ce_client = boto3.client('ce', region_name=aws_region)
-    ses_client = boto3.client('ses', region_name=aws_region)
+    # Reuse the container's rate-limited AWS clients, stopping retries near the Lambda timeout
+    account_clients = get_account_clients(
+        CONFIG['assume_role_name'] if target_accounts else None,
+        get_deadline(context, reserve_seconds=2)
+    )
+    ce_client = account_clients.get_client(None, 'ce', aws_region)
+    ses_client = account_clients.get_client(None, 'ses', aws_region)
+    s3_client = account_clients.get_client(None, 's3', aws_region) if state_bucket else None
+
+    # With the cost history synced to S3, a fetch that runs out of time is carried on by a new invocation
+    run_id, invocation_count, _ = get_continuation(event)
+    stop_at = None
+    if state_bucket and cost_store_path and invocation_count < CONFIG['max_continuations']:
+        stop_at = get_deadline(context, CONTINUATION_RESERVE_SECONDS)
 
-    try:
-        # Get cost data
-        cost_data = get_cost_data(ce_client, report_period_days)
-        service_costs = get_service_breakdown(ce_client, report_period_days)
-        storage_costs = get_storage_costs(ce_client, report_period_days)
+    # Cost Explorer dates are fixed up front so the cube pulls do not wait for the daily costs
+    plan = plan_cost_queries(report_period_days, comparisons=comparisons)
+    owner_tag_key = CONFIG['owner_tag_keys'][0] if CONFIG['owner_tag_keys'] else None
+    cube_dimensions = list(CONFIG['cube_dimensions'])
+    if CONFIG['owner_recipients'] and 'TAG' not in cube_dimensions:
+        # Owner reports are slices of the cube's TAG dimension
+        cube_dimensions.append('TAG')
+
+    def fetch_cost_data():
+        with metrics.phase('fetch'):
+            if target_accounts:
+                # Fan out to the member accounts and consolidate their costs
+                return get_organization_cost_data(
+                    account_clients,
+                    list_target_accounts(target_accounts),
+                    report_period_days,
+                    aws_region,
+                    CONFIG['max_workers'],
+                    CONFIG['max_per_account'],
+                    get_deadline(context),
+                    cost_store_path,
+                    s3_client,
+                    state_bucket,
+                    comparisons,
+                    stop_at,
+                    run_id
+                )
+
+            # Get cost data, reusing the stored history where possible
+            cost_store = None
+            if cost_store_path:
+                cost_store = open_cost_store(cost_store_path, s3_client, state_bucket)
+
+            try:
+                return get_cost_data(ce_client, report_period_days, cost_store, CONFIG['max_workers'], comparisons,
+                                     stop_at, run_id)
+            finally:
+                if cost_store is not None:
+                    close_cost_store(cost_store, cost_store_path, s3_client, state_bucket)
+
+    def fetch_cost_cube(cost_data=None):
+        # Service x account, usage type and owner tag costs for the drill-down sections
+        if not cube_dimensions or cost_data is not None and cost_data['incomplete']:
+            return None, 0
+        with metrics.phase('fetch'):
+            stats = {'api_calls': 0}
+            cost_cube = get_cost_cube(ce_client, plan['start_date'], plan['end_date'], cube_dimensions,
+                                      owner_tag_key, stats, CONFIG['max_workers'])
+            return cost_cube, stats['api_calls']
 
+    def fetch_hourly_costs(cost_data=None):
+        # Hour-by-hour costs of the last days, for the peak hours section
+        if not CONFIG['hourly_cost_days'] or cost_data is not None and cost_data['incomplete']:
+            return None, 0
+        with metrics.phase('fetch'):
+            stats = {'api_calls': 0}
+            try:
+                hourly_costs = get_hourly_costs(ce_client, CONFIG['hourly_cost_days'], stats, CONFIG['max_workers'])
+            except ClientError as e:
+                # Hourly costs need hourly granularity enabled in the Cost Explorer preferences
+                print(f"Skipping the hourly costs: {e}")
+                hourly_costs = None
+            return hourly_costs, stats['api_calls']
+
+    def aggregate(func):
+        def run(**inputs):
+            with metrics.phase('aggregate'):
+                return func(**inputs)
+        return run
+
+    def find_forecast(cost_data):
+        # Project this and next month's spend from the daily series, without a paid forecast request
+        return forecast_costs(cost_data['cost_matrix'], plan['open_from'])
+
+    def find_budget_alerts(cost_data, forecast):
         # Generate budget alerts if needed
         budget_alerts = []
         if budget_threshold > 0:
-            budget_alerts = check_budget_alerts(cost_data, budget_threshold)
+            budget_alerts = check_budget_alerts(cost_data, budget_threshold, forecast, report_period_days)
+        budget_alerts.extend(check_anomaly_alerts(cost_data))
+        return budget_alerts
+
+    def find_changes(cost_data, budget_alerts):
+        # Compare with the last report sent; service_changes is None for a full report
+        if cost_data['incomplete']:
+            return {'snapshot': None, 'send': False, 'service_changes': None}
+        if not CONFIG['report_changes_only']:
+            return {'snapshot': None, 'send': True, 'service_changes': None}
+
+        report_snapshot = ReportSnapshot(CONFIG['report_snapshot_path'], s3_client, state_bucket)
+        if report_snapshot.fingerprint is None:
+            return {'snapshot': report_snapshot, 'send': True, 'service_changes': None}
+
+        service_changes = diff_cost_report(report_snapshot, cost_data, budget_alerts, CONFIG['report_change_tolerance'])
+        return {'snapshot': report_snapshot, 'send': service_changes is not None, 'service_changes': service_changes}
+
+    def render_main_report(cost_data, service_costs, storage_costs, budget_alerts, cost_cube, hourly_costs, forecast, changes):
+        if not changes['send']:
+            return None
+        with metrics.phase('render'):
+            if changes['service_changes'] is not None:
+                report = render_cost_changes_report(cost_data, changes['service_changes'], budget_alerts, aws_region)
+            else:
+                report = render_cost_report(cost_data, service_costs, storage_costs, budget_alerts, aws_region, cost_cube[0],
+                                            forecast, hourly_costs[0])
+            return dict(report, recipients=recipient_emails)
+
+    def render_owner_reports(cost_data, cost_cube, changes):
+        if not changes['send']:
+            return []
+        with metrics.phase('render'):
+            owner_costs = get_owner_costs(cost_cube[0], CONFIG['owner_recipients'])
+            return render_owner_cost_reports(owner_costs, CONFIG['owner_recipients'], cost_data, aws_region)
+
+    try:
+        # Independent fetches run concurrently (within the Cost Explorer rate limit)
+        # and every later step starts as soon as its inputs are ready
+        results = run_task_graph({
+            'cost_data': (fetch_cost_data, ()),
+            # A run that may be continued pulls the cube only once its daily costs are complete
+            'cost_cube': (fetch_cost_cube, ('cost_data',) if stop_at is not None else ()),
+            'hourly_costs': (fetch_hourly_costs, ('cost_data',) if stop_at is not None else ()),
+            'service_costs': (aggregate(get_service_breakdown), ('cost_data',)),
+            'storage_costs': (aggregate(get_storage_costs), ('cost_data',)),
+            'forecast': (aggregate(find_forecast), ('cost_data',)),
+            'budget_alerts': (aggregate(find_budget_alerts), ('cost_data', 'forecast')),
+            'changes': (aggregate(find_changes), ('cost_data', 'budget_alerts')),
+            'main_report': (render_main_report, ('cost_data', 'service_costs', 'storage_costs', 'budget_alerts', 'cost_cube',
+                                                 'hourly_costs', 'forecast', 'changes')),
+            'owner_reports': (render_owner_reports, ('cost_data', 'cost_cube', 'changes'))
+        }, max_workers=CONFIG['max_workers'])
+
+        cost_data = results['cost_data']
+        cost_data['api_calls'] += results['cost_cube'][1] + results['hourly_costs'][1]
+        changes = results['changes']
+
+        if cost_data['incomplete']:
+            start_continuation(account_clients.get_client(None, 'lambda', aws_region), context, run_id, invocation_count)
+            return {
+                'statusCode': 202,
+                'body': f"Cost fetch checkpointed, continuing in invocation {invocation_count + 2} ({cost_data['api_calls']} Cost Explorer API calls)"
+            }
+
+        if not changes['send']:
+            print("No material changes since the last report.")
+            return {
+                'statusCode': 200,
+                'body': f"No material changes since the last report ({cost_data['api_calls']} Cost Explorer API calls)"
+            }
 
         # Send email report
-        send_cost_report(
-            ses_client,
-            cost_data,
-            service_costs,
-            storage_costs,
-            budget_alerts,
-            sender_email,
-            recipient_emails,
-            aws_region
-        )
+        send_reports(ses_client, sender_email, [results['main_report']] + results['owner_reports'], CONFIG['max_workers'])
+
+        if changes['snapshot'] is not None:
+            # The next run is compared with what was just sent
+            changes['snapshot'].save(lambda: cost_report_records(cost_data, results['budget_alerts']))
 
         return {
             'statusCode': 200,
-            'body': 'Cost report generated and sent successfully'
+            'body': f"Cost report generated and sent successfully ({cost_data['api_calls']} Cost Explorer API calls)"
         }
 
     except Exception as e:
@@ -63,193 +350,986 @@ def lambda_handler(event, context):
             'body': f'Error generating cost report: {str(e)}'
         }
 
-def get_cost_data(ce_client, days):
+def plan_cost_queries(days, missing_ranges=None, comparisons=()):
     """
-    Get cost data for the specified period using the Cost Explorer API.
+    Work out the smallest set of Cost Explorer requests the report needs.
+
+    A single DAILY pull grouped by SERVICE covering both the current and the
+    previous window is enough to derive the totals, trend, service breakdown
+    and storage subset locally. The pull reaches back to history_start when
+    the period comparisons need older days. When missing_ranges is given
+    (from the cost history store), only those date ranges are requested.
+    Ranges longer than DAILY_WINDOW_DAYS are split into windows, so long
+    backfills are fetched in parallel.
     """
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-
-    # Get daily costs
-    daily_response = ce_client.get_cost_and_usage(
-        TimePeriod={
-            'Start': start_date,
-            'End': end_date
-        },
-        Granularity='DAILY',
-        Metrics=['UnblendedCost'],
-        GroupBy=[
-            {
-                'Type': 'DIMENSION',
-                'Key': 'SERVICE'
-            }
+    now = datetime.now()
+    end_date = now.strftime('%Y-%m-%d')
+    start_date = (now - timedelta(days=days)).strftime('%Y-%m-%d')
+    previous_start = (now - timedelta(days=days*2)).strftime('%Y-%m-%d')
+    open_from = (now - timedelta(days=OPEN_DAYS)).strftime('%Y-%m-%d')
+
+    periods = plan_comparisons(now, days, comparisons)
+    history_start = min([previous_start] + [period['previous'][0] for period in periods])
+
+    if missing_ranges is None:
+        missing_ranges = [(history_start, end_date)]
+
+    queries = []
+    for range_start, range_end in missing_ranges:
+        queries.extend(plan_window_queries(range_start, range_end, 'DAILY', DAILY_WINDOW_DAYS))
+
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'previous_start': previous_start,
+        'history_start': history_start,
+        'open_from': open_from,
+        'comparisons': periods,
+        'queries': queries
+    }
+
+def plan_window_queries(start, end, granularity, window):
+    """
+    Split [start, end) into windows of at most window periods, with one query per window grouped by SERVICE.
+
+    Windows are half-open and end where the next one starts, so stitching
+    their results back together repeats no period.
+    """
+    period_format, step = PERIODS[granularity]
+    window_start = datetime.strptime(start, period_format)
+    end = datetime.strptime(end, period_format)
+
+    queries = []
+    while window_start < end:
+        window_end = min(window_start + step * window, end)
+        queries.append({
+            'TimePeriod': {
+                'Start': window_start.strftime(period_format),
+                'End': window_end.strftime(period_format)
+            },
+            'Granularity': granularity,
+            'Metrics': ['UnblendedCost'],
+            'GroupBy': [
+                {
+                    'Type': 'DIMENSION',
+                    'Key': 'SERVICE'
+                }
+            ]
+        })
+        window_start = window_end
+
+    return queries
+
+def plan_comparisons(now, days, names):
+    """
+    Work out the current and previous date windows of each named period comparison.
+
+    Windows are [start, end) date strings ending today. Month over month
+    compares the month to date with the same days of the previous month, or
+    the last full month with the one before it on the first of a month.
+    """
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def window(start, end):
+        return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+    periods = []
+    for name in names:
+        if name == 'wow':
+            current = window(today - timedelta(days=7), today)
+            previous = window(today - timedelta(days=14), today - timedelta(days=7))
+        elif name == 'mom':
+            month_start = today.replace(day=1)
+            full_month = month_start == today
+            if full_month:
+                month_start = (today - timedelta(days=1)).replace(day=1)
+            previous_month_start = (month_start - timedelta(days=1)).replace(day=1)
+            previous_end = month_start if full_month else min(previous_month_start + (today - month_start), month_start)
+            current = window(month_start, today)
+            previous = window(previous_month_start, previous_end)
+        elif name == 'yoy':
+            start = today - timedelta(days=days)
+            current = window(start, today)
+            previous = window(start - timedelta(days=YEAR_SHIFT_DAYS), today - timedelta(days=YEAR_SHIFT_DAYS))
+        else:
+            length = timedelta(days=int(name))
+            current = window(today - length, today)
+            previous = window(today - length * 2, today - length)
+
+        periods.append({
+            'name': name,
+            'label': COMPARISONS.get(name, f"{name} Days"),
+            'current': current,
+            'previous': previous
+        })
+
+    return periods
+
+def iter_cost_pages(ce_client, queries, stats, max_workers=1, stop_at=None, pending=None):
+    """
+    Stream the planned queries page by page, following NextPageToken.
+
+    Yields the ResultsByTime entries of each page and counts API calls in
+    stats['api_calls']. A day's groups may be split across pages, so callers
+    must merge entries for the same day rather than replace them. With
+    max_workers > 1, separate queries are fetched concurrently and their
+    pages are yielded as they arrive, through a queue of at most max_workers
+    pages, so memory stays bounded by a few pages whatever the range.
+    Pages of one query come in order, since every page needs the previous
+    page's token, but may be interleaved with other queries' pages.
+
+    Once stop_at (a time.monotonic() deadline) passes, queries stop between
+    pages and the request of each one's next page, with its NextPageToken,
+    is appended to pending so a later invocation can carry on from there,
+    so pending is required with stop_at.
+    """
+    if stop_at is not None and pending is None:
+        raise ValueError('A pending list is needed to carry on the queries cut off at stop_at')
+
+    lock = threading.Lock()
+
+    def load(kwargs):
+        with lock:
+            stats['api_calls'] += 1
+        response = ce_client.get_cost_and_usage(**kwargs)
+        # Cached pages are kept compressed, so a long range does not hold every parsed page in memory
+        page = {'ResultsByTime': response.get('ResultsByTime', []), 'NextPageToken': response.get('NextPageToken')}
+        return zlib.compress(json.dumps(page).encode('utf-8'))
+
+    def query_pages(query):
+        kwargs = dict(query)
+        while True:
+            if stop_at is not None and time.monotonic() >= stop_at:
+                with lock:
+                    pending.append(kwargs)
+                return
+
+            # Pages fetched by a recent warm invocation are served from the cache at no cost
+            key = ('get_cost_and_usage', ce_client, json.dumps(kwargs, sort_keys=True))
+            response = json.loads(zlib.decompress(api_cache.get_or_load(key, lambda: load(kwargs))))
+            yield response.get('ResultsByTime', [])
+
+            next_token = response.get('NextPageToken')
+            if not next_token:
+                break
+            kwargs['NextPageToken'] = next_token
+
+    if max_workers <= 1 or len(queries) <= 1:
+        for query in queries:
+            yield from query_pages(query)
+        return
+
+    pages = queue.Queue(maxsize=max_workers)
+    stopped = threading.Event()
+
+    def put(item):
+        # Give up once the consumer has stopped reading, so workers never block forever
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch(query):
+        try:
+            for page in query_pages(query):
+                if not put((page, None)):
+                    return
+            put((None, None))
+        except Exception as e:
+            put((None, e))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as executor:
+        for query in queries:
+            executor.submit(fetch, query)
+
+        try:
+            remaining = len(queries)
+            while remaining:
+                page, error = pages.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    remaining -= 1
+                else:
+                    yield page
+        finally:
+            stopped.set()
+
+class CostMatrix:
+    """
+    Dense days x services matrix of daily costs.
+
+    The dates are fixed when the matrix is created and services are added as
+    they are first seen. Costs are stored column-wise, one array('d') per
+    service, so amounts are parsed once and window sums, totals and top-N
+    are slice sums over flat arrays instead of walks over nested dicts.
+    With HOURLY granularity the rows are hours, named by their Cost
+    Explorer period start.
+    """
+
+    def __init__(self, start_date, end_date, granularity='DAILY'):
+        period_format, step = PERIODS[granularity]
+        day = datetime.strptime(start_date, period_format)
+        end = datetime.strptime(end_date, period_format)
+
+        self.granularity = granularity
+        self.dates = []
+        while day < end:
+            self.dates.append(day.strftime(period_format))
+            day += step
+
+        self.date_index = {date: index for index, date in enumerate(self.dates)}
+        self.services = []
+        self.service_index = {}
+        self.columns = []
+
+    def column(self, service_name):
+        """
+        Return the cost column for a service, adding an empty one if it is new.
+        """
+        index = self.service_index.get(service_name)
+        if index is None:
+            index = len(self.services)
+            self.service_index[service_name] = index
+            self.services.append(service_name)
+            self.columns.append(array('d', [0.0]) * len(self.dates))
+        return self.columns[index]
+
+    def set(self, day, service_name, amount):
+        row = self.date_index.get(day)
+        if row is not None:
+            self.column(service_name)[row] = amount
+
+    def add_matrix(self, other):
+        """
+        Add another matrix covering the same dates into this one.
+        """
+        for service_name, other_column in zip(other.services, other.columns):
+            column = self.column(service_name)
+            column[:] = array('d', map(operator.add, column, other_column))
+
+    def rows(self, start_date=None, end_date=None):
+        """
+        Return the row slice for [start_date, end_date).
+        """
+        start = 0 if start_date is None else bisect_left(self.dates, start_date)
+        end = len(self.dates) if end_date is None else bisect_left(self.dates, end_date)
+        return slice(start, end)
+
+    def service_totals(self, start_date=None, end_date=None):
+        """
+        Return per-service totals for the window, aligned with self.services.
+        """
+        rows = self.rows(start_date, end_date)
+        return [sum(column[rows]) for column in self.columns]
+
+    def day_totals(self, start_date=None, end_date=None):
+        """
+        Return the total cost of each day in the window.
+        """
+        rows = self.rows(start_date, end_date)
+        if not self.columns:
+            return [0.0] * len(self.dates[rows])
+        return [sum(day) for day in zip(*(column[rows] for column in self.columns))]
+
+    def total(self, start_date=None, end_date=None):
+        return sum(self.service_totals(start_date, end_date))
+
+    def top_services(self, n, start_date=None, end_date=None):
+        """
+        Return the n most expensive services in the window as (service, cost) pairs.
+        """
+        totals = self.service_totals(start_date, end_date)
+        return [
+            (self.services[index], totals[index])
+            for index in heapq.nlargest(n, range(len(totals)), key=totals.__getitem__)
         ]
-    )
 
-    # Get monthly costs
-    monthly_response = ce_client.get_cost_and_usage(
-        TimePeriod={
-            'Start': start_date,
-            'End': end_date
-        },
-        Granularity='MONTHLY',
-        Metrics=['UnblendedCost']
-    )
+class CostIndex:
+    """
+    Prefix sums of every service's daily costs, built once from a cost matrix.
 
-    # Get trend (compare to previous period)
-    previous_start = (datetime.now() - timedelta(days=days*2)).strftime('%Y-%m-%d')
-    previous_end = start_date
-
-    trend_current = ce_client.get_cost_and_usage(
-        TimePeriod={
-            'Start': start_date,
-            'End': end_date
-        },
-        Granularity='MONTHLY',
-        Metrics=['UnblendedCost']
+    The total of any [start_date, end_date) window is the difference of two
+    prefix entries, so each window costs one date lookup plus O(1) per
+    service however long the window is, and any number of comparisons can
+    be answered from the same daily pull without rescanning it.
+    """
+
+    def __init__(self, cost_matrix):
+        self.dates = cost_matrix.dates
+        self.services = cost_matrix.services
+        self.prefixes = [array('d', accumulate(column, initial=0.0)) for column in cost_matrix.columns]
+        self.total_prefix = array('d', accumulate(cost_matrix.day_totals(), initial=0.0))
+
+    def bounds(self, start_date, end_date):
+        return bisect_left(self.dates, start_date), bisect_left(self.dates, end_date)
+
+    def service_totals(self, start_date, end_date):
+        """
+        Return per-service totals for the window, aligned with self.services.
+        """
+        start, end = self.bounds(start_date, end_date)
+        return [prefix[end] - prefix[start] for prefix in self.prefixes]
+
+    def total(self, start_date, end_date):
+        start, end = self.bounds(start_date, end_date)
+        return self.total_prefix[end] - self.total_prefix[start]
+
+def compare_periods(cost_index, periods):
+    """
+    Total every service over the current and previous windows of each period comparison.
+
+    Returns the periods with 'current_totals' and 'previous_totals' lists
+    aligned with cost_index.services, and their sums.
+    """
+    comparisons = []
+    for period in periods:
+        current_totals = cost_index.service_totals(*period['current'])
+        previous_totals = cost_index.service_totals(*period['previous'])
+        comparisons.append(dict(
+            period,
+            current_totals=current_totals,
+            previous_totals=previous_totals,
+            current_total=cost_index.total(*period['current']),
+            previous_total=cost_index.total(*period['previous'])
+        ))
+    return comparisons
+
+def merge_cost_page(cost_matrix, results_by_time):
+    """
+    Merge one page of daily results into the cost matrix.
+    """
+    for day in results_by_time:
+        day_start = day['TimePeriod']['Start']
+        for group in day.get('Groups', []):
+            cost_matrix.set(day_start, group['Keys'][0], float(group['Metrics']['UnblendedCost']['Amount']))
+
+def open_cost_store(path, s3_client=None, bucket=''):
+    """
+    Open the SQLite cost history store, pulling the latest copy from S3 when a bucket is configured.
+    """
+    # Only needed when a store is used, so not imported at cold start
+    import sqlite3
+
+    if s3_client and bucket:
+        download_state_file(s3_client, bucket, path)
+
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cost_history (
+            day TEXT NOT NULL,
+            service TEXT NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (day, service)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fetched_days (
+            day TEXT PRIMARY KEY,
+            estimated INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS anomaly_state (
+            service TEXT PRIMARY KEY,
+            mean REAL NOT NULL,
+            var REAL NOT NULL,
+            count INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+def close_cost_store(conn, path, s3_client=None, bucket=''):
+    """
+    Close the cost history store and push it back to S3 if anything changed.
+    """
+    changed = conn.total_changes > 0
+    conn.close()
+
+    if changed and s3_client and bucket:
+        upload_state_file(s3_client, bucket, path)
+
+def find_missing_ranges(conn, start_date, end_date):
+    """
+    Return the date ranges in [start_date, end_date) that are not stored or may still change.
+    """
+    open_from = (datetime.strptime(end_date, '%Y-%m-%d') - timedelta(days=OPEN_DAYS)).strftime('%Y-%m-%d')
+    closed_days = {
+        row[0] for row in conn.execute(
+            "SELECT day FROM fetched_days WHERE day >= ? AND day < ? AND estimated = 0",
+            (start_date, end_date)
+        )
+    }
+
+    ranges = []
+    day = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+
+    while day < end:
+        day_str = day.strftime('%Y-%m-%d')
+        next_str = (day + timedelta(days=1)).strftime('%Y-%m-%d')
+
+        if day_str not in closed_days or day_str >= open_from:
+            # Extend the previous range when the days are contiguous
+            if ranges and ranges[-1][1] == day_str:
+                ranges[-1] = (ranges[-1][0], next_str)
+            else:
+                ranges.append((day_str, next_str))
+
+        day += timedelta(days=1)
+
+    return ranges
+
+def save_cost_history(conn, pages, replaced_days=None):
+    """
+    Store streamed daily results, replacing any earlier values for the same days.
+
+    replaced_days are the days already cleared by an earlier part of the same
+    fetch, whose stored rows are kept and added to. Returns the days cleared.
+    """
+    replaced_days = set(replaced_days or ())
+
+    for results_by_time in pages:
+        for day in results_by_time:
+            day_start = day['TimePeriod']['Start']
+
+            # Clear a day's old rows once, before its first page is written
+            if day_start not in replaced_days:
+                conn.execute("DELETE FROM cost_history WHERE day = ?", (day_start,))
+                replaced_days.add(day_start)
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO cost_history (day, service, amount) VALUES (?, ?, ?)",
+                [
+                    (day_start, group['Keys'][0], float(group['Metrics']['UnblendedCost']['Amount']))
+                    for group in day.get('Groups', [])
+                ]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO fetched_days (day, estimated) VALUES (?, ?)",
+                (day_start, 1 if day.get('Estimated') else 0)
+            )
+
+        conn.commit()
+
+    return replaced_days
+
+def load_fetch_cursor(conn, end_date):
+    """
+    Return the cursor left by a fetch ending at end_date that was cut short, or None.
+    """
+    row = conn.execute("SELECT value FROM store_meta WHERE key = 'fetch_cursor'").fetchone()
+    if row is None:
+        return None
+
+    cursor = json.loads(row[0])
+    if cursor['end_date'] != end_date:
+        # The days of an older cursor were marked estimated, so they are fetched again anyway
+        return None
+    return cursor
+
+def save_fetch_cursor(conn, end_date, pending, replaced_days):
+    """
+    Remember the unfinished requests of a fetch cut short, or clear the cursor once the fetch is complete.
+    """
+    if not pending:
+        conn.execute("DELETE FROM store_meta WHERE key = 'fetch_cursor'")
+        conn.commit()
+        return
+
+    cursor = {'end_date': end_date, 'queries': pending, 'replaced_days': sorted(replaced_days)}
+    conn.execute(
+        "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('fetch_cursor', ?)",
+        (json.dumps(cursor),)
     )
+    # Days of the unfinished requests may be stored in part until the cursor is picked up
+    conn.executemany(
+        "UPDATE fetched_days SET estimated = 1 WHERE day >= ? AND day < ?",
+        [(query['TimePeriod']['Start'], query['TimePeriod']['End']) for query in pending]
+    )
+    conn.commit()
+
+def load_cost_history(conn, start_date, end_date):
+    """
+    Load stored daily costs in [start_date, end_date) into a cost matrix.
+    """
+    cost_matrix = CostMatrix(start_date, end_date)
+
+    for day, service_name, amount in conn.execute(
+        "SELECT day, service, amount FROM cost_history WHERE day >= ? AND day < ?",
+        (start_date, end_date)
+    ):
+        cost_matrix.set(day, service_name, amount)
+
+    return cost_matrix
+
+def load_anomaly_state(conn):
+    """
+    Load the anomaly detector state saved by the previous run.
+    """
+    row = conn.execute("SELECT value FROM store_meta WHERE key = 'anomaly_last_day'").fetchone()
+
+    return {
+        'last_day': row[0] if row else None,
+        'services': {
+            service_name: [mean, var, count]
+            for service_name, mean, var, count in conn.execute("SELECT service, mean, var, count FROM anomaly_state")
+        }
+    }
+
+def save_anomaly_state(conn, state):
+    """
+    Save the anomaly detector state for the next run.
+    """
+    if state['last_day'] is None:
+        return
 
-    trend_previous = ce_client.get_cost_and_usage(
-        TimePeriod={
-            'Start': previous_start,
-            'End': previous_end
-        },
-        Granularity='MONTHLY',
-        Metrics=['UnblendedCost']
+    conn.execute("DELETE FROM anomaly_state")
+    conn.executemany(
+        "INSERT INTO anomaly_state (service, mean, var, count) VALUES (?, ?, ?, ?)",
+        [(service_name, mean, var, count) for service_name, (mean, var, count) in state['services'].items()]
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('anomaly_last_day', ?)",
+        (state['last_day'],)
     )
+    conn.commit()
+
+def detect_cost_anomalies(cost_matrix, state=None, closed_before=None):
+    """
+    Flag per-service daily cost spikes with an exponentially weighted mean and variance.
+
+    Only days after state['last_day'] are processed, so with a saved state
+    each new day costs O(services). Closed days (before closed_before) update
+    the state; later days may still change, so they are scored against it
+    without updating it. Returns the anomalies found, largest first.
+    """
+    if state is None:
+        state = {'last_day': None, 'services': {}}
+
+    services = state['services']
+    first_row = 0
+    if state['last_day'] is not None:
+        first_row = bisect_left(cost_matrix.dates, state['last_day'])
+        if first_row < len(cost_matrix.dates) and cost_matrix.dates[first_row] == state['last_day']:
+            first_row += 1
+
+    anomalies = []
+
+    for row in range(first_row, len(cost_matrix.dates)):
+        day = cost_matrix.dates[row]
+        update = closed_before is None or day < closed_before
+
+        for service_name, column in zip(cost_matrix.services, cost_matrix.columns):
+            amount = column[row]
+            stats = services.get(service_name)
+            if stats is None:
+                if not update:
+                    continue
+                stats = services[service_name] = [amount, 0.0, 0]
+
+            mean, var, count = stats
+            deviation = amount - mean
+
+            if count >= ANOMALY_WARMUP_DAYS and deviation >= ANOMALY_MIN_INCREASE:
+                z_score = deviation / max(var ** 0.5, ANOMALY_MIN_INCREASE / ANOMALY_Z_THRESHOLD)
+                if z_score >= ANOMALY_Z_THRESHOLD:
+                    anomalies.append({
+                        'service': service_name,
+                        'day': day,
+                        'cost': amount,
+                        'expected': mean,
+                        'deviation': deviation,
+                        'z_score': z_score
+                    })
+
+            if update:
+                increment = ANOMALY_ALPHA * deviation
+                stats[0] = mean + increment
+                stats[1] = (1 - ANOMALY_ALPHA) * (var + deviation * increment)
+                stats[2] = count + 1
+
+        if update:
+            state['last_day'] = day
+
+    anomalies.sort(key=lambda anomaly: anomaly['deviation'], reverse=True)
+    return anomalies
+
+def forecast_costs(cost_matrix, closed_before):
+    """
+    Project this month's and next month's spend per service from the daily cost matrix.
+
+    Each service is fitted on its last FORECAST_FIT_DAYS closed days (whole
+    weeks) as a linear run-rate trend plus an additive day-of-week offset,
+    using closed-form least squares over its cost column, so hundreds of
+    services take a few milliseconds. The trend is damped as it is
+    projected, the open days are projected rather than read, and the
+    confidence bands come from the residual variance of every service.
+    Returns None when there is too little history or the matrix does not
+    reach back to the start of the month.
+    """
+    closed_end = bisect_left(cost_matrix.dates, closed_before)
+    fit_days = min(closed_end, FORECAST_FIT_DAYS)
+    seasonal = fit_days >= 14
+    if seasonal:
+        # Whole weeks, so every weekday weighs the same in the fit
+        fit_days -= fit_days % 7
+    if fit_days < FORECAST_MIN_DAYS:
+        print(f"Not enough closed days for a forecast ({fit_days})")
+        return None
+
+    first_fitted = datetime.strptime(cost_matrix.dates[closed_end - fit_days], '%Y-%m-%d')
+    first_projected = datetime.strptime(cost_matrix.dates[closed_end - 1], '%Y-%m-%d') + timedelta(days=1)
+    today = datetime.strptime(cost_matrix.dates[-1], '%Y-%m-%d') + timedelta(days=1)
+    month_start = today.replace(day=1)
+    next_start = (month_start + timedelta(days=32)).replace(day=1)
+    next_end = (next_start + timedelta(days=32)).replace(day=1)
+    if month_start.strftime('%Y-%m-%d') < cost_matrix.dates[0]:
+        print(f"Cost history starts after {month_start:%Y-%m-%d}, skipping the forecast")
+        return None
+
+    # Steps of the projection that fall in this month and in the next one
+    horizon = (next_end - first_projected).days
+    month_from = max(0, (month_start - first_projected).days)
+    next_from = (next_start - first_projected).days
+    actual_rows = cost_matrix.rows(month_start.strftime('%Y-%m-%d'), first_projected.strftime('%Y-%m-%d'))
+
+    # Shared per-row and per-step terms
+    fit_rows = slice(closed_end - fit_days, closed_end)
+    fit_weekdays = [(first_fitted.weekday() + row) % 7 for row in range(fit_days)]
+    step_weekdays = [(first_projected.weekday() + step) % 7 for step in range(horizon)]
+    xs = array('d', range(fit_days))
+    x_mean = (fit_days - 1) / 2
+    sxx = fit_days * (fit_days * fit_days - 1) / 12
+    damping = FORECAST_TREND_DAMPING
+    trend_steps = [damping * (1 - damping ** (step + 1)) / (1 - damping) for step in range(horizon)]
+    dof = max(1, fit_days - 2 - (6 if seasonal else 0))
+
+    services = []
+    month_variance = 0.0
+    next_variance = 0.0
+    run_rate = 0.0
+
+    for service_name, column in zip(cost_matrix.services, cost_matrix.columns):
+        ys = column[fit_rows]
+        month_to_date = sum(column[actual_rows])
+        total = sum(ys)
+        if not total and not month_to_date:
+            continue
+        mean = total / fit_days
 
-    # Calculate total costs and trend
-    current_total = sum(float(day['Total']['UnblendedCost']['Amount'])
-                       for day in trend_current['ResultsByTime'])
+        offsets = [0.0] * 7
+        if seasonal:
+            # Weekday means around the overall mean; whole weeks give each weekday fit_days / 7 rows
+            start = first_fitted.weekday()
+            for offset in range(7):
+                offsets[(start + offset) % 7] = sum(ys[offset::7]) * 7 / fit_days - mean
 
-    previous_total = sum(float(day['Total']['UnblendedCost']['Amount'])
-                        for day in trend_previous['ResultsByTime'])
+        # Least-squares trend of the deseasonalized series; the offsets sum to zero over whole weeks
+        deseasonalized = array('d', map(operator.sub, ys, map(offsets.__getitem__, fit_weekdays)))
+        slope = (sum(map(operator.mul, xs, deseasonalized)) - x_mean * total) / sxx
+        level = mean + slope * (fit_days - 1 - x_mean)
+        sum_squares = sum(map(operator.mul, deseasonalized, deseasonalized)) - fit_days * mean * mean
+        variance = max(0.0, sum_squares - slope * slope * sxx) / dof
+
+        projected = [
+            max(0.0, level + slope * trend + offsets[weekday])
+            for trend, weekday in zip(trend_steps, step_weekdays)
+        ]
+        month_end = month_to_date + sum(projected[month_from:next_from])
+        next_month = sum(projected[next_from:])
+
+        month_variance += variance * (next_from - month_from)
+        next_variance += variance * (horizon - next_from)
+        run_rate += max(0.0, level)
+        services.append({
+            'service': service_name,
+            'month_to_date': month_to_date,
+            'month_end': month_end,
+            'next_month': next_month,
+            'daily_run_rate': max(0.0, level)
+        })
+
+    services.sort(key=lambda service: service['month_end'], reverse=True)
+    month_to_date = sum(service['month_to_date'] for service in services)
+    month_end = sum(service['month_end'] for service in services)
+    next_month = sum(service['next_month'] for service in services)
+    month_margin = FORECAST_Z * month_variance ** 0.5
+    next_margin = FORECAST_Z * next_variance ** 0.5
+
+    return {
+        'month': month_start.strftime('%Y-%m'),
+        'next_month': next_start.strftime('%Y-%m'),
+        'fit_days': fit_days,
+        'month_to_date': month_to_date,
+        'month_end': month_end,
+        'month_end_low': max(month_to_date, month_end - month_margin),
+        'month_end_high': month_end + month_margin,
+        'next_month_total': next_month,
+        'next_month_low': max(0.0, next_month - next_margin),
+        'next_month_high': next_month + next_margin,
+        'daily_run_rate': run_rate,
+        'services': services
+    }
+
+def fetch_daily_costs(ce_client, days, cost_store=None, max_workers=1, comparisons=(), stop_at=None, run_id=None):
+    """
+    Fetch daily costs per service for the current and previous windows.
+
+    When a cost history store is given, only the days it is missing (or that
+    may still change) are fetched and the rest are read from the store.
+    The missing ranges are fetched concurrently with up to max_workers
+    threads. Returns the plan, the cost matrix and the number of API calls.
+
+    With a store, the fetch stops between pages once stop_at passes and
+    leaves a cursor in the store, sets plan['incomplete'] and is picked up
+    from the cursor by the next call. A store already fetched by run_id is
+    not fetched again.
+    """
+    plan = plan_cost_queries(days, comparisons=comparisons)
+    cursor = None
+
+    if cost_store is not None:
+        cursor = load_fetch_cursor(cost_store, plan['end_date'])
+        if cursor is not None:
+            plan['queries'] = cursor['queries']
+        else:
+            fetched_run = cost_store.execute("SELECT value FROM store_meta WHERE key = 'fetched_run'").fetchone()
+            if run_id is not None and fetched_run is not None and fetched_run[0] == run_id:
+                missing_ranges = []
+            else:
+                missing_ranges = find_missing_ranges(cost_store, plan['history_start'], plan['end_date'])
+            plan = plan_cost_queries(days, missing_ranges, comparisons)
+
+    stats = {'api_calls': 0}
+    pending = []
+    pages = iter_cost_pages(ce_client, plan['queries'], stats, max_workers,
+                            stop_at if cost_store is not None else None, pending)
+
+    if cost_store is not None:
+        replaced_days = save_cost_history(cost_store, pages, cursor['replaced_days'] if cursor else None)
+        save_fetch_cursor(cost_store, plan['end_date'], pending, replaced_days)
+        if run_id is not None and not pending:
+            cost_store.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('fetched_run', ?)", (run_id,))
+            cost_store.commit()
+        cost_matrix = load_cost_history(cost_store, plan['history_start'], plan['end_date'])
+    else:
+        cost_matrix = CostMatrix(plan['history_start'], plan['end_date'])
+        for results_by_time in pages:
+            merge_cost_page(cost_matrix, results_by_time)
+
+    plan['incomplete'] = bool(pending)
+    if pending:
+        print(f"Fetch stopped with {len(pending)} requests left, continuing from the cursor")
+
+    return plan, cost_matrix, stats['api_calls']
+
+def summarize_cost_data(plan, cost_matrix, api_calls):
+    """
+    Derive the report totals, trend, per-service costs and period comparisons from the cost matrix.
+    """
+    start_date = plan['start_date']
+    end_date = plan['end_date']
+
+    cost_index = CostIndex(cost_matrix)
+    current_totals = cost_index.service_totals(start_date, end_date)
+    current_total = sum(current_totals)
+    previous_total = cost_index.total(plan['previous_start'], start_date)
 
     trend_percentage = ((current_total - previous_total) / previous_total * 100) if previous_total > 0 else 0
 
+    print(f"Cost Explorer API calls: {api_calls} (${api_calls * 0.01:.2f})")
+
     return {
-        'daily_data': daily_response,
-        'monthly_data': monthly_response,
+        'cost_matrix': cost_matrix,
+        'cost_index': cost_index,
+        'comparisons': compare_periods(cost_index, plan['comparisons']),
+        'service_totals': dict(zip(cost_matrix.services, current_totals)),
         'start_date': start_date,
         'end_date': end_date,
         'current_total': current_total,
         'previous_total': previous_total,
-        'trend_percentage': trend_percentage
+        'trend_percentage': trend_percentage,
+        'api_calls': api_calls
     }
 
-def get_service_breakdown(ce_client, days):
+def get_cost_data(ce_client, days, cost_store=None, max_workers=1, comparisons=(), stop_at=None, run_id=None):
     """
-    Get cost breakdown by service.
+    Get cost data for the specified period using the Cost Explorer API.
+
+    When the fetch is cut short at stop_at, cost_data['incomplete'] is set
+    and the anomaly detector is left for the invocation that completes it.
     """
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-
-    response = ce_client.get_cost_and_usage(
-        TimePeriod={
-            'Start': start_date,
-            'End': end_date
-        },
-        Granularity='MONTHLY',
-        Metrics=['UnblendedCost'],
-        GroupBy=[
-            {
-                'Type': 'DIMENSION',
-                'Key': 'SERVICE'
-            }
-        ]
-    )
+    plan, cost_matrix, api_calls = fetch_daily_costs(ce_client, days, cost_store, max_workers, comparisons, stop_at, run_id)
+    cost_data = summarize_cost_data(plan, cost_matrix, api_calls)
+    cost_data['incomplete'] = plan['incomplete']
 
-    # Extract service costs from the response
-    service_costs = []
+    # Carry the anomaly detector over between runs when the store is available
+    if plan['incomplete']:
+        cost_data['anomalies'] = []
+    elif cost_store is not None:
+        anomaly_state = load_anomaly_state(cost_store)
+        cost_data['anomalies'] = detect_cost_anomalies(cost_matrix, anomaly_state, plan['open_from'])
+        save_anomaly_state(cost_store, anomaly_state)
+    else:
+        cost_data['anomalies'] = detect_cost_anomalies(cost_matrix, closed_before=plan['open_from'])
 
-    for time_period in response['ResultsByTime']:
-        for group in time_period['Groups']:
-            service_name = group['Keys'][0]
-            amount = float(group['Metrics']['UnblendedCost']['Amount'])
-            service_costs.append({
-                'service': service_name,
-                'cost': amount
-            })
+    return cost_data
+
+def get_organization_cost_data(account_clients, accounts, days, region, max_workers, max_per_account,
+                               deadline=None, cost_store_path='', s3_client=None, state_bucket='', comparisons=(),
+                               stop_at=None, run_id=None):
+    """
+    Get cost data for several accounts through assumed roles and consolidate it into one report.
+
+    Each account keeps its own cost history store. Accounts that fail or miss
+    the deadline are left out and listed in 'failed_accounts'. With stop_at,
+    accounts still fetching when it passes keep a cursor in their store and
+    set cost_data['incomplete']; accounts already fetched by run_id are read
+    from their store without any request.
+    """
+    store_root, store_ext = os.path.splitext(cost_store_path)
+
+    def fetch(account_id, _):
+        ce_client = account_clients.get_client(account_id, 'ce', region)
+        store_path = f"{store_root}-{account_id}{store_ext}" if cost_store_path else ''
+
+        cost_store = open_cost_store(store_path, s3_client, state_bucket) if store_path else None
+        try:
+            # An account's windows share its per-account concurrency cap
+            return fetch_daily_costs(ce_client, days, cost_store, max_per_account, comparisons, stop_at, run_id)
+        finally:
+            if cost_store is not None:
+                close_cost_store(cost_store, store_path, s3_client, state_bucket)
+
+    tasks = [(account_id, 'costs') for account_id in accounts]
+    results, errors = run_scheduled(tasks, fetch, max_workers, max_per_account, deadline)
+
+    plan = plan_cost_queries(days, comparisons=comparisons)
+    cost_matrix = CostMatrix(plan['history_start'], plan['end_date'])
+    account_totals = {}
+    api_calls = 0
+    incomplete = False
 
-    # Sort by cost (descending)
-    service_costs.sort(key=lambda x: x['cost'], reverse=True)
+    for (account_id, _), (account_plan, account_matrix, account_api_calls) in results.items():
+        api_calls += account_api_calls
+        incomplete = incomplete or account_plan['incomplete']
+        cost_matrix.add_matrix(account_matrix)
+        account_totals[account_id] = account_matrix.total(plan['start_date'], plan['end_date'])
 
-    return service_costs[:10]  # Return top 10 services
+    failed_accounts = []
+    for (account_id, _), error in errors.items():
+        if stop_at is not None and isinstance(error, (TimeoutError, DeadlineExceeded)):
+            # Accounts cut short by the deadline are carried on by the continuation
+            incomplete = True
+            continue
+        print(f"Skipping account {account_id}: {error}")
+        failed_accounts.append({'account': account_id, 'error': str(error)})
 
-def get_storage_costs(ce_client, days):
+    cost_data = summarize_cost_data(plan, cost_matrix, api_calls)
+    cost_data['incomplete'] = incomplete
+    cost_data['anomalies'] = [] if incomplete else detect_cost_anomalies(cost_matrix, closed_before=plan['open_from'])
+    cost_data['account_totals'] = account_totals
+    cost_data['failed_accounts'] = failed_accounts
+
+    return cost_data
+
+def get_hourly_costs(ce_client, days, stats, max_workers=1):
     """
-    Get detailed breakdown of storage costs (EBS, S3, etc.)
+    Fetch the hourly costs per service of the last days into an HOURLY cost matrix.
+
+    The range is split into windows of HOURLY_WINDOW_HOURS that are fetched
+    concurrently, and their pages are stitched together by period start.
+    Cost Explorer only has hourly costs for the last 14 days, and only once
+    hourly granularity is enabled in its preferences. API calls are counted
+    in stats['api_calls'].
     """
-    end_date = datetime.now().strftime('%Y-%m-%d')
-    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-
-    # Define storage services to track
-    storage_services = ['Amazon Elastic Block Store', 'Amazon Simple Storage Service',
-                        'Amazon RDS Service', 'Amazon DynamoDB', 'AWS Backup']
-
-    # Create a filter for storage services
-    response = ce_client.get_cost_and_usage(
-        TimePeriod={
-            'Start': start_date,
-            'End': end_date
-        },
-        Granularity='MONTHLY',
-        Metrics=['UnblendedCost'],
-        Filter={
-            'Dimensions': {
-                'Key': 'SERVICE',
-                'Values': storage_services
-            }
-        },
-        GroupBy=[
-            {
-                'Type': 'DIMENSION',
-                'Key': 'SERVICE'
-            }
-        ]
-    )
+    period_format = PERIODS['HOURLY'][0]
+    end = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    # Start an hour inside the 14-day limit, since a start right on it can be rejected
+    start_hour = (end - timedelta(hours=min(days, MAX_HOURLY_DAYS) * 24 - 1)).strftime(period_format)
+    end_hour = end.strftime(period_format)
 
-    # Extract storage costs from the response
-    storage_costs = []
+    cost_matrix = CostMatrix(start_hour, end_hour, 'HOURLY')
+    queries = plan_window_queries(start_hour, end_hour, 'HOURLY', HOURLY_WINDOW_HOURS)
+    for results_by_time in iter_cost_pages(ce_client, queries, stats, max_workers):
+        merge_cost_page(cost_matrix, results_by_time)
 
-    for time_period in response['ResultsByTime']:
-        for group in time_period.get('Groups', []):
-            service_name = group['Keys'][0]
-            amount = float(group['Metrics']['UnblendedCost']['Amount'])
-            storage_costs.append({
-                'service': service_name,
-                'cost': amount
-            })
+    return cost_matrix
+
+def get_hourly_peaks(hourly_costs, n=10):
+    """
+    Return the n most expensive hours, each with the service that cost the most in it.
+    """
+    hour_totals = hourly_costs.day_totals()
+    peaks = []
+    for row in heapq.nlargest(n, range(len(hour_totals)), key=hour_totals.__getitem__):
+        if not hour_totals[row]:
+            break
+        service_index = max(range(len(hourly_costs.columns)), key=lambda index: hourly_costs.columns[index][row])
+        peaks.append({
+            'hour': hourly_costs.dates[row],
+            'cost': hour_totals[row],
+            'service': hourly_costs.services[service_index],
+            'service_cost': hourly_costs.columns[service_index][row]
+        })
+    return peaks
+
+def get_service_breakdown(cost_data):
+    """
+    Get cost breakdown by service.
+    """
+    # Return top 10 services, most expensive first
+    return [
+        {
+            'service': service_name,
+            'cost': amount
+        }
+        for service_name, amount in heapq.nlargest(10, cost_data['service_totals'].items(), key=operator.itemgetter(1))
+    ]
+
+def get_storage_costs(cost_data):
+    """
+    Get detailed breakdown of storage costs (EBS, S3, etc.)
+    """
+    service_totals = cost_data['service_totals']
+
+    storage_costs = [
+        {
+            'service': service_name,
+            'cost': service_totals[service_name]
+        }
+        for service_name in STORAGE_SERVICES
+        if service_name in service_totals
+    ]
 
     # If no storage costs are found
     if len(storage_costs) == 0:
-        # Try without filter to see if there are any storage costs at all
-        try:
-            basic_response = ce_client.get_cost_and_usage(
-                TimePeriod={
-                    'Start': start_date,
-                    'End': end_date
-                },
-                Granularity='MONTHLY',
-                Metrics=['UnblendedCost']
-            )
-            # Just note that no storage costs were found
-            storage_costs = [{
-                'service': 'No specific storage costs found',
-                'cost': 0
-            }]
-        except Exception as e:
-            print(f"Error getting basic cost data: {e}")
-            storage_costs = [{
-                'service': 'Error retrieving storage costs',
-                'cost': 0
-            }]
+        storage_costs = [{
+            'service': 'No specific storage costs found',
+            'cost': 0
+        }]
 
     return storage_costs
 
-def check_budget_alerts(cost_data, budget_threshold):
+def check_budget_alerts(cost_data, budget_threshold, forecast=None, report_period_days=30):
     """
     Check if current spending exceeds budget threshold and generate alerts.
+
+    The threshold applies to the spend of the report period. With a
+    forecast, also warn when this month's projected spend will cross the
+    threshold scaled from report_period_days to the days of the month,
+    before the period's spend actually has.
     """
     current_total = cost_data['current_total']
     alerts = []
@@ -262,6 +1342,17 @@ def check_budget_alerts(cost_data, budget_threshold):
             'message': f'Current spending (${current_total:.2f}) exceeds budget threshold (${budget_threshold:.2f}) by {percentage_over:.1f}%',
             'severity': 'high'
         })
+    elif forecast is not None:
+        year, month = map(int, forecast['month'].split('-'))
+        monthly_budget = budget_threshold * calendar.monthrange(year, month)[1] / report_period_days
+        if forecast['month_end'] > monthly_budget:
+            alerts.append({
+                'type': 'Budget Forecast',
+                'message': f"Spending is projected to reach ${forecast['month_end']:.2f} by the end of {forecast['month']} "
+                           f"(90% range ${forecast['month_end_low']:.2f} to ${forecast['month_end_high']:.2f}), "
+                           f"above the budget threshold for the month (${monthly_budget:.2f})",
+                'severity': 'medium'
+            })
 
     # Check if the trend is significantly increasing
     if cost_data['trend_percentage'] > 20:
@@ -273,53 +1364,466 @@ def check_budget_alerts(cost_data, budget_threshold):
 
     return alerts
 
-def send_cost_report(ses_client, cost_data, service_costs, storage_costs, budget_alerts, sender_email, recipient_emails, region):
+def check_anomaly_alerts(cost_data, max_alerts=10):
     """
-    Send email with cost analysis report.
+    Generate alerts for the largest per-service daily cost anomalies in the report period.
     """
-    # Generate service cost rows for the email
-    service_rows = ""
-    for service in service_costs:
-        service_rows += f"""
-        <tr>
-            <td>{service['service']}</td>
-            <td>${service['cost']:.2f}</td>
-        </tr>
+    anomalies = [anomaly for anomaly in cost_data.get('anomalies', []) if anomaly['day'] >= cost_data['start_date']]
+    alerts = []
+
+    for anomaly in anomalies[:max_alerts]:
+        alerts.append({
+            'type': 'Anomaly',
+            'message': f"{anomaly['service']} cost ${anomaly['cost']:.2f} on {anomaly['day']}, "
+                       f"${anomaly['deviation']:.2f} above its usual ${anomaly['expected']:.2f} per day ({anomaly['z_score']:.1f} standard deviations)",
+            'severity': 'medium'
+        })
+
+    return alerts
+
+def cost_report_records(cost_data, budget_alerts):
+    """
+    Yield the report snapshot records of the alerts, anomalies and service costs, in key order.
+    """
+    for alert_type in sorted({alert['type'] for alert in budget_alerts}):
+        yield ('alert', alert_type), None
+    for anomaly in sorted({(anomaly['service'], anomaly['day']) for anomaly in cost_data.get('anomalies', [])
+                           if anomaly['day'] >= cost_data['start_date']}):
+        yield ('anomaly',) + anomaly, None
+    for service_name, amount in sorted(cost_data['service_totals'].items()):
+        if round(amount, 2):
+            yield ('service', service_name), amount
+
+def diff_cost_report(report_snapshot, cost_data, budget_alerts, tolerance):
+    """
+    Compare the service costs and alerts with the snapshot of the last report sent.
+
+    Returns None when nothing changed materially: no new alert type or
+    anomaly, and no service whose cost moved by more than tolerance (a
+    fraction) and CHANGE_MIN_COST. Otherwise returns the moved services as
+    dicts with their previous and current cost, largest move first.
+    Alerts and anomalies that are gone do not count as changes.
+    """
+    if fingerprint_records(cost_report_records(cost_data, budget_alerts)) == report_snapshot.fingerprint:
+        return None
+
+    new_alerts = False
+    service_changes = []
+    for status, key, previous, amount, _ in report_snapshot.diff(cost_report_records(cost_data, budget_alerts),
+                                                                  tolerance, CHANGE_MIN_COST):
+        if key[0] != 'service':
+            new_alerts = new_alerts or status == 'added'
+        elif status == 'changed' or (amount or previous or 0.0) > CHANGE_MIN_COST:
+            service_changes.append({'service': key[1], 'previous': previous or 0.0, 'cost': amount or 0.0})
+
+    if not new_alerts and not service_changes:
+        return None
+
+    service_changes.sort(key=lambda change: abs(change['cost'] - change['previous']), reverse=True)
+    print(f"Changes since the last report: {len(service_changes)} services moved{', new alerts' if new_alerts else ''}")
+    return service_changes
+
+class CostCube:
+    """
+    Sparse services x members cost cube for the report period, per dimension.
+
+    Every dimension (LINKED_ACCOUNT, USAGE_TYPE or TAG) comes from one Cost
+    Explorer pull grouped by SERVICE and that dimension. Service and member
+    names are interned once into index lists, and the cells of a dimension
+    are parallel arrays of service index, member index and cost, so
+    rollups, slices and top-N drill-downs are scans over flat arrays
+    instead of further API calls.
+    """
+
+    def __init__(self, tag_key=None):
+        self.tag_key = tag_key
+        self.services = []
+        self.service_index = {}
+        self.members = {}
+        self.member_index = {}
+        self.cells = {}
+        self._positions = {}
+
+    @property
+    def dimensions(self):
+        return list(self.cells)
+
+    def add(self, dimension, service_name, member, amount):
+        """
+        Add a cost to the (service, member) cell of a dimension.
         """
+        if dimension not in self.cells:
+            self.members[dimension] = []
+            self.member_index[dimension] = {}
+            self.cells[dimension] = (array('I'), array('I'), array('d'))
+            self._positions[dimension] = {}
 
-    # Generate storage cost rows for the email
-    storage_rows = ""
-    for storage in storage_costs:
-        storage_rows += f"""
-        <tr>
-            <td>{storage['service']}</td>
-            <td>${storage['cost']:.2f}</td>
-        </tr>
+        service = self.service_index.get(service_name)
+        if service is None:
+            service = self.service_index[service_name] = len(self.services)
+            self.services.append(service_name)
+
+        member_index = self.member_index[dimension]
+        index = member_index.get(member)
+        if index is None:
+            index = member_index[member] = len(self.members[dimension])
+            self.members[dimension].append(member)
+
+        services, members, amounts = self.cells[dimension]
+        positions = self._positions[dimension]
+        position = positions.get((service, index))
+        if position is None:
+            positions[(service, index)] = len(amounts)
+            services.append(service)
+            members.append(index)
+            amounts.append(amount)
+        else:
+            # Periods spanning two months return the same cell twice
+            amounts[position] += amount
+
+    def rollup(self, dimension):
+        """
+        Return the total cost of each member of a dimension across all services.
+        """
+        if dimension not in self.cells:
+            return {}
+        _, members, amounts = self.cells[dimension]
+        totals = array('d', [0.0]) * len(self.members[dimension])
+        for member, amount in zip(members, amounts):
+            totals[member] += amount
+        return dict(zip(self.members[dimension], totals))
+
+    def slice(self, dimension, member):
+        """
+        Return the cost of each service for one member of a dimension.
+        """
+        index = self.member_index.get(dimension, {}).get(member)
+        if index is None:
+            return {}
+        services, members, amounts = self.cells[dimension]
+        return {
+            self.services[service]: amount
+            for service, cell_member, amount in zip(services, members, amounts)
+            if cell_member == index
+        }
+
+    def top(self, dimension, n):
+        """
+        Return the n most expensive members of a dimension as (member, cost) pairs.
+        """
+        return heapq.nlargest(n, self.rollup(dimension).items(), key=operator.itemgetter(1))
+
+    def drill_down(self, dimension, n, service_name=None):
+        """
+        Return the n most expensive cells of a dimension as (member, service, cost) tuples,
+        optionally within one service.
+        """
+        if dimension not in self.cells:
+            return []
+        services, members, amounts = self.cells[dimension]
+        service = None if service_name is None else self.service_index.get(service_name, -1)
+        positions = (
+            position for position in range(len(amounts))
+            if service is None or services[position] == service
+        )
+        return [
+            (self.members[dimension][members[position]], self.services[services[position]], amounts[position])
+            for position in heapq.nlargest(n, positions, key=amounts.__getitem__)
+        ]
+
+    def iter_cells(self):
+        """
+        Yield every cell as a (dimension, member, service, cost) tuple.
         """
+        for dimension, (services, members, amounts) in self.cells.items():
+            dimension_members = self.members[dimension]
+            for service, member, amount in zip(services, members, amounts):
+                yield dimension, dimension_members[member], self.services[service], amount
+
+def plan_cube_queries(start_date, end_date, dimensions, tag_key=None):
+    """
+    Plan one MONTHLY Cost Explorer pull per cube dimension, grouped by SERVICE and the dimension.
+
+    Cost Explorer only groups by one tag, so TAG uses a single key and is
+    skipped when there is none.
+    """
+    queries = {}
+    for dimension in dimensions:
+        if dimension == 'TAG':
+            if not tag_key:
+                continue
+            group = {'Type': 'TAG', 'Key': tag_key}
+        else:
+            group = {'Type': 'DIMENSION', 'Key': dimension}
+
+        queries[dimension] = {
+            'TimePeriod': {'Start': start_date, 'End': end_date},
+            'Granularity': 'MONTHLY',
+            'Metrics': ['UnblendedCost'],
+            'GroupBy': [
+                {'Type': 'DIMENSION', 'Key': 'SERVICE'},
+                group
+            ]
+        }
+
+    return queries
+
+def get_cost_cube(ce_client, start_date, end_date, dimensions, tag_key, stats, max_workers=1):
+    """
+    Build the cost cube for the report period from one pull per dimension.
+
+    The pulls are fetched concurrently and API calls are counted in
+    stats['api_calls']. Untagged costs are kept under the UNTAGGED member.
+    """
+    queries = plan_cube_queries(start_date, end_date, dimensions, tag_key)
+
+    def fetch(query):
+        query_stats = {'api_calls': 0}
+        return list(iter_cost_pages(ce_client, [query], query_stats)), query_stats['api_calls']
+
+    cost_cube = CostCube(tag_key)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(queries)))) as executor:
+        futures = {dimension: executor.submit(fetch, query) for dimension, query in queries.items()}
+
+    for dimension, future in futures.items():
+        pages, api_calls = future.result()
+        stats['api_calls'] += api_calls
+        for results_by_time in pages:
+            for result in results_by_time:
+                for group in result.get('Groups', []):
+                    service_name, member = group['Keys']
+                    if dimension == 'TAG':
+                        # Tag group keys look like 'Team$platform', with an empty value for untagged costs
+                        member = member.split('$', 1)[-1] or UNTAGGED
+                    cost_cube.add(dimension, service_name, member, float(group['Metrics']['UnblendedCost']['Amount']))
+
+    return cost_cube
+
+def get_owner_costs(cost_cube, owners):
+    """
+    Slice the cost of each service for every owner from the cube's TAG dimension.
+    """
+    if cost_cube is None:
+        return {}
+    tag_members = cost_cube.member_index.get('TAG', {})
+    return {owner: cost_cube.slice('TAG', owner) for owner in owners if owner in tag_members}
+
+def send_cost_report(ses_client, cost_data, service_costs, storage_costs, budget_alerts, sender_email, recipient_emails, region,
+                     cost_cube=None, owner_recipients=None, max_workers=8, forecast=None, hourly_costs=None):
+    """
+    Send email with cost analysis report.
+
+    The recipients get the full report, with drill-down sections from
+    cost_cube, the month-end projection from forecast and the peak hours
+    from hourly_costs when given. Owners listed in owner_recipients also get a
+    report of their own services, sliced from the cube's TAG dimension.
+    """
+    with metrics.phase('render'):
+        reports = [dict(
+            render_cost_report(cost_data, service_costs, storage_costs, budget_alerts, region, cost_cube, forecast,
+                               hourly_costs),
+            recipients=recipient_emails
+        )]
+        owner_costs = get_owner_costs(cost_cube, owner_recipients or {})
+        reports.extend(render_owner_cost_reports(owner_costs, owner_recipients, cost_data, region))
+
+    return send_reports(ses_client, sender_email, reports, max_workers)
+
+def send_reports(ses_client, sender_email, reports, max_workers=8):
+    """
+    Deliver rendered reports, logging their message IDs.
+    """
+    try:
+        # Send emails
+        message_ids = deliver_reports(ses_client, sender_email, reports, max_workers)
+        print(f"Email sent! Message IDs: {', '.join(message_ids)}")
+        return True
+
+    except ClientError as e:
+        print(f"Error sending email: {e}")
+        raise
+
+def render_owner_cost_reports(owner_costs, owner_recipients, cost_data, region):
+    """
+    Render a report for every owner in owner_costs that has recipients.
+    """
+    owner_recipients = owner_recipients or {}
+    return [
+        dict(render_owner_cost_report(owner, services, cost_data, region), recipients=owner_recipients[owner])
+        for owner, services in (owner_costs or {}).items()
+        if owner_recipients.get(owner)
+    ]
+
+def render_owner_cost_report(owner, services, cost_data, region):
+    """
+    Render one owner's service costs as a report dict for deliver_reports.
+    """
+    total = sum(services.values())
+    top_services = heapq.nlargest(INLINE_ROWS, services.items(), key=operator.itemgetter(1))
+    service_rows = render_rows(COST_ROW, ({'name': service_name, 'cost': amount} for service_name, amount in top_services))
+
+    html_body = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; color: #333; max-width: 800px; margin: 0 auto;">
+        <h2>AWS Cost Report for {escape(owner)}</h2>
+        <p>Period: {cost_data['start_date']} to {cost_data['end_date']}</p>
+        <p>Total Cost: <strong>${total:.2f}</strong> of ${cost_data['current_total']:.2f} for the whole account</p>
+
+        <h3>Top Services by Cost</h3>
+        <table style="border-collapse: collapse; width: 100%;" border="1" cellpadding="8">
+            <tr>
+                <th>Service</th>
+                <th>Cost</th>
+            </tr>
+            {service_rows}
+        </table>
+
+        <p>All services are listed in {SERVICES_CSV_NAME}. View detailed cost analysis in the <a href="https://{region}.console.aws.amazon.com/cost-management/home">AWS Cost Explorer Console</a>.</p>
+    </body>
+    </html>
+    """
+
+    return {
+        'subject': f"AWS Cost Report for {owner} - ${total:.2f}",
+        'html_body': html_body,
+        'attachment_specs': [(
+            SERVICES_CSV_NAME,
+            ['Service', 'Cost'],
+            lambda: ((service_name, f"{amount:.2f}") for service_name, amount in sorted(services.items(), key=operator.itemgetter(1), reverse=True))
+        )]
+    }
+
+def render_cost_changes_report(cost_data, service_changes, budget_alerts, region):
+    """
+    Render the changes since the last report as a report dict for deliver_reports.
+    """
+    def format_move(change):
+        if change['previous'] > 0:
+            return f"{(change['cost'] - change['previous']) / change['previous'] * 100:+.1f}%"
+        return "new"
+
+    top_changes = service_changes[:INLINE_ROWS]
+    change_rows = render_rows(CHANGE_ROW, (
+        {'name': change['service'], 'previous': change['previous'], 'cost': change['cost'], 'change': format_move(change)}
+        for change in top_changes
+    ))
+    listed_html = ""
+    if len(top_changes) < len(service_changes):
+        listed_html = f"<p>Showing the {len(top_changes)} largest of {len(service_changes)} changes. All of them are listed in {CHANGES_CSV_NAME}.</p>"
+
+    alerts_html = render_rows(ALERT_BOX, (
+        {
+            'color': "red" if alert['severity'] == 'high' else "orange",
+            'type': alert['type'],
+            'message': alert['message']
+        }
+        for alert in budget_alerts
+    ))
+
+    html_body = f"""
+    <html>
+    <body style="font-family: Arial, sans-serif; color: #333; max-width: 800px; margin: 0 auto;">
+        <h2>AWS Cost Report Changes</h2>
+        <p>Period: {cost_data['start_date']} to {cost_data['end_date']}</p>
+        {alerts_html}
+        <p>Total Cost: <strong>${cost_data['current_total']:.2f}</strong> ({cost_data['trend_percentage']:+.1f}% compared to the previous period)</p>
+
+        <h3>Services That Changed Since the Last Report</h3>
+        <table style="border-collapse: collapse; width: 100%;" border="1" cellpadding="8">
+            <tr>
+                <th>Service</th>
+                <th>Last Report</th>
+                <th>Now</th>
+                <th>Change</th>
+            </tr>
+            {change_rows}
+        </table>
+        {listed_html}
+
+        <p>Only the changes since the last report are shown. View detailed cost analysis in the <a href="https://{region}.console.aws.amazon.com/cost-management/home">AWS Cost Explorer Console</a>.</p>
+    </body>
+    </html>
+    """
+
+    return {
+        'subject': f"AWS Cost Report Changes - ${cost_data['current_total']:.2f} ({len(service_changes)} services changed)",
+        'html_body': html_body,
+        'attachment_specs': [(
+            CHANGES_CSV_NAME,
+            ['Service', 'Last Report', 'Now'],
+            lambda: ((change['service'], f"{change['previous']:.2f}", f"{change['cost']:.2f}") for change in service_changes)
+        )]
+    }
+
+def render_cost_report(cost_data, service_costs, storage_costs, budget_alerts, region, cost_cube=None, forecast=None,
+                       hourly_costs=None):
+    """
+    Render the cost analysis report as a report dict for deliver_reports.
+
+    With a cost_cube, the report also breaks the costs down by owner tag,
+    linked account and usage type, and attaches every cube cell. With a
+    forecast, it projects the month-end and next-month spend per service.
+    With hourly_costs, it lists the most expensive hours and attaches the
+    hourly costs of every service.
+    """
+    # Generate service and storage cost rows for the email
+    service_rows = render_rows(COST_ROW, ({'name': service['service'], 'cost': service['cost']} for service in service_costs))
+    storage_rows = render_rows(COST_ROW, ({'name': storage['service'], 'cost': storage['cost']} for storage in storage_costs))
 
     # Generate alert boxes if needed
-    alerts_html = ""
-    if budget_alerts:
-        for alert in budget_alerts:
-            color = "red" if alert['severity'] == 'high' else "orange"
-            alerts_html += f"""
-            <div style="background-color: {color}; color: white; padding: 10px; margin: 10px 0; border-radius: 5px;">
-                <strong>{alert['type']}:</strong> {alert['message']}
-            </div>
-            """
+    alerts_html = render_rows(ALERT_BOX, (
+        {
+            'color': "red" if alert['severity'] == 'high' else "orange",
+            'type': alert['type'],
+            'message': alert['message']
+        }
+        for alert in budget_alerts
+    ))
+
+    # Generate the per-account section for multi-account reports, or from the
+    # cube's linked accounts when the account is an organization's payer
+    accounts_html = ""
+    account_totals = cost_data.get('account_totals') or {}
+    if not account_totals and cost_cube is not None and len(cost_cube.members.get('LINKED_ACCOUNT', ())) > 1:
+        account_totals = cost_cube.rollup('LINKED_ACCOUNT')
+    if account_totals:
+        top_accounts = heapq.nlargest(INLINE_ROWS, account_totals.items(), key=operator.itemgetter(1))
+        account_rows = render_rows(COST_ROW, ({'name': account_id, 'cost': amount} for account_id, amount in top_accounts))
+        listed_html = ""
+        if len(top_accounts) < len(account_totals):
+            listed_html = f"<p>Showing the {len(top_accounts)} most expensive of {len(account_totals)} accounts. All accounts are listed in {ACCOUNTS_CSV_NAME}.</p>"
+        accounts_html = f"""
+            <h3>Costs by Account</h3>
+            <table>
+                <tr>
+                    <th>Account</th>
+                    <th>Cost</th>
+                </tr>
+                {account_rows}
+            </table>
+            {listed_html}
+        """
+
+    if cost_data.get('failed_accounts'):
+        failed_items = "".join(
+            f"<li>{failed['account']}: {escape(failed['error'])}</li>"
+            for failed in cost_data['failed_accounts']
+        )
+        accounts_html += f"""
+            <p>The following accounts could not be queried and are missing from this report:</p>
+            <ul>{failed_items}</ul>
+        """
+
+    cube_html = render_cube_sections(cost_cube) if cost_cube is not None else ""
+    forecast_html = render_forecast_section(forecast) if forecast is not None else ""
+    comparisons = cost_data.get('comparisons') or []
+    comparisons_html = render_comparison_section(comparisons, service_costs, cost_data['cost_matrix'].service_index) if comparisons else ""
+    hourly_html = render_hourly_section(hourly_costs) if hourly_costs is not None else ""
 
     # Calculate trend indicator
     trend_indicator = "↑" if cost_data['trend_percentage'] > 0 else "↓"
     trend_color = "red" if cost_data['trend_percentage'] > 0 else "green"
 
-    # Generate cost trends for charting (simplified as text-based visualization)
-    month_costs = []
-    for month in cost_data['monthly_data']['ResultsByTime']:
-        amount = float(month['Total']['UnblendedCost']['Amount'])
-        month_costs.append(amount)
-
-    trend_values = ", ".join([f"${cost:.2f}" for cost in month_costs])
-
     # Construct email body
     html_body = f"""
     <html>
@@ -390,6 +1894,8 @@ def send_cost_report(ses_client, cost_data, service_costs, storage_costs, budget
                 <p>Previous Period: ${cost_data['previous_total']:.2f}</p>
             </div>
 
+            {forecast_html}
+
             <h3>Top Services by Cost</h3>
             <table>
                 <tr>
@@ -399,6 +1905,14 @@ def send_cost_report(ses_client, cost_data, service_costs, storage_costs, budget
                 {service_rows}
             </table>
 
+            {comparisons_html}
+
+            {hourly_html}
+
+            {accounts_html}
+
+            {cube_html}
+
             <h3>Storage Costs Breakdown</h3>
             <table>
                 <tr>
@@ -417,6 +1931,8 @@ def send_cost_report(ses_client, cost_data, service_costs, storage_costs, budget
                 <li>Review and terminate development/testing resources during off-hours</li>
             </ul>
 
+            <p>The full service totals and daily costs are attached as {SERVICES_CSV_NAME} and {DAILY_CSV_NAME}.</p>
+
             <p>View detailed cost analysis in the <a href="https://{region}.console.aws.amazon.com/cost-management/home">AWS Cost Explorer Console</a>.</p>
         </div>
 
@@ -431,27 +1947,241 @@ def send_cost_report(ses_client, cost_data, service_costs, storage_costs, budget
     trend_text = "increased" if cost_data['trend_percentage'] > 0 else "decreased"
     subject = f"AWS Cost Report - ${cost_data['current_total']:.2f} ({trend_text} by {abs(cost_data['trend_percentage']):.1f}%)"
 
-    try:
-        # Send email
-        response = ses_client.send_email(
-            Source=sender_email,
-            Destination={
-                'ToAddresses': recipient_emails
-            },
-            Message={
-                'Subject': {
-                    'Data': subject
-                },
-                'Body': {
-                    'Html': {
-                        'Data': html_body
-                    }
-                }
-            }
-        )
-        print(f"Email sent! Message ID: {response['MessageId']}")
-        return True
+    # Full service totals and daily costs for the report period
+    cost_matrix = cost_data['cost_matrix']
 
-    except ClientError as e:
-        print(f"Error sending email: {e}")
-        raise
+    def service_csv_rows():
+        totals = cost_matrix.top_services(len(cost_matrix.services), cost_data['start_date'], cost_data['end_date'])
+        for service_name, amount in totals:
+            yield service_name, f"{amount:.2f}"
+
+    def daily_csv_rows():
+        rows = cost_matrix.rows(cost_data['start_date'], cost_data['end_date'])
+        for service_name, column in zip(cost_matrix.services, cost_matrix.columns):
+            for day, amount in zip(cost_matrix.dates[rows], column[rows]):
+                if amount:
+                    yield day, service_name, f"{amount:.2f}"
+
+    attachments = [
+        (SERVICES_CSV_NAME, ['Service', 'Cost'], service_csv_rows),
+        (DAILY_CSV_NAME, ['Date', 'Service', 'Cost'], daily_csv_rows)
+    ]
+    if account_totals:
+        attachments.append((
+            ACCOUNTS_CSV_NAME,
+            ['Account', 'Cost'],
+            lambda: ((account_id, f"{amount:.2f}") for account_id, amount in sorted(account_totals.items(), key=operator.itemgetter(1), reverse=True))
+        ))
+    if comparisons:
+        def comparison_csv_rows():
+            for index, service_name in enumerate(cost_matrix.services):
+                amounts = [
+                    amount
+                    for comparison in comparisons
+                    for amount in (comparison['current_totals'][index], comparison['previous_totals'][index])
+                ]
+                if any(amounts):
+                    yield [service_name] + [f"{amount:.2f}" for amount in amounts]
+
+        attachments.append((
+            COMPARISONS_CSV_NAME,
+            ['Service'] + [f"{comparison['label']} {column}" for comparison in comparisons for column in ('Current', 'Previous')],
+            comparison_csv_rows
+        ))
+    if forecast is not None and forecast['services']:
+        attachments.append((
+            FORECAST_CSV_NAME,
+            ['Service', 'MonthToDate', 'MonthEnd', 'NextMonth', 'DailyRunRate'],
+            lambda: (
+                (service['service'], f"{service['month_to_date']:.2f}", f"{service['month_end']:.2f}",
+                 f"{service['next_month']:.2f}", f"{service['daily_run_rate']:.2f}")
+                for service in forecast['services']
+            )
+        ))
+    if hourly_costs is not None and hourly_costs.services:
+        def hourly_csv_rows():
+            for service_name, column in zip(hourly_costs.services, hourly_costs.columns):
+                for hour, amount in zip(hourly_costs.dates, column):
+                    if amount:
+                        yield hour, service_name, f"{amount:.4f}"
+
+        attachments.append((HOURLY_CSV_NAME, ['Hour (UTC)', 'Service', 'Cost'], hourly_csv_rows))
+    if cost_cube is not None and cost_cube.cells:
+        attachments.append((
+            CUBE_CSV_NAME,
+            ['Dimension', 'Member', 'Service', 'Cost'],
+            lambda: ((dimension, member, service_name, f"{amount:.2f}") for dimension, member, service_name, amount in cost_cube.iter_cells() if amount)
+        ))
+
+    return {
+        'subject': subject,
+        'html_body': html_body,
+        'attachment_specs': attachments
+    }
+
+def format_change(current, previous):
+    """
+    Format a window total with its change from the previous window.
+    """
+    if previous > 0:
+        return f"${current:.2f} ({(current - previous) / previous * 100:+.1f}%)"
+    if current > 0:
+        return f"${current:.2f} (new)"
+    return "$0.00"
+
+def render_comparison_section(comparisons, service_costs, service_index):
+    """
+    Render the period comparison columns for the total and the top services.
+    """
+    row_template = html_row_template('{name}', *(f'{{period_{index}}}' for index in range(len(comparisons))))
+
+    rows = [dict(
+        {f'period_{index}': format_change(comparison['current_total'], comparison['previous_total'])
+         for index, comparison in enumerate(comparisons)},
+        name='All services'
+    )]
+    for service in service_costs:
+        index = service_index[service['service']]
+        rows.append(dict(
+            {f'period_{period}': format_change(comparison['current_totals'][index], comparison['previous_totals'][index])
+             for period, comparison in enumerate(comparisons)},
+            name=service['service']
+        ))
+
+    headers = "".join(f"<th>{escape(comparison['label'])}</th>" for comparison in comparisons)
+    windows = "".join(
+        f"<li>{escape(comparison['label'])}: {comparison['current'][0]} to {comparison['current'][1]} "
+        f"compared with {comparison['previous'][0]} to {comparison['previous'][1]}</li>"
+        for comparison in comparisons
+    )
+
+    return f"""
+            <h3>Period Comparisons</h3>
+            <table>
+                <tr>
+                    <th>Service</th>
+                    {headers}
+                </tr>
+                {render_rows(row_template, rows)}
+            </table>
+            <p>Every service's window totals are listed in {COMPARISONS_CSV_NAME}.</p>
+            <ul>{windows}</ul>
+    """
+
+def render_forecast_section(forecast):
+    """
+    Render the month-end and next-month projection with the most expensive services.
+    """
+    top_services = forecast['services'][:10]
+    forecast_rows = render_rows(FORECAST_ROW, (
+        {
+            'name': service['service'],
+            'month_to_date': service['month_to_date'],
+            'month_end': service['month_end'],
+            'next_month': service['next_month']
+        }
+        for service in top_services
+    ))
+    listed_html = ""
+    if len(top_services) < len(forecast['services']):
+        listed_html = f"<p>Showing the {len(top_services)} services with the highest projected spend. All services are listed in {FORECAST_CSV_NAME}.</p>"
+
+    return f"""
+            <div class="summary">
+                <h3>Forecast</h3>
+                <p>Month to date ({forecast['month']}): ${forecast['month_to_date']:.2f}</p>
+                <p>Projected month end: <strong>${forecast['month_end']:.2f}</strong> (90% range ${forecast['month_end_low']:.2f} to ${forecast['month_end_high']:.2f})</p>
+                <p>Projected {forecast['next_month']}: ${forecast['next_month_total']:.2f} (90% range ${forecast['next_month_low']:.2f} to ${forecast['next_month_high']:.2f})</p>
+                <p>Daily run rate: ${forecast['daily_run_rate']:.2f}, fitted on the last {forecast['fit_days']} complete days</p>
+            </div>
+
+            <table>
+                <tr>
+                    <th>Service</th>
+                    <th>Month to Date</th>
+                    <th>Projected Month End</th>
+                    <th>Projected {forecast['next_month']}</th>
+                </tr>
+                {forecast_rows}
+            </table>
+            {listed_html}
+    """
+
+def render_hourly_section(hourly_costs):
+    """
+    Render the most expensive hours with the service behind each one.
+    """
+    peaks = get_hourly_peaks(hourly_costs)
+    if not peaks:
+        return ""
+
+    hourly_rows = render_rows(HOURLY_ROW, (
+        {
+            'hour': peak['hour'][:13].replace('T', ' ') + ':00',
+            'cost': peak['cost'],
+            'service': peak['service'],
+            'service_cost': peak['service_cost']
+        }
+        for peak in peaks
+    ))
+    average = hourly_costs.total() / len(hourly_costs.dates)
+
+    return f"""
+            <h3>Hourly Cost Peaks</h3>
+            <p>Average hourly cost over the last {len(hourly_costs.dates) // 24} days: ${average:.2f}. The {len(peaks)} most expensive hours (UTC):</p>
+            <table>
+                <tr>
+                    <th>Hour</th>
+                    <th>Cost</th>
+                    <th>Top Service</th>
+                    <th>Service Cost</th>
+                </tr>
+                {hourly_rows}
+            </table>
+            <p>Every hour and service is listed in {HOURLY_CSV_NAME}.</p>
+    """
+
+def render_cube_sections(cost_cube):
+    """
+    Render the per-team and top usage type sections from the cost cube.
+    """
+    sections = []
+
+    team_totals = cost_cube.rollup('TAG')
+    if team_totals:
+        top_teams = heapq.nlargest(INLINE_ROWS, team_totals.items(), key=operator.itemgetter(1))
+        team_rows = render_rows(COST_ROW, ({'name': team, 'cost': amount} for team, amount in top_teams))
+        listed_html = ""
+        if len(top_teams) < len(team_totals):
+            listed_html = f"<p>Showing the {len(top_teams)} most expensive of {len(team_totals)} {escape(cost_cube.tag_key)} values. All cube cells are listed in {CUBE_CSV_NAME}.</p>"
+        sections.append(f"""
+            <h3>Costs by {escape(cost_cube.tag_key)}</h3>
+            <table>
+                <tr>
+                    <th>{escape(cost_cube.tag_key)}</th>
+                    <th>Cost</th>
+                </tr>
+                {team_rows}
+            </table>
+            {listed_html}
+        """)
+
+    top_usage = cost_cube.drill_down('USAGE_TYPE', INLINE_ROWS)
+    if top_usage:
+        usage_rows = render_rows(USAGE_ROW, (
+            {'name': usage_type, 'service': service_name, 'cost': amount}
+            for usage_type, service_name, amount in top_usage
+        ))
+        sections.append(f"""
+            <h3>Top Usage Types by Cost</h3>
+            <table>
+                <tr>
+                    <th>Usage Type</th>
+                    <th>Service</th>
+                    <th>Cost</th>
+                </tr>
+                {usage_rows}
+            </table>
+        """)
+
+    return "".join(sections)
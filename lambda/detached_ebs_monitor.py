@@ -1,19 +1,174 @@
-import boto3
 import os
-from datetime import datetime, timezone
+import gzip
+import json
+import heapq
+import operator
+import threading
+import time
+from array import array
+from contextlib import nullcontext
+from datetime import datetime, timezone, timedelta
+from html import escape
 from botocore.exceptions import ClientError
+from aws_common import (CONTINUATION_RESERVE_SECONDS, DeadlineExceeded, api_cache, download_state_file,
+                        get_account_clients, get_continuation, get_deadline, list_target_accounts, metrics,
+                        run_scheduled, start_continuation, upload_state_file)
+from report_email import (INLINE_ROWS, ReportSnapshot, deliver_reports, fingerprint_records, html_row_template, render_rows,
+                          split_by_owner)
+from resource_inventory import (DETECTORS, VOLUME_ACTIVITY_DAYS, ResourceInventory, list_own_snapshots,
+                                register_detector)
+
+# Fallback EBS prices (us-east-1, USD per month) used when no price list file is available.
+# Each dimension maps to (begin, price) tiers: storage per GB, IOPS per provisioned IOPS,
+# throughput per MiB/s and snapshots per GB.
+DEFAULT_EBS_PRICES = {
+    ('gp2', 'storage'): ((0, 0.10),),
+    ('gp3', 'storage'): ((0, 0.08),),
+    ('io1', 'storage'): ((0, 0.125),),
+    ('io2', 'storage'): ((0, 0.125),),
+    ('st1', 'storage'): ((0, 0.045),),
+    ('sc1', 'storage'): ((0, 0.025),),
+    ('standard', 'storage'): ((0, 0.05),),
+    ('gp3', 'iops'): ((0, 0.005),),
+    ('io1', 'iops'): ((0, 0.065),),
+    ('io2', 'iops'): ((0, 0.065), (32000, 0.0455), (64000, 0.03185)),
+    ('gp3', 'throughput'): ((0, 0.04),),
+    (None, 'snapshot'): ((0, 0.05),)
+}
+
+# Hourly prices (us-east-1, USD) of idle resources that are not in the EBS price list;
+# load balancers are priced without capacity units, since an idle one uses almost none
+ELASTIC_IP_HOURLY_PRICE = 0.005
+LOAD_BALANCER_HOURLY_PRICES = {
+    'application': 0.0225,
+    'network': 0.0225,
+    'gateway': 0.0125
+}
+HOURS_PER_MONTH = 730
+
+# IOPS and throughput (MiB/s) included in the gp3 storage price
+GP3_BASELINE_IOPS = 3000
+GP3_BASELINE_THROUGHPUT = 125
+
+# Attached volumes averaging fewer read and write operations a day than this are idle
+IDLE_VOLUME_DAILY_OPS = 100
+
+# EC2 API calls (delivered as CloudTrail events) that change whether a volume is attached,
+# mapped to the volume state they leave behind
+VOLUME_EVENT_STATES = {
+    'CreateVolume': 'available',
+    'DetachVolume': 'available',
+    'AttachVolume': 'in-use',
+    'DeleteVolume': 'deleted'
+}
+
+# Timestamp format used in the volume state store (matches CloudTrail eventTime)
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# CloudTrail LookupEvents only returns the last 90 days of management events
+CLOUDTRAIL_LOOKUP_DAYS = 90
+
+# Seconds between checkpoint saves while a scan is running
+CHECKPOINT_SAVE_SECONDS = 15
+
+# Precompiled rows of the detached volumes table
+VOLUME_ROW = html_row_template(
+    '{volume_id}', '{name}', '{size} GB', '{volume_type}', '{days}', '${cost:.2f}', '{zone}'
+)
+VOLUME_ROW_WITH_ACCOUNT = html_row_template(
+    '{account}', '{volume_id}', '{name}', '{size} GB', '{volume_type}', '{days}', '${cost:.2f}', '{zone}'
+)
+
+# Attachment with every detached volume
+VOLUMES_CSV_NAME = 'detached-volumes.csv.gz'
+VOLUMES_CSV_HEADER = ['Account', 'Region', 'Volume ID', 'Name', 'Size (GB)', 'Type', 'Days Detached',
+                      'Est. Monthly Cost', 'AZ', 'Tags']
+
+# Precompiled rows and attachment of the other waste findings
+FINDING_ROW = html_row_template('{type}', '{resource_id}', '{name}', '{region}', '{details}', '${cost:.2f}')
+FINDING_ROW_WITH_ACCOUNT = html_row_template(
+    '{account}', '{type}', '{resource_id}', '{name}', '{region}', '{details}', '${cost:.2f}'
+)
+FINDINGS_CSV_NAME = 'waste-findings.csv.gz'
+FINDINGS_CSV_HEADER = ['Account', 'Region', 'Type', 'Resource ID', 'Name', 'Details', 'Est. Monthly Cost', 'Tags']
+
+# Separators of the packed tag strings in VolumeTable (tags cannot contain control characters)
+TAG_SEPARATOR = '\x1f'
+TAG_VALUE_SEPARATOR = '\x1e'
+
+# VolumeTable keeps the low 64 bits of a volume ID in one column and the rest in another
+ID_LOW_MASK = (1 << 64) - 1
+
+# Offline AWS Price List file for EBS, bundled next to this module when available
+EBS_PRICE_LIST_PATH = os.environ.get(
+    'EBS_PRICE_LIST_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ebs_price_list.json')
+)
+
+def load_config():
+    """
+    Read the function configuration from the environment variables.
+    """
+    return {
+        'sender_email': os.environ.get('SENDER_EMAIL'),
+        'recipient_emails': os.environ.get('RECIPIENT_EMAILS', '').split(','),
+        'days_threshold': int(os.environ.get('DAYS_THRESHOLD', '7')),
+        'include_snapshots': os.environ.get('INCLUDE_SNAPSHOT_COSTS', 'true').lower() == 'true',
+        'scan_regions': [region.strip() for region in os.environ.get('SCAN_REGIONS', '').split(',') if region.strip()],
+        'target_accounts': [account.strip() for account in os.environ.get('TARGET_ACCOUNTS', '').split(',') if account.strip()],
+        'assume_role_name': os.environ.get('ASSUME_ROLE_NAME', 'aws-cost-optimization-read'),
+        'max_workers': int(os.environ.get('MAX_WORKERS', '8')),
+        'max_per_account': int(os.environ.get('MAX_PER_ACCOUNT', '2')),
+        'track_detach_events': os.environ.get('TRACK_DETACH_EVENTS', 'false').lower() == 'true',
+        'volume_state_path': os.environ.get('VOLUME_STATE_PATH', '/tmp/volume_state.db'),
+        'state_bucket': os.environ.get('STATE_BUCKET', ''),
+        'reconcile_days': int(os.environ.get('RECONCILE_DAYS', '7')),
+        'owner_tag_keys': [key.strip() for key in os.environ.get('OWNER_TAG_KEYS', 'Team,Owner').split(',') if key.strip()],
+        'owner_recipients': json.loads(os.environ.get('OWNER_RECIPIENTS') or '{}'),
+        'volume_types': [volume_type.strip() for volume_type in os.environ.get('VOLUME_TYPES', '').split(',') if volume_type.strip()],
+        'volume_tag_keys': [key.strip() for key in os.environ.get('VOLUME_TAG_KEYS', '').split(',') if key.strip()],
+        'waste_detectors': [name.strip() for name in os.environ.get('WASTE_DETECTORS', '').split(',') if name.strip()],
+        'snapshot_age_days': int(os.environ.get('SNAPSHOT_AGE_DAYS', '90')),
+        'report_changes_only': os.environ.get('REPORT_CHANGES_ONLY', 'false').lower() == 'true',
+        'report_snapshot_path': os.environ.get('REPORT_SNAPSHOT_PATH', '/tmp/volume_report.snapshot.gz'),
+        'max_continuations': int(os.environ.get('MAX_CONTINUATIONS', '3')),
+        'scan_checkpoint_path': os.environ.get('SCAN_CHECKPOINT_PATH', '/tmp/volume_scan.checkpoint.gz')
+    }
+
+# Configuration is read once per container and reused by warm invocations
+CONFIG = load_config()
 
 def lambda_handler(event, context):
     """
-    Lambda function to identify detached EBS volumes and send email alerts.
+    Lambda function to identify detached EBS volumes and other idle resources and send email alerts.
+
+    Every invocation ends with one CloudWatch EMF log line of API and phase metrics.
+    """
+    metrics.reset()
+    try:
+        return monitor_detached_volumes(event, context)
+    finally:
+        metrics.emit(getattr(context, 'function_name', None) or context.invoked_function_arn.split(':')[6])
+
+def monitor_detached_volumes(event, context):
+    """
+    Handle one invocation: apply a volume event, or scan for detached volumes and send the alert.
     """
-    # Environment variables
-    sender_email = os.environ.get('SENDER_EMAIL')
-    recipient_emails = os.environ.get('RECIPIENT_EMAILS', '').split(',')
-    days_threshold = int(os.environ.get('DAYS_THRESHOLD', '7'))
+    sender_email = CONFIG['sender_email']
+    recipient_emails = CONFIG['recipient_emails']
+    days_threshold = CONFIG['days_threshold']
+    include_snapshots = CONFIG['include_snapshots']
+    scan_regions = CONFIG['scan_regions']
+    target_accounts = CONFIG['target_accounts']
+    max_workers = CONFIG['max_workers']
+    max_per_account = CONFIG['max_per_account']
+    volume_state_path = CONFIG['volume_state_path']
+    state_bucket = CONFIG['state_bucket']
+    filters = volume_filters(CONFIG['volume_types'], CONFIG['volume_tag_keys'])
 
-    # Get the AWS region from the Lambda context instead of environment variable
+    # Get the AWS region and account from the Lambda context instead of environment variables
     aws_region = context.invoked_function_arn.split(':')[3]
+    aws_account_id = context.invoked_function_arn.split(':')[4]
 
     if not sender_email or not recipient_emails:
         print("Missing required environment variables: SENDER_EMAIL and RECIPIENT_EMAILS")
@@ -22,14 +177,125 @@ def lambda_handler(event, context):
             'body': 'Missing required environment variables'
         }
 
-    # Initialize AWS clients
-    ec2_client = boto3.client('ec2', region_name=aws_region)
-    ses_client = boto3.client('ses', region_name=aws_region)
+    # Reuse the container's rate-limited AWS clients, stopping retries near the Lambda timeout
+    account_clients = get_account_clients(
+        CONFIG['assume_role_name'] if target_accounts else None,
+        get_deadline(context, reserve_seconds=2)
+    )
+    ec2_client = account_clients.get_client(None, 'ec2', aws_region)
+    ses_client = account_clients.get_client(None, 'ses', aws_region)
+    s3_client = account_clients.get_client(None, 's3', aws_region) if state_bucket else None
 
-    # Find detached EBS volumes
-    detached_volumes = find_detached_volumes(ec2_client, days_threshold)
+    # EC2 volume events only update the tracked detach times
+    if is_volume_event(event):
+        volume_state = open_volume_state(volume_state_path, s3_client, state_bucket)
+        try:
+            applied = apply_volume_event(volume_state, event)
+        finally:
+            close_volume_state(volume_state, volume_state_path, s3_client, state_bucket)
 
-    if not detached_volumes:
+        return {
+            'statusCode': 200,
+            'body': f"{event['detail']['eventName']} event {'applied' if applied else 'ignored'}"
+        }
+
+    with metrics.phase('fetch'):
+        # Resolve the regions to scan, defaulting to the Lambda's own region
+        if not scan_regions:
+            scan_regions = [aws_region]
+        elif scan_regions == ['all']:
+            scan_regions = get_enabled_regions(ec2_client)
+
+        # Fan out to the member accounts, or scan only this account
+        accounts = list_target_accounts(target_accounts) if target_accounts else [None]
+
+        # Find detached EBS volumes, from the tracked detach times when event tracking is enabled
+        if CONFIG['track_detach_events']:
+            volume_state = open_volume_state(volume_state_path, s3_client, state_bucket)
+            try:
+                detached_volumes, failed_scans = find_tracked_detached_volumes(
+                    volume_state,
+                    account_clients,
+                    accounts,
+                    scan_regions,
+                    aws_account_id,
+                    days_threshold,
+                    CONFIG['reconcile_days'],
+                    max_workers,
+                    max_per_account,
+                    get_deadline(context),
+                    include_snapshots,
+                    filters,
+                    aws_region
+                )
+            finally:
+                close_volume_state(volume_state, volume_state_path, s3_client, state_bucket)
+        else:
+            # With a state bucket, a scan that runs out of time is checkpointed and carried on by a new invocation
+            run_id, invocation_count, _ = get_continuation(event)
+            checkpoint = None
+            stop_at = None
+            if state_bucket:
+                checkpoint = ScanCheckpoint(CONFIG['scan_checkpoint_path'], run_id, s3_client, state_bucket,
+                                            resume=invocation_count > 0)
+                if invocation_count < CONFIG['max_continuations']:
+                    stop_at = get_deadline(context, CONTINUATION_RESERVE_SECONDS)
+
+            detached_volumes, failed_scans = scan_for_detached_volumes(
+                account_clients,
+                accounts,
+                scan_regions,
+                days_threshold,
+                max_workers,
+                max_per_account,
+                get_deadline(context),
+                include_snapshots,
+                filters,
+                checkpoint,
+                stop_at
+            )
+
+            if detached_volumes is None:
+                checkpoint.save()
+                start_continuation(account_clients.get_client(None, 'lambda', aws_region), context, run_id, invocation_count)
+                return {
+                    'statusCode': 202,
+                    'body': f'Scan checkpointed, continuing in invocation {invocation_count + 2}'
+                }
+
+        # Run the other waste detectors over one shared inventory of the same accounts and regions
+        findings = []
+        if CONFIG['waste_detectors']:
+            findings, failed_passes = find_waste(
+                account_clients,
+                accounts,
+                scan_regions,
+                CONFIG['waste_detectors'],
+                days_threshold,
+                CONFIG['snapshot_age_days'],
+                max_workers,
+                max_per_account,
+                get_deadline(context)
+            )
+            failed_scans.extend(failed_passes)
+
+    # Only report what changed since the last report that was sent
+    report_volumes, report_findings, removed = detached_volumes, findings, None
+    report_snapshot = None
+    if CONFIG['report_changes_only']:
+        with metrics.phase('aggregate'):
+            report_snapshot = ReportSnapshot(CONFIG['report_snapshot_path'], s3_client, state_bucket, snapshot_order)
+            changes = diff_volume_report(report_snapshot, detached_volumes, findings, failed_scans)
+
+        if changes is None:
+            print("No changes since the last report.")
+            return {
+                'statusCode': 200,
+                'body': 'No changes since the last report'
+            }
+        report_volumes, report_findings, removed = changes
+
+    if not report_volumes and not report_findings and not removed:
         print("No detached volumes found.")
         return {
             'statusCode': 200,
@@ -37,52 +303,384 @@ def lambda_handler(event, context):
         }
 
     # Send email alert
-    send_email_alert(ses_client, detached_volumes, sender_email, recipient_emails, aws_region)
+    send_email_alert(
+        ses_client,
+        report_volumes,
+        sender_email,
+        recipient_emails,
+        aws_region,
+        failed_scans,
+        CONFIG['owner_tag_keys'],
+        CONFIG['owner_recipients'],
+        max_workers,
+        report_findings,
+        removed
+    )
+
+    if report_snapshot is not None:
+        # Keep what the failed scans could not see, so it is not reported as new once they succeed
+        failed_targets = {(scan['AccountId'] or '', scan['Region']) for scan in failed_scans}
+        report_snapshot.save(
+            lambda: volume_report_records(detached_volumes, findings),
+            keep=lambda key: key[1:3] in failed_targets
+        )
+
+    if removed is not None:
+        return {
+            'statusCode': 200,
+            'body': f'Found {len(report_volumes)} new detached volumes, {len(report_findings)} new waste findings and {len(removed)} resolved and sent email alert'
+        }
 
     return {
         'statusCode': 200,
-        'body': f'Found {len(detached_volumes)} detached volumes and sent email alert'
+        'body': f'Found {len(report_volumes)} detached volumes and {len(report_findings)} other waste findings and sent email alert'
     }
 
-def find_detached_volumes(ec2_client, days_threshold):
+def snapshot_order(key):
+    """
+    Sort key of a report snapshot record, with resource IDs ordered by length first like VolumeTable.sort().
+    """
+    return key[:-1] + (len(key[-1]), key[-1])
+
+def finding_key(finding):
+    return ('finding', finding.get('AccountId') or '', finding['Region'], finding['Detector'], finding['ResourceId'])
+
+def volume_report_records(detached_volumes, findings):
+    """
+    Yield the report snapshot records of the findings and volumes, in snapshot_order.
+
+    Only the resource keys are recorded: days detached and costs move every
+    day without the report changing materially.
+    """
+    for finding in sorted(findings, key=lambda finding: snapshot_order(finding_key(finding))):
+        yield finding_key(finding), None
+    for account_id, region, volume_id in detached_volumes.row_keys():
+        yield ('volume', account_id, region, volume_id), None
+
+def diff_volume_report(report_snapshot, detached_volumes, findings, failed_scans):
+    """
+    Compare the volumes and findings with the snapshot of the last report sent.
+
+    Returns None when nothing changed. Otherwise returns the volumes and
+    findings to report with the resources removed since, or everything with
+    removed=None when there is no snapshot yet. Resources in accounts and
+    regions whose scans failed are not reported as removed.
+    """
+    fingerprint = fingerprint_records(volume_report_records(detached_volumes, findings))
+    if fingerprint == report_snapshot.fingerprint:
+        return None
+    if report_snapshot.fingerprint is None:
+        return detached_volumes, findings, None
+
+    failed_targets = {(scan['AccountId'] or '', scan['Region']) for scan in failed_scans}
+    ordered_findings = sorted(findings, key=lambda finding: snapshot_order(finding_key(finding)))
+    added_rows = array('I')
+    added_findings = []
+    removed = []
+
+    for status, key, _, _, index in report_snapshot.diff(volume_report_records(detached_volumes, findings)):
+        if status == 'added':
+            if index < len(ordered_findings):
+                added_findings.append(ordered_findings[index])
+            else:
+                added_rows.append(index - len(ordered_findings))
+        elif status == 'removed' and key[1:3] not in failed_targets:
+            removed.append({
+                'Type': 'volume' if key[0] == 'volume' else key[3],
+                'AccountId': key[1] or None,
+                'Region': key[2],
+                'ResourceId': key[-1]
+            })
+
+    if not added_rows and not added_findings and not removed:
+        return None
+
+    print(f"Changes since the last report: {len(added_rows)} new volumes, {len(added_findings)} new findings, {len(removed)} removed")
+    return detached_volumes.take(added_rows), added_findings, removed
+
+def iter_volume_pages(ec2_client, filters, page_size=500):
+    """
+    Stream describe_volumes results one page at a time, following NextToken.
+    """
+    paginator = ec2_client.get_paginator('describe_volumes')
+
+    for page in paginator.paginate(Filters=filters, PaginationConfig={'PageSize': page_size}):
+        yield page.get('Volumes', [])
+
+def volume_filters(volume_types=(), tag_keys=()):
+    """
+    Build the describe_volumes filters for available volumes, optionally of the given types or tag keys.
+
+    EC2 applies these server-side, so volumes outside them are never sent.
+    """
+    filters = [{'Name': 'status', 'Values': ['available']}]
+    if volume_types:
+        filters.append({'Name': 'volume-type', 'Values': list(volume_types)})
+    if tag_keys:
+        filters.append({'Name': 'tag-key', 'Values': list(tag_keys)})
+    return filters
+
+def get_enabled_regions(ec2_client):
+    """
+    List the regions enabled for this account.
+    """
+    def load():
+        response = ec2_client.describe_regions(AllRegions=False)
+        return sorted(region['RegionName'] for region in response.get('Regions', []))
+
+    return api_cache.get_or_load(('describe_regions', ec2_client), load)
+
+def scan_for_detached_volumes(account_clients, accounts, regions, days_threshold, max_workers, max_per_account,
+                              deadline=None, include_snapshots=True, filters=None, checkpoint=None, stop_at=None):
+    """
+    Scan every account and region concurrently and merge their detached volumes into one VolumeTable.
+
+    Scans run through run_scheduled, which caps concurrency globally and per
+    account. A scan that fails or misses the deadline is logged and returned
+    in the failed list so the rest still make it into the report.
+
+    With a ScanCheckpoint, finished scans are not repeated and the others
+    resume where they stopped. The checkpoint is saved as pages come in, at
+    most every CHECKPOINT_SAVE_SECONDS, so an invocation killed before its
+    soft stop still leaves its progress behind. When stop_at is set and some scans are still
+    unfinished once it passes, (None, []) is returned so the run can be
+    continued from the checkpoint.
+    """
+    tasks = [(account_id, region) for account_id in accounts for region in regions]
+    if checkpoint is not None:
+        tasks = [task for task in tasks if not checkpoint.progress(*task)['done']]
+
+    def scan(account_id, region):
+        ec2_client = account_clients.get_client(account_id, 'ec2', region)
+        if checkpoint is None:
+            return find_detached_volumes(ec2_client, days_threshold, include_snapshots, filters, account_id)
+        return find_detached_volumes(ec2_client, days_threshold, include_snapshots, filters, account_id,
+                                     checkpoint.progress(account_id, region), stop_at, checkpoint.lock,
+                                     checkpoint.save_if_due)
+
+    results, errors = run_scheduled(tasks, scan, max_workers, max_per_account, deadline)
+
+    if checkpoint is not None:
+        with checkpoint.lock:
+            for task, error in errors.items():
+                # Scans cut short by the deadline are carried on by the continuation
+                if stop_at is None or not isinstance(error, (TimeoutError, DeadlineExceeded)):
+                    # An exception without a message still has to mark the scan as failed
+                    checkpoint.progress(*task).update(done=True, error=str(error) or type(error).__name__)
+
+        pending = [task for task, progress in checkpoint.targets.items() if not progress['done']]
+        if pending and stop_at is not None:
+            print(f"{len(pending)} of {len(checkpoint.targets)} scans unfinished, continuing from the checkpoint")
+            return None, []
+
+        # Everything the run has scanned so far, including the earlier invocations
+        results = {task: progress['table'] for task, progress in checkpoint.targets.items()
+                   if progress['done'] and not progress['error']}
+        errors = {task: progress['error'] or errors.get(task) for task, progress in checkpoint.targets.items()
+                  if progress['error'] or not progress['done']}
+
+    # Merge into the first table, releasing each scan's table as it is copied
+    detached_volumes = None
+    for task in list(results):
+        volumes = results.pop(task)
+        if detached_volumes is None:
+            detached_volumes = volumes
+        else:
+            detached_volumes.extend(volumes)
+    if detached_volumes is None:
+        detached_volumes = VolumeTable(datetime.now(timezone.utc))
+
+    failed_scans = []
+    for (account_id, region), error in errors.items():
+        print(f"Skipping {account_id or 'local account'} in {region}: {error}")
+        failed_scans.append({'AccountId': account_id, 'Region': region, 'Error': str(error)})
+
+    # Keep the report order stable regardless of which scan finished first
+    detached_volumes.sort()
+
+    return detached_volumes, failed_scans
+
+class ScanCheckpoint:
+    """
+    Progress of a volume scan that spans several invocations.
+
+    Each account and region has a progress dict with its VolumeTable so far,
+    the describe_volumes token of its next page, whether its last page has
+    been read, whether it is done and the error that failed it. save()
+    writes them as one gzipped JSON file, synced to S3 when a bucket is set,
+    and the continuation of the run loads it back; a checkpoint left by
+    another run is ignored. save_if_due() saves it from the scans
+    themselves, at most every save_interval seconds.
+    """
+
+    def __init__(self, path, run_id, s3_client=None, bucket='', resume=False, save_interval=CHECKPOINT_SAVE_SECONDS):
+        self.path = path
+        self.run_id = run_id
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.now = datetime.now(timezone.utc)
+        self.targets = {}
+        self.lock = threading.Lock()
+        self.save_interval = save_interval
+        self.saved_at = time.monotonic()
+        # Only one thread writes the file at a time
+        self._save_lock = threading.Lock()
+
+        if not resume:
+            return
+        if s3_client and bucket:
+            download_state_file(s3_client, bucket, path)
+        if not os.path.exists(path):
+            return
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            state = json.load(f)
+        if state['run_id'] != run_id:
+            print(f"Ignoring the checkpoint of run {state['run_id']}")
+            return
+
+        # Volume ages stay measured from when the run started
+        self.now = datetime.fromisoformat(state['now'])
+        for target in state['targets']:
+            self.targets[(target['account_id'], target['region'])] = {
+                'table': VolumeTable.from_state(target['table'], self.now),
+                'next_token': target['next_token'],
+                'pages_done': target['pages_done'],
+                'done': target['done'],
+                'error': target['error']
+            }
+        print(f"Resuming run {run_id}: {sum(progress['done'] for progress in self.targets.values())} "
+              f"of {len(self.targets)} scans done")
+
+    def progress(self, account_id, region):
+        """
+        Return the progress dict of an account and region, starting it if needed.
+        """
+        return self.targets.setdefault((account_id, region), {
+            'table': VolumeTable(self.now),
+            'next_token': None,
+            'pages_done': False,
+            'done': False,
+            'error': None
+        })
+
+    def save_if_due(self):
+        """
+        Save the checkpoint once save_interval has passed since the last save, unless another thread is saving it.
+        """
+        if time.monotonic() - self.saved_at < self.save_interval or not self._save_lock.acquire(blocking=False):
+            return
+        try:
+            self._save()
+        finally:
+            self._save_lock.release()
+
+    def save(self):
+        """
+        Write the progress of every scan and push it to S3.
+        """
+        with self._save_lock:
+            self._save()
+
+    def _save(self):
+        self.saved_at = time.monotonic()
+        with self.lock:
+            state = {
+                'run_id': self.run_id,
+                'now': self.now.isoformat(),
+                'targets': [
+                    {
+                        'account_id': account_id,
+                        'region': region,
+                        'table': progress['table'].to_state(),
+                        'next_token': progress['next_token'],
+                        'pages_done': progress['pages_done'],
+                        'done': progress['done'],
+                        'error': progress['error']
+                    }
+                    for (account_id, region), progress in self.targets.items()
+                ]
+            }
+
+        temp_path = f"{self.path}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+        if self.s3_client and self.bucket:
+            upload_state_file(self.s3_client, self.bucket, self.path)
+
+def get_snapshot_sizes(ec2_client):
+    """
+    Return the snapshot storage (GB) held for each volume owned by this account.
+
+    Snapshots are incremental, so the stored size is estimated as the
+    largest full snapshot of each volume.
+    """
+    def load():
+        snapshot_sizes = {}
+        for snapshot in list_own_snapshots(ec2_client):
+            volume_id = snapshot.get('VolumeId')
+            full_size = snapshot.get('FullSnapshotSizeInBytes')
+            size = full_size / 1024 ** 3 if full_size else snapshot.get('VolumeSize', 0)
+            if size > snapshot_sizes.get(volume_id, 0):
+                snapshot_sizes[volume_id] = size
+
+        return snapshot_sizes
+
+    # The client identifies the account and region
+    return api_cache.get_or_load(('snapshot_sizes', ec2_client), load)
+
+def find_detached_volumes(ec2_client, days_threshold, include_snapshots=True, filters=None, account_id=None,
+                          progress=None, stop_at=None, lock=None, on_progress=None):
     """
     Find EBS volumes that are available (not attached) for more than the specified days.
+
+    Volumes are streamed page by page into a VolumeTable, dropping those
+    under the threshold before anything else is kept, and the rest are
+    priced in one pass at the end.
+
+    With a progress dict from ScanCheckpoint, the scan resumes from its
+    page token into its table, and each page is added together with the
+    token of the next one under lock. Once stop_at (a time.monotonic()
+    deadline) passes, the scan stops between pages and returns None,
+    leaving progress to be carried on by the next invocation. A scan cut
+    off after its last page resumes straight at pricing. on_progress is
+    called outside the lock after every page and once the scan is done.
     """
-    now = datetime.now(timezone.utc)
-    detached_volumes = []
+    if progress is None:
+        progress = {'table': VolumeTable(datetime.now(timezone.utc)), 'next_token': None, 'pages_done': False,
+                    'done': False}
+    detached_volumes = progress['table']
+    cutoff = (detached_volumes.now - timedelta(days=days_threshold)).timestamp()
+    region = ec2_client.meta.region_name
+    lock = lock or nullcontext()
 
     try:
-        # Get all available volumes
-        response = ec2_client.describe_volumes(
-            Filters=[{'Name': 'status', 'Values': ['available']}]
-        )
+        # Stream all available volumes page by page, from where the last invocation stopped
+        params = {'Filters': filters or volume_filters(), 'MaxResults': 500}
+        while not progress['pages_done']:
+            if stop_at is not None and time.monotonic() >= stop_at:
+                print(f"Stopping the scan of {account_id or 'local account'} in {region} to continue later")
+                return None
+
+            if progress['next_token']:
+                params['NextToken'] = progress['next_token']
+            response = ec2_client.describe_volumes(**params)
+            with lock:
+                detached_volumes.add_page(response.get('Volumes', []), region, account_id, cutoff)
+                progress['next_token'] = response.get('NextToken')
+                progress['pages_done'] = not progress['next_token']
+            if on_progress is not None:
+                on_progress()
 
-        # Process each volume
-        for volume in response.get('Volumes', []):
-            volume_id = volume.get('VolumeId')
-            create_time = volume.get('CreateTime')
-            size = volume.get('Size')
-            volume_type = volume.get('VolumeType')
-
-            # Calculate days since creation
-            days_available = (now - create_time).days
-
-            # Calculate monthly cost (estimation)
-            monthly_cost = estimate_volume_cost(size, volume_type)
-
-            # Add volumes that exceed the threshold
-            if days_available >= days_threshold:
-                tags = {tag['Key']: tag['Value'] for tag in volume.get('Tags', [])} if 'Tags' in volume else {}
-
-                detached_volumes.append({
-                    'VolumeId': volume_id,
-                    'Size': size,
-                    'VolumeType': volume_type,
-                    'DaysAvailable': days_available,
-                    'EstimatedMonthlyCost': monthly_cost,
-                    'Tags': tags,
-                    'AvailabilityZone': volume.get('AvailabilityZone')
-                })
+        # Snapshot sizes are only needed when there is something to price
+        snapshot_sizes = get_snapshot_sizes(ec2_client) if include_snapshots and len(detached_volumes) else {}
+        with lock:
+            detached_volumes.price(snapshot_sizes)
+            progress['done'] = True
+        if on_progress is not None:
+            on_progress()
 
         return detached_volumes
 
@@ -90,48 +688,1069 @@ def find_detached_volumes(ec2_client, days_threshold):
         print(f"Error finding detached volumes: {e}")
         raise
 
-def estimate_volume_cost(size, volume_type):
+class VolumeTable:
+    """
+    Compact columnar table of detached volumes.
+
+    Only the fields the report uses are kept. Volume IDs are stored as
+    integers, split into their low 64 bits and the bits above (17-digit
+    IDs take 68), and sizes, IOPS, throughput, detach times and costs live in
+    typed arrays. Volume types, zones, regions and accounts are interned,
+    and each volume's tags are packed into one string, so a volume takes
+    about a hundred bytes instead of a full boto3 dict. Totals, top-N and
+    owner slices work on the columns; rows are only turned into report
+    dicts when they are read by index or iterated.
+    """
+
+    COLUMNS = ('ids', 'id_highs', 'id_widths', 'sizes', 'iops', 'throughputs', 'since', 'costs',
+               'types', 'zones', 'regions', 'accounts')
+
+    def __init__(self, now):
+        self.now = now
+        self.ids = array('Q')
+        self.id_highs = array('B')
+        self.id_widths = array('B')
+        self.sizes = array('I')
+        self.iops = array('I')
+        self.throughputs = array('I')
+        self.since = array('d')
+        self.costs = array('d')
+        self.types = array('H')
+        self.zones = array('H')
+        self.regions = array('H')
+        self.accounts = array('H')
+        self.tags = []
+        self.strings = []
+        self._string_index = {}
+
+    def intern(self, value):
+        index = self._string_index.get(value)
+        if index is None:
+            index = self._string_index[value] = len(self.strings)
+            self.strings.append(value)
+        return index
+
+    def add_volume(self, volume, region, account_id=None, since=None):
+        """
+        Add a volume from its describe_volumes data, available since the given POSIX timestamp
+        (its creation time by default).
+        """
+        volume_hex = volume['VolumeId'][4:]
+        volume_id = int(volume_hex, 16)
+        self.ids.append(volume_id & ID_LOW_MASK)
+        self.id_highs.append(volume_id >> 64)
+        self.id_widths.append(len(volume_hex))
+        self.sizes.append(volume['Size'])
+        self.iops.append(volume.get('Iops') or 0)
+        self.throughputs.append(volume.get('Throughput') or 0)
+        self.since.append(volume['CreateTime'].timestamp() if since is None else since)
+        self.types.append(self.intern(volume['VolumeType']))
+        self.zones.append(self.intern(volume['AvailabilityZone']))
+        self.regions.append(self.intern(region))
+        self.accounts.append(self.intern(account_id))
+        # Sorted by key, so the attachment's tag column is a plain substitution
+        self.tags.append(TAG_SEPARATOR.join(
+            tag['Key'] + TAG_VALUE_SEPARATOR + tag['Value']
+            for tag in sorted(volume.get('Tags', ()), key=operator.itemgetter('Key'))
+        ))
+
+    def add_page(self, volumes, region, account_id, cutoff):
+        """
+        Add the volumes of a describe_volumes page created before cutoff (a POSIX timestamp).
+        """
+        for volume in volumes:
+            created = volume['CreateTime'].timestamp()
+            if created <= cutoff:
+                self.add_volume(volume, region, account_id, created)
+
+    def price(self, snapshot_sizes=None):
+        """
+        Estimate the monthly cost of every volume in one pass over the columns.
+        """
+        pricing = get_ebs_pricing()
+        strings = self.strings
+        self.costs = array('d', (
+            pricing.volume_cost(
+                strings[region], strings[volume_type], size, iops, throughput,
+                snapshot_sizes.get(self.volume_id(row), 0) if snapshot_sizes else 0
+            )
+            for row, (region, volume_type, size, iops, throughput) in enumerate(
+                zip(self.regions, self.types, self.sizes, self.iops, self.throughputs)
+            )
+        ))
+
+    def volume_id(self, row):
+        return f"vol-{self.id_highs[row] << 64 | self.ids[row]:0{self.id_widths[row]}x}"
+
+    def volume_tags(self, row):
+        tags = self.tags[row]
+        return dict(tag.split(TAG_VALUE_SEPARATOR, 1) for tag in tags.split(TAG_SEPARATOR)) if tags else {}
+
+    def tag_value(self, row, key):
+        """
+        Return the value of one tag of a row without unpacking the others, or None.
+        """
+        tags = TAG_SEPARATOR + self.tags[row]
+        start = tags.find(TAG_SEPARATOR + key + TAG_VALUE_SEPARATOR)
+        if start < 0:
+            return None
+        start += len(key) + 2
+        end = tags.find(TAG_SEPARATOR, start)
+        return tags[start:end] if end >= 0 else tags[start:]
+
+    def extend(self, other):
+        """
+        Append the rows of another table.
+        """
+        mapping = array('H', (self.intern(value) for value in other.strings))
+        for name in self.COLUMNS:
+            column = getattr(other, name)
+            if name in ('types', 'zones', 'regions', 'accounts'):
+                column = array('H', (mapping[index] for index in column))
+            getattr(self, name).extend(column)
+        self.tags.extend(other.tags)
+
+    def to_state(self):
+        """
+        Return the columns, strings and tags as plain lists for a checkpoint.
+        """
+        state = {name: getattr(self, name).tolist() for name in self.COLUMNS}
+        state['tags'] = self.tags
+        state['strings'] = self.strings
+        return state
+
+    @classmethod
+    def from_state(cls, state, now):
+        """
+        Rebuild a table saved by to_state().
+        """
+        table = cls(now)
+        for name in cls.COLUMNS:
+            # Checkpoints from before the high ID bits were kept only hold 64-bit IDs
+            values = state[name] if name in state else [0] * len(state['ids'])
+            setattr(table, name, array(getattr(table, name).typecode, values))
+        table.tags = state['tags']
+        table.strings = state['strings']
+        table._string_index = {value: index for index, value in enumerate(table.strings)}
+        return table
+
+    def row_keys(self):
+        """
+        Yield (account ID, region, volume ID) for every row, with '' for the local account.
+        """
+        strings = self.strings
+        for account, region, width, high, low in zip(self.accounts, self.regions, self.id_widths, self.id_highs, self.ids):
+            yield strings[account] or '', strings[region], f"vol-{high << 64 | low:0{width}x}"
+
+    def take(self, rows):
+        """
+        Return a new table with the given rows, in that order.
+        """
+        table = VolumeTable(self.now)
+        table.strings = self.strings
+        table._string_index = self._string_index
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            setattr(table, name, array(column.typecode, (column[row] for row in rows)))
+        table.tags = [self.tags[row] for row in rows]
+        return table
+
+    def sort(self):
+        """
+        Order the rows by account, region and volume ID, in place and one column at a time.
+        """
+        # One integer key per row instead of tuples of strings
+        strings = self.strings
+        ranks = array('H', [0]) * len(strings)
+        for rank, index in enumerate(sorted(range(len(strings)), key=lambda index: strings[index] or '')):
+            ranks[index] = rank
+        keys = [
+            (((ranks[account] << 16 | ranks[region]) << 8 | width) << 72) | high << 64 | low
+            for account, region, width, high, low in zip(self.accounts, self.regions, self.id_widths, self.id_highs, self.ids)
+        ]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        del keys
+
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, (column[row] for row in order)))
+        self.tags = [self.tags[row] for row in order]
+
+    def split_by_owner(self, tag_keys, owners=None):
+        """
+        Split the rows by the value of their first matching owner tag, as tables; untagged rows are left out.
+
+        When owners is given, only rows of those owners are kept.
+        """
+        rows = {}
+        for row in range(len(self)):
+            if not self.tags[row]:
+                continue
+            for key in tag_keys:
+                owner = self.tag_value(row, key)
+                if owner:
+                    if owners is None or owner in owners:
+                        rows.setdefault(owner, []).append(row)
+                    break
+        return {owner: self.take(owner_rows) for owner, owner_rows in rows.items()}
+
+    def total_cost(self):
+        return sum(self.costs)
+
+    def has_accounts(self):
+        return any(self.strings[index] is not None for index in set(self.accounts))
+
+    def top(self, n):
+        """
+        Return the rows of the n most expensive volumes.
+        """
+        return heapq.nlargest(n, range(len(self)), key=self.costs.__getitem__)
+
+    def days_available(self, row):
+        return int((self.now.timestamp() - self.since[row]) // 86400)
+
+    def csv_rows(self, default_region):
+        """
+        Yield the rows of the volumes attachment straight from the columns.
+        """
+        strings = self.strings
+        now = self.now.timestamp()
+        columns = zip(self.ids, self.id_highs, self.id_widths, self.sizes, self.since, self.costs,
+                      self.types, self.zones, self.regions, self.accounts, self.tags)
+        for row, (low, high, width, size, since, cost, volume_type, zone, region, account, tags) in enumerate(columns):
+            yield (
+                strings[account] or '',
+                strings[region] or default_region,
+                f"vol-{high << 64 | low:0{width}x}",
+                self.tag_value(row, 'Name') or '',
+                size,
+                strings[volume_type],
+                int((now - since) // 86400),
+                f"{cost:.2f}",
+                strings[zone],
+                tags.replace(TAG_VALUE_SEPARATOR, '=').replace(TAG_SEPARATOR, ';')
+            )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        if not 0 <= row < len(self):
+            raise IndexError('volume row out of range')
+        strings = self.strings
+        record = {
+            'VolumeId': self.volume_id(row),
+            'Size': self.sizes[row],
+            'VolumeType': strings[self.types[row]],
+            'DaysAvailable': self.days_available(row),
+            'EstimatedMonthlyCost': self.costs[row],
+            'Tags': self.volume_tags(row),
+            'AvailabilityZone': strings[self.zones[row]],
+            'Region': strings[self.regions[row]]
+        }
+        account_id = strings[self.accounts[row]]
+        if account_id is not None:
+            record['AccountId'] = account_id
+        return record
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+def is_volume_event(event):
+    """
+    Check whether the invocation event is a CloudTrail EC2 call that changes a volume's attachment.
+    """
+    if not isinstance(event, dict) or event.get('source') != 'aws.ec2':
+        return False
+    return event.get('detail', {}).get('eventName') in VOLUME_EVENT_STATES
+
+def open_volume_state(path, s3_client=None, bucket=''):
     """
-    Estimate monthly cost of EBS volume (simplified calculation).
-    Prices are approximations and may vary by region.
+    Open the SQLite store of tracked volume states, pulling the latest copy from S3 when a bucket is configured.
+    """
+    # Only needed when event tracking is enabled, so not imported at cold start
+    import sqlite3
+
+    if s3_client and bucket:
+        download_state_file(s3_client, bucket, path)
+
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS volume_state (
+            volume_id TEXT PRIMARY KEY,
+            account_id TEXT NOT NULL,
+            region TEXT NOT NULL,
+            state TEXT NOT NULL,
+            detached_at TEXT,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS volume_state_detached ON volume_state (state, detached_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+def close_volume_state(conn, path, s3_client=None, bucket=''):
+    """
+    Close the volume state store and push it back to S3 if anything changed.
+    """
+    changed = conn.total_changes > 0
+    conn.close()
+
+    if changed and s3_client and bucket:
+        upload_state_file(s3_client, bucket, path)
+
+def apply_volume_event(conn, event):
+    """
+    Record the volume state change described by a CloudTrail event.
+
+    Failed calls and events older than the volume's last recorded change
+    (EventBridge does not guarantee ordering) are ignored. Returns whether
+    the state was updated.
     """
-    # Simplified pricing (USD per GB-month)
-    pricing = {
-        'gp2': 0.10,
-        'gp3': 0.08,
-        'io1': 0.125,
-        'io2': 0.125,
-        'st1': 0.045,
-        'sc1': 0.025,
-        'standard': 0.05
+    detail = event['detail']
+    if detail.get('errorCode'):
+        return False
+
+    event_name = detail['eventName']
+    if event_name == 'CreateVolume':
+        volume_id = (detail.get('responseElements') or {}).get('volumeId')
+    else:
+        volume_id = (detail.get('requestParameters') or {}).get('volumeId')
+    if not volume_id:
+        return False
+
+    event_time = datetime.strptime(detail.get('eventTime') or event['time'], TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+    row = conn.execute("SELECT updated_at FROM volume_state WHERE volume_id = ?", (volume_id,)).fetchone()
+    if row and row[0] > event_time:
+        return False
+
+    state = VOLUME_EVENT_STATES[event_name]
+    conn.execute(
+        "INSERT OR REPLACE INTO volume_state (volume_id, account_id, region, state, detached_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            volume_id,
+            detail.get('recipientAccountId') or event.get('account'),
+            detail.get('awsRegion') or event.get('region'),
+            state,
+            event_time if state == 'available' else None,
+            event_time
+        )
+    )
+    conn.commit()
+    return True
+
+def reconcile_volume_state(conn, available_volumes, scanned_targets, local_account_id, now):
+    """
+    Bring the tracked state of the scanned accounts and regions in line with a full scan.
+
+    Volumes found available keep their tracked detach time. Volumes whose
+    detach event was missed are given the earliest time that is still
+    certain: their creation time on the first reconcile, otherwise the
+    previous reconcile (they were not available then). Everything else
+    tracked for the scanned targets is dropped, since it is attached or gone.
+    """
+    row = conn.execute("SELECT value FROM store_meta WHERE key = 'reconciled_at'").fetchone()
+    previous_reconcile = row[0] if row else None
+    now_str = now.strftime(TIMESTAMP_FORMAT)
+
+    tracked = {
+        volume_id: (state, detached_at)
+        for volume_id, state, detached_at in conn.execute("SELECT volume_id, state, detached_at FROM volume_state")
+    }
+
+    available_ids = set()
+    rows = []
+    for volume in available_volumes:
+        volume_id = volume['VolumeId']
+        available_ids.add(volume_id)
+
+        state, detached_at = tracked.get(volume_id, (None, None))
+        if state != 'available' or not detached_at:
+            detached_at = volume['CreateTime'].strftime(TIMESTAMP_FORMAT)
+            if previous_reconcile and previous_reconcile > detached_at:
+                detached_at = previous_reconcile
+
+        rows.append((volume_id, volume.get('AccountId') or local_account_id, volume['Region'], 'available', detached_at, now_str))
+
+    for account_id, region in scanned_targets:
+        conn.execute(
+            "DELETE FROM volume_state WHERE account_id = ? AND region = ?",
+            (account_id or local_account_id, region)
+        )
+
+    conn.executemany(
+        "INSERT OR REPLACE INTO volume_state (volume_id, account_id, region, state, detached_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('reconciled_at', ?)", (now_str,))
+    conn.commit()
+
+def describe_available_volumes(ec2_client, volume_ids, filters=None):
+    """
+    Describe the given volumes that are still available, in batches of 200 IDs per filter.
+    """
+    volumes = []
+    for start in range(0, len(volume_ids), 200):
+        batch_filters = [{'Name': 'volume-id', 'Values': volume_ids[start:start + 200]}] + (filters or volume_filters())
+        for page in iter_volume_pages(ec2_client, batch_filters):
+            volumes.extend(page)
+    return volumes
+
+def lookup_volume_events(conn, account_clients, targets, now, max_workers, max_per_account, deadline=None):
+    """
+    Apply the volume events of the given accounts and regions, read back from CloudTrail.
+
+    The EventBridge rule only receives the events of the Lambda's own account
+    and region. For every other (account, region), the volume calls made
+    since its last lookup (or in the last CLOUDTRAIL_LOOKUP_DAYS) are read
+    with LookupEvents, one request per event name and page, and applied like
+    the events the rule delivers. Targets whose lookup fails are retried
+    from the same point on the next run.
+    """
+    last_lookups = dict(conn.execute("SELECT key, value FROM store_meta WHERE key LIKE 'events_looked_up:%'"))
+    oldest = now - timedelta(days=CLOUDTRAIL_LOOKUP_DAYS)
+
+    def lookup_key(account_id, region):
+        return f"events_looked_up:{account_id or ''}:{region}"
+
+    def lookup(account_id, region):
+        last_lookup = last_lookups.get(lookup_key(account_id, region))
+        start = max(oldest, datetime.strptime(last_lookup, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)) if last_lookup else oldest
+        cloudtrail_client = account_clients.get_client(account_id, 'cloudtrail', region)
+
+        events = []
+        for event_name in VOLUME_EVENT_STATES:
+            pages = cloudtrail_client.get_paginator('lookup_events').paginate(
+                LookupAttributes=[{'AttributeKey': 'EventName', 'AttributeValue': event_name}],
+                StartTime=start,
+                EndTime=now
+            )
+            for page in pages:
+                events.extend({'detail': json.loads(event['CloudTrailEvent'])} for event in page.get('Events', []))
+        return events
+
+    results, errors = run_scheduled(targets, lookup, max_workers, max_per_account, deadline)
+    for (account_id, region), error in errors.items():
+        print(f"Skipping volume events of {account_id or 'local account'} in {region}: {error}")
+
+    # The store is only written from this thread, oldest events first
+    events = [event for target_events in results.values() for event in target_events]
+    events.sort(key=lambda event: event['detail'].get('eventTime', ''))
+    applied = sum(apply_volume_event(conn, event) for event in events)
+
+    now_str = now.strftime(TIMESTAMP_FORMAT)
+    conn.executemany(
+        "INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)",
+        [(lookup_key(account_id, region), now_str) for account_id, region in results]
+    )
+    conn.commit()
+    print(f"Applied {applied} of {len(events)} volume events looked up in {len(results)} accounts and regions")
+
+def find_tracked_detached_volumes(conn, account_clients, accounts, regions, local_account_id, days_threshold, reconcile_days,
+                                  max_workers, max_per_account, deadline=None, include_snapshots=True, filters=None,
+                                  local_region=None):
+    """
+    Find volumes detached for more than the specified days from the tracked detach times.
+
+    A full scan only runs every reconcile_days (or when nothing has been
+    reconciled yet) to correct the state. Other runs only describe the
+    volumes the state flags, so they cost O(flagged volumes) instead of
+    O(all volumes). The events of accounts and regions other than the local
+    one (local_account_id in local_region) are looked up in CloudTrail first.
+    """
+    now = datetime.now(timezone.utc)
+    remote_targets = [
+        (account_id, region) for account_id in accounts for region in regions
+        if account_id not in (None, local_account_id) or region != local_region
+    ]
+    if remote_targets:
+        lookup_volume_events(conn, account_clients, remote_targets, now, max_workers, max_per_account, deadline)
+
+    row = conn.execute("SELECT value FROM store_meta WHERE key = 'reconciled_at'").fetchone()
+    reconcile_due = not row or row[0] <= (now - timedelta(days=reconcile_days)).strftime(TIMESTAMP_FORMAT)
+
+    details = {}
+    failed_scans = []
+
+    if reconcile_due:
+        available_volumes = []
+
+        def scan(account_id, region):
+            ec2_client = account_clients.get_client(account_id, 'ec2', region)
+            volumes = []
+            for page in iter_volume_pages(ec2_client, filters or volume_filters()):
+                for volume in page:
+                    volume['AccountId'] = account_id
+                    volume['Region'] = region
+                    volumes.append(volume)
+            return volumes
+
+        tasks = [(account_id, region) for account_id in accounts for region in regions]
+        results, errors = run_scheduled(tasks, scan, max_workers, max_per_account, deadline)
+        for volumes in results.values():
+            available_volumes.extend(volumes)
+        for (account_id, region), error in errors.items():
+            print(f"Skipping {account_id or 'local account'} in {region}: {error}")
+            failed_scans.append({'AccountId': account_id, 'Region': region, 'Error': str(error)})
+
+        reconcile_volume_state(conn, available_volumes, list(results), local_account_id, now)
+        details = {volume['VolumeId']: volume for volume in available_volumes}
+
+    # Volumes whose tracked detach time is past the threshold
+    cutoff = (now - timedelta(days=days_threshold)).strftime(TIMESTAMP_FORMAT)
+    flagged = conn.execute(
+        "SELECT volume_id, account_id, region, detached_at FROM volume_state WHERE state = 'available' AND detached_at <= ?",
+        (cutoff,)
+    ).fetchall()
+
+    # Describe flagged volumes that the reconcile scan did not already return
+    to_describe = {}
+    for volume_id, account_id, region, _ in flagged:
+        if volume_id not in details:
+            account_key = None if account_id == local_account_id else account_id
+            to_describe.setdefault((account_key, region), []).append(volume_id)
+
+    def describe(account_id, region):
+        ec2_client = account_clients.get_client(account_id, 'ec2', region)
+        return describe_available_volumes(ec2_client, to_describe[(account_id, region)], filters)
+
+    results, errors = run_scheduled(list(to_describe), describe, max_workers, max_per_account, deadline)
+    for volumes in results.values():
+        details.update((volume['VolumeId'], volume) for volume in volumes)
+    for (account_id, region), error in errors.items():
+        print(f"Skipping {account_id or 'local account'} in {region}: {error}")
+        failed_scans.append({'AccountId': account_id, 'Region': region, 'Error': str(error)})
+
+    # Snapshot sizes are only looked up for the regions that have flagged volumes
+    snapshot_sizes = {}
+    if include_snapshots:
+        snapshot_targets = {
+            (None if account_id == local_account_id else account_id, region)
+            for volume_id, account_id, region, _ in flagged if volume_id in details
+        }
+        results, _ = run_scheduled(
+            list(snapshot_targets),
+            lambda account_id, region: get_snapshot_sizes(account_clients.get_client(account_id, 'ec2', region)),
+            max_workers,
+            max_per_account,
+            deadline
+        )
+        for sizes in results.values():
+            snapshot_sizes.update(sizes)
+
+    detached_volumes = VolumeTable(now)
+    for volume_id, account_id, region, detached_at in flagged:
+        volume = details.get(volume_id)
+        if volume is None:
+            continue
+
+        detached_since = datetime.strptime(detached_at, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+        detached_volumes.add_volume(volume, region, None if account_id == local_account_id else account_id, detached_since)
+
+    detached_volumes.price(snapshot_sizes)
+    detached_volumes.sort()
+
+    return detached_volumes, failed_scans
+
+class EbsPricing:
+    """
+    Indexed EBS price table keyed by (region, volume type, dimension).
+
+    The table is built once, from an offline AWS Price List file when one is
+    available, and each dimension holds sorted (begin, price) tiers. Volume
+    costs are memoized per configuration, since large fleets repeat the same
+    few sizes and types, so the per-volume hot path is a single dict lookup.
+    Regions missing from the file fall back to DEFAULT_EBS_PRICES.
+    """
+
+    # Price list product families mapped to the dimensions priced here
+    PRODUCT_FAMILIES = {
+        'Storage': 'storage',
+        'System Operation': 'iops',
+        'Provisioned Throughput': 'throughput',
+        'Storage Snapshot': 'snapshot'
+    }
+
+    def __init__(self, prices=None):
+        self.prices = {(None,) + key: tiers for key, tiers in DEFAULT_EBS_PRICES.items()}
+        self.prices.update(prices or {})
+        self._memo = {}
+
+    @classmethod
+    def from_price_list(cls, path):
+        """
+        Load EBS prices from an AWS Price List bulk offer file or 'aws pricing get-products' output.
+        """
+        with open(path) as f:
+            price_list = json.load(f)
+
+        if 'PriceList' in price_list:
+            items = [json.loads(item) if isinstance(item, str) else item for item in price_list['PriceList']]
+            offers = ((item['product'], item.get('terms', {}).get('OnDemand', {})) for item in items)
+        else:
+            on_demand = price_list.get('terms', {}).get('OnDemand', {})
+            offers = ((product, on_demand.get(sku, {})) for sku, product in price_list.get('products', {}).items())
+
+        tiers = {}
+        for product, terms in offers:
+            key = cls._price_key(product)
+            if key is None:
+                continue
+
+            for term in terms.values():
+                for dimension in term.get('priceDimensions', {}).values():
+                    price = float(dimension['pricePerUnit'].get('USD', 0))
+                    begin = float(dimension.get('beginRange', 0) or 0)
+
+                    # io2 IOPS tiers are separate usage types rather than ranges
+                    usage_type = product['attributes'].get('usagetype', '')
+                    if usage_type.endswith('.tier2'):
+                        begin = 32000
+                    elif usage_type.endswith('.tier3'):
+                        begin = 64000
+
+                    # Throughput is listed per GiB/s-month, volumes report MiB/s
+                    if key[2] == 'throughput' and dimension.get('unit', '').lower().startswith('gibps'):
+                        price /= 1024
+
+                    tiers.setdefault(key, set()).add((begin, price))
+
+        return cls({key: tuple(sorted(values)) for key, values in tiers.items()})
+
+    @classmethod
+    def _price_key(cls, product):
+        """
+        Return the (region, volume type, dimension) index key for a price list product, or None.
+        """
+        attributes = product.get('attributes', {})
+        dimension = cls.PRODUCT_FAMILIES.get(product.get('productFamily'))
+        region = attributes.get('regionCode')
+
+        if dimension is None or region is None or attributes.get('locationType', 'AWS Region') != 'AWS Region':
+            return None
+
+        if dimension == 'snapshot':
+            # Only standard snapshot storage, not the archive tier
+            if not attributes.get('usagetype', '').endswith('EBS:SnapshotUsage'):
+                return None
+            return (region, None, dimension)
+
+        if dimension == 'iops' and attributes.get('group') != 'EBS IOPS':
+            return None
+
+        volume_type = attributes.get('volumeApiName')
+        if not volume_type:
+            return None
+
+        return (region, volume_type, dimension)
+
+    def _tiered_cost(self, region, volume_type, dimension, quantity):
+        tiers = self.prices.get((region, volume_type, dimension)) or self.prices.get((None, volume_type, dimension))
+        if not tiers or quantity <= 0:
+            return 0.0
+
+        cost = 0.0
+        for index, (begin, price) in enumerate(tiers):
+            end = tiers[index + 1][0] if index + 1 < len(tiers) else quantity
+            if quantity <= begin:
+                break
+            cost += (min(quantity, end) - begin) * price
+
+        return cost
+
+    def volume_cost(self, region, volume_type, size, iops=0, throughput=0, snapshot_gb=0):
+        """
+        Return the monthly cost of a volume, including provisioned IOPS, throughput and snapshots.
+        """
+        key = (region, volume_type, size, iops, throughput, snapshot_gb)
+        cost = self._memo.get(key)
+        if cost is not None:
+            return cost
+
+        # Unknown volume types are priced as gp2
+        storage_type = volume_type if (None, volume_type, 'storage') in self.prices else 'gp2'
+        cost = self._tiered_cost(region, storage_type, 'storage', size)
+
+        if volume_type == 'gp3':
+            cost += self._tiered_cost(region, volume_type, 'iops', (iops or 0) - GP3_BASELINE_IOPS)
+            cost += self._tiered_cost(region, volume_type, 'throughput', (throughput or 0) - GP3_BASELINE_THROUGHPUT)
+        elif volume_type in ('io1', 'io2'):
+            cost += self._tiered_cost(region, volume_type, 'iops', iops or 0)
+
+        cost += self._tiered_cost(region, None, 'snapshot', snapshot_gb)
+
+        cost = round(cost, 2)
+        self._memo[key] = cost
+        return cost
+
+    def snapshot_cost(self, region, snapshot_gb):
+        """
+        Return the monthly cost of snapshot storage.
+        """
+        return round(self._tiered_cost(region, None, 'snapshot', snapshot_gb), 2)
+
+_ebs_pricing = None
+
+def get_ebs_pricing():
+    """
+    Return the process-wide EBS price table, loading the price list file on first use.
+    """
+    global _ebs_pricing
+
+    if _ebs_pricing is None:
+        if os.path.exists(EBS_PRICE_LIST_PATH):
+            _ebs_pricing = EbsPricing.from_price_list(EBS_PRICE_LIST_PATH)
+        else:
+            _ebs_pricing = EbsPricing()
+
+    return _ebs_pricing
+
+def estimate_volume_cost(size, volume_type, region=None, iops=0, throughput=0, snapshot_gb=0):
+    """
+    Estimate monthly cost of EBS volume.
+    Prices come from the offline price list when available, otherwise us-east-1 approximations.
+    """
+    return get_ebs_pricing().volume_cost(region, volume_type, size, iops, throughput, snapshot_gb)
+
+def estimate_snapshot_cost(snapshot_gb, region=None):
+    """
+    Estimate monthly cost of EBS snapshot storage.
+    """
+    return get_ebs_pricing().snapshot_cost(region, snapshot_gb)
+
+def waste_finding(detector, account_id, region, resource_id, resource, details, monthly_cost):
+    """
+    Build the report entry for a waste detector finding.
+    """
+    tags = {tag['Key']: tag['Value'] for tag in resource.get('Tags', [])}
+    finding = {
+        'Detector': detector,
+        'ResourceId': resource_id,
+        'Region': region,
+        'Details': details,
+        'EstimatedMonthlyCost': monthly_cost,
+        'Tags': tags
     }
+    if account_id is not None:
+        finding['AccountId'] = account_id
+    return finding
+
+@register_detector('old_snapshots', 'snapshots')
+def detect_old_snapshots(inventory, settings):
+    """
+    Find snapshots older than snapshot_age_days.
+    """
+    for account_id, region, snapshot_id, snapshot in inventory.resources('snapshots'):
+        age_days = (settings['now'] - snapshot['StartTime']).days
+        if age_days < settings['snapshot_age_days']:
+            continue
+
+        full_size = snapshot.get('FullSnapshotSizeInBytes')
+        size = full_size / 1024 ** 3 if full_size else snapshot.get('VolumeSize', 0)
+        yield waste_finding(
+            'Old snapshot', account_id, region, snapshot_id, snapshot,
+            f"{age_days} days old, {size:.0f} GB", estimate_snapshot_cost(size, region)
+        )
+
+@register_detector('unassociated_addresses', 'addresses')
+def detect_unassociated_addresses(inventory, settings):
+    """
+    Find Elastic IP addresses that are not associated with anything.
+    """
+    for account_id, region, allocation_id, address in inventory.resources('addresses'):
+        if address.get('AssociationId'):
+            continue
+
+        yield waste_finding(
+            'Unassociated Elastic IP', account_id, region, allocation_id, address,
+            address.get('PublicIp', ''), round(ELASTIC_IP_HOURLY_PRICE * HOURS_PER_MONTH, 2)
+        )
+
+@register_detector('idle_load_balancers', 'load_balancers', 'target_groups', 'target_health')
+def detect_idle_load_balancers(inventory, settings):
+    """
+    Find load balancers older than days_threshold with no healthy targets behind them.
+    """
+    target_groups = {}
+    for _, _, group_arn, group in inventory.resources('target_groups'):
+        for lb_arn in group.get('LoadBalancerArns', []):
+            target_groups.setdefault(lb_arn, []).append(group_arn)
+
+    cutoff = settings['now'] - timedelta(days=settings['days_threshold'])
+    for account_id, region, lb_arn, lb in inventory.resources('load_balancers'):
+        if lb.get('State', {}).get('Code') != 'active' or lb['CreatedTime'] > cutoff:
+            continue
+
+        group_arns = target_groups.get(lb_arn, [])
+        healthy = any(
+            target.get('TargetHealth', {}).get('State') == 'healthy'
+            for group_arn in group_arns
+            for target in inventory.get('target_health', group_arn) or []
+        )
+        if healthy:
+            continue
+
+        details = "no healthy targets" if group_arns else "no target groups"
+        lb_type = lb.get('Type', 'application')
+        monthly_cost = round(LOAD_BALANCER_HOURLY_PRICES.get(lb_type, LOAD_BALANCER_HOURLY_PRICES['application']) * HOURS_PER_MONTH, 2)
+        yield waste_finding(
+            'Idle load balancer', account_id, region, lb['LoadBalancerName'], lb,
+            f"{lb_type}, {details}", monthly_cost
+        )
+
+@register_detector('stopped_instances', 'instances', 'instance_volumes')
+def detect_stopped_instances(inventory, settings):
+    """
+    Find instances stopped for more than days_threshold that still pay for their volumes.
+    """
+    for account_id, region, instance_id, instance in inventory.resources('instances'):
+        if instance.get('State', {}).get('Name') != 'stopped':
+            continue
+
+        # The stop time is only recorded in the transition reason, e.g. 'User initiated (2024-01-31 12:00:00 GMT)'
+        reason = instance.get('StateTransitionReason', '')
+        try:
+            stopped_at = datetime.strptime(reason[reason.index('(') + 1:reason.index(')')], '%Y-%m-%d %H:%M:%S %Z')
+            stopped_days = (settings['now'] - stopped_at.replace(tzinfo=timezone.utc)).days
+        except ValueError:
+            stopped_days = None
+        if stopped_days is not None and stopped_days < settings['days_threshold']:
+            continue
+
+        volumes = [
+            inventory.get('instance_volumes', mapping['Ebs']['VolumeId'])
+            for mapping in instance.get('BlockDeviceMappings', []) if 'Ebs' in mapping
+        ]
+        volumes = [volume for volume in volumes if volume is not None]
+        if not volumes:
+            continue
+
+        monthly_cost = sum(
+            estimate_volume_cost(volume['Size'], volume['VolumeType'], region, volume.get('Iops', 0), volume.get('Throughput', 0))
+            for volume in volumes
+        )
+        stopped_text = f"stopped {stopped_days} days" if stopped_days is not None else "stopped"
+        yield waste_finding(
+            'Stopped instance', account_id, region, instance_id, instance,
+            f"{stopped_text}, {len(volumes)} volumes ({sum(volume['Size'] for volume in volumes)} GB)", round(monthly_cost, 2)
+        )
+
+@register_detector('idle_volumes', 'in_use_volumes', 'volume_activity')
+def detect_idle_volumes(inventory, settings):
+    """
+    Find attached volumes older than days_threshold with almost no reads or writes.
+
+    Activity is summed over the last VOLUME_ACTIVITY_DAYS. Volumes without
+    datapoints, such as those of stopped instances, are left out. For
+    provisioned IOPS, the share of them used on average is shown.
+    """
+    cutoff = settings['now'] - timedelta(days=settings['days_threshold'])
+    for account_id, region, volume_id, volume in inventory.resources('in_use_volumes'):
+        if volume['CreateTime'] > cutoff:
+            continue
+
+        activity = inventory.get('volume_activity', volume_id)
+        if not activity or not activity['Datapoints']:
+            continue
+        operations = activity['VolumeReadOps'] + activity['VolumeWriteOps']
+        daily_operations = operations / VOLUME_ACTIVITY_DAYS
+        if daily_operations >= IDLE_VOLUME_DAILY_OPS:
+            continue
+
+        volume_type = volume['VolumeType']
+        iops = volume.get('Iops') or 0
+        details = f"{volume_type}, {volume['Size']} GB, {daily_operations:.0f} operations a day"
+        if volume_type in ('io1', 'io2') or volume_type == 'gp3' and iops > GP3_BASELINE_IOPS:
+            utilization = operations / (VOLUME_ACTIVITY_DAYS * 86400) / iops * 100
+            details += f", {utilization:.2f}% of {iops} provisioned IOPS used"
+        instance_ids = [attachment['InstanceId'] for attachment in volume.get('Attachments', []) if attachment.get('InstanceId')]
+        if instance_ids:
+            details += f", attached to {', '.join(instance_ids)}"
+
+        monthly_cost = estimate_volume_cost(volume['Size'], volume_type, region, iops, volume.get('Throughput') or 0)
+        yield waste_finding('Idle volume', account_id, region, volume_id, volume, details, round(monthly_cost, 2))
+
+def find_waste(account_clients, accounts, regions, detector_names, days_threshold, snapshot_age_days,
+               max_workers, max_per_account, deadline=None):
+    """
+    Run the waste detectors over one shared resource inventory of every account and region.
+
+    Returns the findings, most expensive first, and the describe passes that
+    failed in the failed_scans format.
+    """
+    unknown = [name for name in detector_names if name not in DETECTORS]
+    if unknown:
+        print(f"Ignoring unknown waste detectors: {', '.join(unknown)}")
+
+    inventory = ResourceInventory(account_clients, accounts, regions, max_workers, max_per_account, deadline)
+    findings = inventory.run(
+        [name for name in detector_names if name in DETECTORS],
+        {
+            'now': datetime.now(timezone.utc),
+            'days_threshold': days_threshold,
+            'snapshot_age_days': snapshot_age_days
+        }
+    )
+    return findings, inventory.failed_scans()
+
+def send_email_alert(ses_client, detached_volumes, sender_email, recipient_emails, region, failed_scans=None,
+                     owner_tag_keys=(), owner_recipients=None, max_workers=8, findings=None, removed=None):
+    """
+    Send email alert with details of detached volumes and other waste findings.
+
+    The recipients get every volume and finding. Owners listed in
+    owner_recipients also get the slice whose first matching owner tag
+    names them. When removed is given, the volumes and findings are the
+    ones new since the last report and the alert is rendered as a change
+    report, with the removed resources listed in the recipients' copy.
+    """
+    findings = findings or []
+    with metrics.phase('render'):
+        reports = [dict(
+            render_volume_report(detached_volumes, region, failed_scans, findings=findings, removed=removed),
+            recipients=recipient_emails
+        )]
+
+        owner_recipients = owner_recipients or {}
+        owner_volumes = detached_volumes.split_by_owner(owner_tag_keys, owner_recipients)
+        owner_findings = split_by_owner(findings, owner_tag_keys, owner_recipients)
+        for owner in list(owner_volumes) + [owner for owner in owner_findings if owner not in owner_volumes]:
+            if owner_recipients.get(owner):
+                volumes = owner_volumes.get(owner) or VolumeTable(detached_volumes.now)
+                report = render_volume_report(volumes, region, owner=owner, findings=owner_findings.get(owner),
+                                              removed=None if removed is None else [])
+                reports.append(dict(report, recipients=owner_recipients[owner]))
+
+    try:
+        # Send emails
+        message_ids = deliver_reports(ses_client, sender_email, reports, max_workers)
+        print(f"Email sent! Message IDs: {', '.join(message_ids)}")
+        return True
 
-    rate = pricing.get(volume_type.lower(), 0.10)  # Default to gp2 pricing
-    return round(size * rate, 2)
+    except ClientError as e:
+        print(f"Error sending email: {e}")
+        raise
 
-def send_email_alert(ses_client, detached_volumes, sender_email, recipient_emails, region):
+def render_volume_report(detached_volumes, region, failed_scans=None, owner=None, findings=None, removed=None):
     """
-    Send email alert with details of detached volumes.
+    Render the detached volumes alert as a report dict for deliver_reports.
+
+    The body lists the most expensive volumes and waste findings; the full
+    lists are attached as gzipped CSVs so large inventories stay within the
+    SES message limit. With removed (a list, possibly empty), the report
+    only covers the changes since the last report.
     """
+    findings = findings or []
+    changes_only = removed is not None
+
     # Calculate total cost
-    total_cost = sum(volume['EstimatedMonthlyCost'] for volume in detached_volumes)
-
-    # Generate HTML table for email
-    volume_rows = ""
-    for volume in detached_volumes:
-        name_tag = volume['Tags'].get('Name', 'N/A')
-        volume_rows += f"""
-        <tr>
-            <td>{volume['VolumeId']}</td>
-            <td>{name_tag}</td>
-            <td>{volume['Size']} GB</td>
-            <td>{volume['VolumeType']}</td>
-            <td>{volume['DaysAvailable']}</td>
-            <td>${volume['EstimatedMonthlyCost']:.2f}</td>
-            <td>{volume['AvailabilityZone']}</td>
-        </tr>
+    total_cost = detached_volumes.total_cost() + sum(finding['EstimatedMonthlyCost'] for finding in findings)
+
+    # Only show the account column for multi-account scans
+    multi_account = detached_volumes.has_accounts() or any('AccountId' in finding for finding in findings)
+    account_header = "<th>Account</th>" if multi_account else ""
+    row_template = VOLUME_ROW_WITH_ACCOUNT if multi_account else VOLUME_ROW
+
+    # Generate HTML table for the most expensive volumes
+    top_volumes = [detached_volumes[row] for row in detached_volumes.top(INLINE_ROWS)]
+    volume_rows = render_rows(row_template, (
+        {
+            'account': volume.get('AccountId', 'N/A'),
+            'volume_id': volume['VolumeId'],
+            'name': volume['Tags'].get('Name', 'N/A'),
+            'size': volume['Size'],
+            'volume_type': volume['VolumeType'],
+            'days': volume['DaysAvailable'],
+            'cost': volume['EstimatedMonthlyCost'],
+            'zone': volume['AvailabilityZone']
+        }
+        for volume in top_volumes
+    ))
+
+    listed_html = ""
+    if len(top_volumes) < len(detached_volumes):
+        listed_html = f"<p>Showing the {len(top_volumes)} most expensive of {len(detached_volumes)} volumes. The full list is attached as {VOLUMES_CSV_NAME}.</p>"
+
+    # Other waste findings, most expensive first
+    findings_html = ""
+    if findings:
+        finding_template = FINDING_ROW_WITH_ACCOUNT if multi_account else FINDING_ROW
+        finding_rows = render_rows(finding_template, (
+            {
+                'account': finding.get('AccountId', 'N/A'),
+                'type': finding['Detector'],
+                'resource_id': finding['ResourceId'],
+                'name': finding['Tags'].get('Name', 'N/A'),
+                'region': finding['Region'],
+                'details': finding['Details'],
+                'cost': finding['EstimatedMonthlyCost']
+            }
+            for finding in heapq.nlargest(INLINE_ROWS, findings, key=lambda finding: finding['EstimatedMonthlyCost'])
+        ))
+        findings_listed = ""
+        if len(findings) > INLINE_ROWS:
+            findings_listed = f"<p>Showing the {INLINE_ROWS} most expensive of {len(findings)} findings. The full list is attached as {FINDINGS_CSV_NAME}.</p>"
+        findings_html = f"""
+        <h3>Other Idle Resources</h3>
+        <table>
+            <tr>
+                {account_header}
+                <th>Type</th>
+                <th>Resource</th>
+                <th>Name</th>
+                <th>Region</th>
+                <th>Details</th>
+                <th>Est. Monthly Cost</th>
+            </tr>
+            {finding_rows}
+        </table>
+        {findings_listed}
+        """
+
+    # List scans that failed or timed out so gaps in the report are visible
+    failed_html = ""
+    if failed_scans:
+        failed_items = "".join(
+            f"<li>{scan['AccountId'] or 'This account'} ({scan['Region']}): {escape(scan['Error'])}</li>"
+            for scan in failed_scans
+        )
+        failed_html = f"""
+        <p>The following scans could not be completed and are missing from this report:</p>
+        <ul>{failed_items}</ul>
+        """
+
+    # Resources found in the last report that are gone now
+    removed_html = ""
+    if removed:
+        removed_items = "".join(
+            f"<li>{escape(resource['ResourceId'])} ({escape(resource['Type'])}, "
+            f"{resource['AccountId'] + ', ' if resource['AccountId'] else ''}{resource['Region']})</li>"
+            for resource in removed[:INLINE_ROWS]
+        )
+        more_html = f"<p>And {len(removed) - INLINE_ROWS} more.</p>" if len(removed) > INLINE_ROWS else ""
+        removed_html = f"""
+        <h3>Resolved Since the Last Report</h3>
+        <p>These resources were reported last time and are no longer detached or idle:</p>
+        <ul>{removed_items}</ul>
+        {more_html}
         """
 
+    owner_title = f" for {escape(owner)}" if owner else ""
+    if changes_only:
+        heading = f"Detached EBS Volumes Alert Changes{owner_title}"
+        intro = "The following EBS volumes were found detached for an extended period since the last report:"
+        cost_label = "Estimated Monthly Cost of New Resources"
+    else:
+        heading = f"Detached EBS Volumes Alert{owner_title}"
+        intro = "The following EBS volumes have been detached for an extended period and may be candidates for cleanup:"
+        cost_label = "Total Estimated Monthly Cost"
+
     # Construct email body
     html_body = f"""
     <html>
@@ -159,11 +1778,12 @@ def send_email_alert(ses_client, detached_volumes, sender_email, recipient_email
         </style>
     </head>
     <body>
-        <h2>Detached EBS Volumes Alert</h2>
-        <p>The following EBS volumes have been detached for an extended period and may be candidates for cleanup:</p>
+        <h2>{heading}</h2>
+        <p>{intro}</p>
 
         <table>
             <tr>
+                {account_header}
                 <th>Volume ID</th>
                 <th>Name</th>
                 <th>Size</th>
@@ -174,12 +1794,19 @@ def send_email_alert(ses_client, detached_volumes, sender_email, recipient_email
             </tr>
             {volume_rows}
         </table>
+        {listed_html}
+
+        {findings_html}
+
+        {removed_html}
 
         <div class="summary">
-            <p>Total Estimated Monthly Cost: ${total_cost:.2f}</p>
+            <p>{cost_label}: ${total_cost:.2f}</p>
             <p>Potential Annual Savings: ${total_cost * 12:.2f}</p>
         </div>
 
+        {failed_html}
+
         <p>To clean up these volumes, visit the <a href="https://{region}.console.aws.amazon.com/ec2/v2/home?region={region}#Volumes">EC2 Console</a>.</p>
 
         <p><small>This is an automated message from the AWS Cost Optimization system.</small></p>
@@ -188,29 +1815,43 @@ def send_email_alert(ses_client, detached_volumes, sender_email, recipient_email
     """
 
     # Construct email subject
-    subject = f"[AWS Cost Alert] {len(detached_volumes)} Detached EBS Volumes Found (${total_cost:.2f}/month)"
+    if changes_only:
+        subject = f"[AWS Cost Alert] {len(detached_volumes)} New Detached EBS Volumes"
+        if findings:
+            subject += f" and {len(findings)} New Idle Resources"
+        if removed:
+            subject += f", {len(removed)} Resolved"
+        subject += f" (${total_cost:.2f}/month)"
+    elif findings:
+        subject = f"[AWS Cost Alert] {len(detached_volumes)} Detached EBS Volumes and {len(findings)} Idle Resources Found (${total_cost:.2f}/month)"
+    else:
+        subject = f"[AWS Cost Alert] {len(detached_volumes)} Detached EBS Volumes Found (${total_cost:.2f}/month)"
+    if owner:
+        subject += f" for {owner}"
 
-    try:
-        # Send email
-        response = ses_client.send_email(
-            Source=sender_email,
-            Destination={
-                'ToAddresses': recipient_emails
-            },
-            Message={
-                'Subject': {
-                    'Data': subject
-                },
-                'Body': {
-                    'Html': {
-                        'Data': html_body
-                    }
-                }
-            }
-        )
-        print(f"Email sent! Message ID: {response['MessageId']}")
-        return True
+    # Full volume list, in the report order
+    def volume_csv_rows():
+        return detached_volumes.csv_rows(region)
 
-    except ClientError as e:
-        print(f"Error sending email: {e}")
-        raise
+    def finding_csv_rows():
+        for finding in findings:
+            yield (
+                finding.get('AccountId', ''),
+                finding['Region'],
+                finding['Detector'],
+                finding['ResourceId'],
+                finding['Tags'].get('Name', ''),
+                finding['Details'],
+                f"{finding['EstimatedMonthlyCost']:.2f}",
+                ';'.join(f"{key}={value}" for key, value in sorted(finding['Tags'].items()))
+            )
+
+    attachments = [(VOLUMES_CSV_NAME, VOLUMES_CSV_HEADER, volume_csv_rows)]
+    if findings:
+        attachments.append((FINDINGS_CSV_NAME, FINDINGS_CSV_HEADER, finding_csv_rows))
+
+    return {
+        'subject': subject,
+        'html_body': html_body,
+        'attachment_specs': attachments
+    }
@@ -0,0 +1,356 @@
+"""
+Streaming HTML and CSV rendering for the report emails, sent through SES within its size limit.
+"""
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from html import escape
+from botocore.exceptions import ClientError
+from aws_common import AdaptiveTokenBucket, api_cache, download_state_file, metrics, upload_state_file
+
+# SES rejects messages larger than 10 MB, including base64-encoded attachments
+MAX_SES_MESSAGE_BYTES = 10 * 1024 * 1024
+
+# Room left for the MIME headers and boundaries around the parts
+MIME_OVERHEAD_BYTES = 16 * 1024
+
+# SES accepts at most 50 recipients per message
+MAX_RECIPIENTS_PER_MESSAGE = 50
+
+# Send rate (recipients per second) of an account still in the SES sandbox
+SANDBOX_SEND_RATE = 1.0
+
+# Rows shown inline in the HTML body; the full tables go in the CSV attachments
+INLINE_ROWS = 25
+
+def html_row_template(*cells):
+    """
+    Precompile a table row template from cell format strings, returning its bound format method.
+    """
+    return ('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>\n').format
+
+def render_rows(template, rows):
+    """
+    Render table rows in one pass, escaping every value before it is formatted.
+    """
+    return ''.join(
+        template(**{key: escape(value) if isinstance(value, str) else value for key, value in row.items()})
+        for row in rows
+    )
+
+class CsvAttachment:
+    """
+    Gzipped CSV attachment streamed from an iterable of rows.
+
+    Rows are written straight into the compressor as they are produced, so
+    the uncompressed table is never held in memory. max_rows truncates the
+    table when the message has to be shrunk to fit SES.
+    """
+
+    def __init__(self, filename, header, rows, max_rows=None):
+        self.filename = filename
+        self.row_count = 0
+        self.total_rows = 0
+
+        buffer = io.BytesIO()
+        with gzip.GzipFile(filename=filename[:-3], mode='wb', fileobj=buffer, mtime=0) as gz:
+            text = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(header)
+            for row in rows:
+                self.total_rows += 1
+                if max_rows is None or self.row_count < max_rows:
+                    writer.writerow(row)
+                    self.row_count += 1
+            text.flush()
+            text.detach()
+
+        self.data = buffer.getvalue()
+
+    @property
+    def truncated(self):
+        return self.row_count < self.total_rows
+
+    @property
+    def encoded_size(self):
+        # Base64 turns every 3 bytes into 4 characters plus a line break every 76
+        encoded = (len(self.data) + 2) // 3 * 4
+        return encoded + encoded // 76 * 2
+
+def build_raw_message(sender_email, recipient_emails, subject, html_body, attachments):
+    """
+    Build the MIME message with the HTML body and the gzipped CSV attachments.
+
+    With no recipient_emails the message has no To header, and is only
+    addressed by the SES Destinations it is sent to.
+    """
+    message = MIMEMultipart('mixed')
+    message['Subject'] = subject
+    message['From'] = sender_email
+    if recipient_emails:
+        message['To'] = ', '.join(recipient_emails)
+    message.attach(MIMEText(html_body, 'html', 'utf-8'))
+
+    for attachment in attachments:
+        part = MIMEApplication(attachment.data, 'gzip')
+        part.add_header('Content-Disposition', 'attachment', filename=attachment.filename)
+        message.attach(part)
+
+    return message.as_bytes()
+
+def fit_attachments(html_body, attachment_specs, max_bytes=MAX_SES_MESSAGE_BYTES):
+    """
+    Render the attachments, truncating their rows until the message fits within max_bytes.
+
+    attachment_specs are (filename, header, rows_factory) tuples, where
+    rows_factory returns a fresh row iterator each time it is called. Returns
+    the attachments and the HTML body, with a note added when rows were cut.
+    """
+    max_rows = None
+    while True:
+        attachments = [
+            CsvAttachment(filename, header, rows_factory(), max_rows)
+            for filename, header, rows_factory in attachment_specs
+        ]
+
+        # The HTML part is base64-encoded too
+        size = MIME_OVERHEAD_BYTES + len(html_body.encode('utf-8')) * 4 // 3
+        size += sum(attachment.encoded_size for attachment in attachments)
+        if size <= max_bytes or not any(attachment.row_count for attachment in attachments):
+            break
+
+        # Shrink every table in proportion to the overshoot, with a margin for compression variance
+        largest = max(attachment.row_count for attachment in attachments)
+        max_rows = int(largest * max_bytes / size * 0.9)
+
+    truncated = [attachment for attachment in attachments if attachment.truncated]
+    if truncated:
+        note = ''.join(
+            f'<p><small>{escape(attachment.filename)} was truncated to {attachment.row_count} of '
+            f'{attachment.total_rows} rows to stay within the SES message size limit.</small></p>'
+            for attachment in truncated
+        )
+        html_body = html_body.replace('</body>', note + '</body>', 1)
+
+    return attachments, html_body
+
+def split_by_owner(items, tag_keys, owners=None):
+    """
+    Group items by the value of their first matching owner tag; untagged items are left out.
+
+    When owners is given, only items of those owners are kept.
+    """
+    slices = {}
+    for item in items:
+        tags = item.get('Tags') or {}
+        for key in tag_keys:
+            if tags.get(key):
+                if owners is None or tags[key] in owners:
+                    slices.setdefault(tags[key], []).append(item)
+                break
+    return slices
+
+def format_snapshot_record(key, value):
+    """
+    Format a (key, value) record as a snapshot line; key parts must not contain tabs or newlines.
+    """
+    return '\t'.join(key) + '\t' + ('' if value is None else f"{value:.2f}") + '\n'
+
+def fingerprint_records(records):
+    """
+    Return the SHA-256 fingerprint of a stream of (key, value) records.
+    """
+    digest = hashlib.sha256()
+    for key, value in records:
+        digest.update(format_snapshot_record(key, value).encode('utf-8'))
+    return digest.hexdigest()
+
+class ReportSnapshot:
+    """
+    Fingerprint and content of the last report sent, kept between runs.
+
+    The content is a stream of (key, value) records, where keys are tuples
+    of strings and values are amounts (or None when only the key matters),
+    in the order given by the order function. The snapshot is a gzipped
+    text file, synced to S3 when a bucket is set, whose first line is the
+    fingerprint, so an unchanged report is detected from one line. diff()
+    merges the saved and current streams, so neither is held in memory.
+    """
+
+    def __init__(self, path, s3_client=None, bucket='', order=None):
+        self.path = path
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.order = order or (lambda key: key)
+        self.fingerprint = None
+
+        if s3_client and bucket:
+            download_state_file(s3_client, bucket, path)
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                self.fingerprint = f.readline().strip() or None
+
+    def records(self):
+        """
+        Yield the saved (key, value) records.
+        """
+        if self.fingerprint is None:
+            return
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                *key, value = line.rstrip('\n').split('\t')
+                yield tuple(key), float(value) if value else None
+
+    def diff(self, records, tolerance=0.0, min_change=0.0):
+        """
+        Yield the differences between the saved records and the current ones.
+
+        Each difference is (status, key, previous_value, value, index), where
+        status is 'added', 'removed' or 'changed' and index is the position of
+        the record in the current stream (None when removed). Amounts change
+        when they move by more than tolerance (a fraction of the previous
+        amount) and more than min_change.
+        """
+        order = self.order
+        saved = self.records()
+        previous = next(saved, None)
+
+        for index, (key, value) in enumerate(records):
+            # Everything saved that sorts before this key is gone
+            while previous is not None and order(previous[0]) < order(key):
+                yield 'removed', previous[0], previous[1], None, None
+                previous = next(saved, None)
+
+            if previous is None or order(previous[0]) != order(key):
+                yield 'added', key, None, value, index
+                continue
+
+            previous_value = previous[1]
+            if value is not None and previous_value is not None:
+                change = abs(value - previous_value)
+                if change > min_change and change > tolerance * abs(previous_value):
+                    yield 'changed', key, previous_value, value, index
+            previous = next(saved, None)
+
+        while previous is not None:
+            yield 'removed', previous[0], previous[1], None, None
+            previous = next(saved, None)
+
+    def save(self, records_factory, keep=None):
+        """
+        Save the current records as the new snapshot and push it to S3.
+
+        records_factory returns a fresh record iterator each time it is
+        called: once for the fingerprint and once to write the records.
+        Saved records matching keep are carried over into the new snapshot,
+        so resources that could not be scanned this time are not forgotten.
+        """
+        kept = [] if keep is None else [(key, value) for key, value in self.records() if keep(key)]
+
+        def merged():
+            return heapq.merge(records_factory(), kept, key=lambda record: self.order(record[0]))
+
+        fingerprint = fingerprint_records(merged())
+        temp_path = f"{self.path}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            f.write(fingerprint + '\n')
+            f.writelines(format_snapshot_record(key, value) for key, value in merged())
+        os.replace(temp_path, self.path)
+        self.fingerprint = fingerprint
+
+        if self.s3_client and self.bucket:
+            upload_state_file(self.s3_client, self.bucket, self.path)
+
+def get_send_rate(ses_client):
+    """
+    Return the account's SES maximum send rate, in recipients per second.
+    """
+    def load():
+        try:
+            return ses_client.get_send_quota()['MaxSendRate'] or SANDBOX_SEND_RATE
+        except ClientError as e:
+            print(f"Could not read the SES send quota, assuming the sandbox rate: {e}")
+            return SANDBOX_SEND_RATE
+
+    return api_cache.get_or_load(('get_send_quota', ses_client), load)
+
+def deliver_reports(ses_client, sender_email, reports, max_workers=8, deadline=None):
+    """
+    Send a batch of reports concurrently within the account's SES send rate.
+
+    Each report is a dict with recipients, subject, html_body and
+    attachment_specs (see fit_attachments). Reports with an identical
+    payload are merged and sent once to the union of their recipients, in
+    messages of at most 50 recipients. Merged messages list their
+    recipients only in the SES Destinations, not in a To header, so owners
+    do not see each other's addresses. Every recipient takes a token from
+    a bucket filled at the SES MaxSendRate. Returns the message IDs; the
+    first error is raised once every other message has been attempted.
+    """
+    with metrics.phase('render'):
+        # Merge identical payloads, keeping the first-seen order
+        payloads = {}
+        for report in reports:
+            attachments, html_body = fit_attachments(report['html_body'], report.get('attachment_specs', ()))
+            digest = hashlib.sha256(report['subject'].encode('utf-8') + b'\0' + html_body.encode('utf-8'))
+            for attachment in attachments:
+                digest.update(attachment.filename.encode('utf-8') + b'\0' + attachment.data)
+
+            payload = payloads.setdefault(digest.hexdigest(), {
+                'subject': report['subject'],
+                'html_body': html_body,
+                'attachments': attachments,
+                'recipients': {},
+                'report_count': 0
+            })
+            payload['report_count'] += 1
+            # A dict keeps the recipients unique and in order
+            payload['recipients'].update(dict.fromkeys(report['recipients']))
+
+    messages = [
+        (payload, list(payload['recipients'])[start:start + MAX_RECIPIENTS_PER_MESSAGE])
+        for payload in payloads.values()
+        for start in range(0, len(payload['recipients']), MAX_RECIPIENTS_PER_MESSAGE)
+    ]
+
+    send_bucket = AdaptiveTokenBucket(get_send_rate(ses_client))
+
+    def send(payload, recipients):
+        for _ in recipients:
+            send_bucket.acquire(deadline)
+
+        # Recipients of merged reports are sent blind copies
+        to_emails = recipients if payload['report_count'] == 1 else []
+        response = ses_client.send_raw_email(
+            Source=sender_email,
+            Destinations=recipients,
+            RawMessage={
+                'Data': build_raw_message(sender_email, to_emails, payload['subject'], payload['html_body'], payload['attachments'])
+            }
+        )
+        return response['MessageId']
+
+    with metrics.phase('send'), ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(send, payload, recipients) for payload, recipients in messages]
+
+    message_ids = []
+    errors = []
+    for future in futures:
+        try:
+            message_ids.append(future.result())
+        except Exception as e:
+            errors.append(e)
+
+    print(f"Sent {len(message_ids)} of {len(messages)} messages for {len(reports)} reports")
+    if errors:
+        raise errors[0]
+
+    return message_ids
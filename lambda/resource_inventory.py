@@ -0,0 +1,292 @@
+"""
+Shared in-memory inventory of AWS resources for the waste detectors.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from aws_common import api_cache, run_scheduled
+
+# Snapshot fields kept in the inventory (large accounts hold many snapshots)
+SNAPSHOT_FIELDS = ('SnapshotId', 'VolumeId', 'VolumeSize', 'FullSnapshotSizeInBytes', 'StartTime', 'Description', 'Tags')
+
+# In-use volume fields kept in the inventory
+VOLUME_FIELDS = ('VolumeId', 'Size', 'VolumeType', 'Iops', 'Throughput', 'CreateTime', 'Attachments', 'Tags')
+
+# Volume I/O is summed over this many days, as one datapoint per metric
+VOLUME_ACTIVITY_DAYS = 14
+VOLUME_ACTIVITY_METRICS = ('VolumeReadOps', 'VolumeWriteOps')
+
+# GetMetricData accepts up to 500 metric queries per request; batches are sent this many at a time
+METRIC_QUERIES_PER_REQUEST = 500
+METRIC_REQUEST_WORKERS = 4
+
+# Resource types, mapped to the service they are described with and the types their loader reads
+RESOURCE_TYPES = {
+    'snapshots': ('ec2', ()),
+    'addresses': ('ec2', ()),
+    'instances': ('ec2', ()),
+    'instance_volumes': ('ec2', ('instances',)),
+    'in_use_volumes': ('ec2', ()),
+    'volume_activity': ('cloudwatch', ('in_use_volumes',)),
+    'load_balancers': ('elbv2', ()),
+    'target_groups': ('elbv2', ()),
+    'target_health': ('elbv2', ('target_groups',))
+}
+
+# Registered detectors, by name: (resource types they read, detector function)
+DETECTORS = {}
+
+def register_detector(name, *resource_types):
+    """
+    Register a detector function that finds waste in the given resource types.
+
+    The function is called with the loaded ResourceInventory and a settings
+    dict, and returns finding dicts. Detectors that read the same resource
+    types share one describe pass.
+    """
+    def register(func):
+        DETECTORS[name] = (resource_types, func)
+        return func
+    return register
+
+def paginate(client, operation, result_key, **kwargs):
+    """
+    Yield every item of a paginated describe call.
+    """
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        yield from page.get(result_key, [])
+
+def list_own_snapshots(ec2_client):
+    """
+    Return the snapshots owned by this account, trimmed to SNAPSHOT_FIELDS.
+
+    The list is cached per client, so the snapshot costs of the volume scan
+    and the old snapshot detector share one describe_snapshots pass.
+    """
+    def load():
+        return [
+            {field: snapshot[field] for field in SNAPSHOT_FIELDS if field in snapshot}
+            for snapshot in paginate(ec2_client, 'describe_snapshots', 'Snapshots',
+                                     OwnerIds=['self'], PaginationConfig={'PageSize': 1000})
+        ]
+
+    # The client identifies the account and region
+    return api_cache.get_or_load(('describe_snapshots', ec2_client), load)
+
+def load_snapshots(client, loaded):
+    return ((snapshot['SnapshotId'], snapshot) for snapshot in list_own_snapshots(client))
+
+def load_addresses(client, loaded):
+    # describe_addresses returns every address in one call
+    return ((address.get('AllocationId') or address['PublicIp'], address) for address in client.describe_addresses().get('Addresses', []))
+
+def load_instances(client, loaded):
+    for reservation in paginate(client, 'describe_instances', 'Reservations', PaginationConfig={'PageSize': 1000}):
+        for instance in reservation.get('Instances', []):
+            yield instance['InstanceId'], instance
+
+def load_instance_volumes(client, loaded):
+    """
+    Describe the volumes attached to stopped instances, in batches of 200 instance IDs per filter.
+    """
+    instance_ids = [
+        instance_id for instance_id, instance in loaded['instances'].items()
+        if instance.get('State', {}).get('Name') == 'stopped'
+    ]
+    for start in range(0, len(instance_ids), 200):
+        filters = [{'Name': 'attachment.instance-id', 'Values': instance_ids[start:start + 200]}]
+        for volume in paginate(client, 'describe_volumes', 'Volumes', Filters=filters, PaginationConfig={'PageSize': 500}):
+            yield volume['VolumeId'], volume
+
+def load_in_use_volumes(client, loaded):
+    """
+    Describe the volumes attached to an instance, trimmed to VOLUME_FIELDS.
+    """
+    filters = [{'Name': 'status', 'Values': ['in-use']}]
+    for volume in paginate(client, 'describe_volumes', 'Volumes', Filters=filters, PaginationConfig={'PageSize': 500}):
+        yield volume['VolumeId'], {field: volume[field] for field in VOLUME_FIELDS if field in volume}
+
+def load_volume_activity(client, loaded):
+    """
+    Sum the read and write operations of every in-use volume over the last VOLUME_ACTIVITY_DAYS.
+
+    Each volume takes one metric query per metric, packed 500 queries to a
+    GetMetricData request, and the requests are sent concurrently, so
+    thousands of volumes take a few dozen calls. Each volume maps to its
+    sums and the number of datapoints they were summed from.
+    """
+    volume_ids = list(loaded['in_use_volumes'])
+    if not volume_ids:
+        return
+
+    period = VOLUME_ACTIVITY_DAYS * 86400
+    end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    start = end - timedelta(seconds=period)
+    batch_size = METRIC_QUERIES_PER_REQUEST // len(VOLUME_ACTIVITY_METRICS)
+
+    def fetch(batch):
+        queries = [
+            {
+                'Id': f"m{index}_{metric_index}",
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/EBS',
+                        'MetricName': metric,
+                        'Dimensions': [{'Name': 'VolumeId', 'Value': volume_id}]
+                    },
+                    'Period': period,
+                    'Stat': 'Sum'
+                },
+                'ReturnData': True
+            }
+            for index, volume_id in enumerate(batch)
+            for metric_index, metric in enumerate(VOLUME_ACTIVITY_METRICS)
+        ]
+
+        activity = {volume_id: dict.fromkeys(VOLUME_ACTIVITY_METRICS, 0.0) for volume_id in batch}
+        datapoints = dict.fromkeys(batch, 0)
+        for result in paginate(client, 'get_metric_data', 'MetricDataResults',
+                               MetricDataQueries=queries, StartTime=start, EndTime=end):
+            index, metric_index = map(int, result['Id'][1:].split('_'))
+            volume_id = batch[index]
+            activity[volume_id][VOLUME_ACTIVITY_METRICS[metric_index]] += sum(result.get('Values', []))
+            datapoints[volume_id] += len(result.get('Values', []))
+
+        for volume_id in batch:
+            activity[volume_id]['Datapoints'] = datapoints[volume_id]
+        return activity
+
+    batches = [volume_ids[offset:offset + batch_size] for offset in range(0, len(volume_ids), batch_size)]
+    with ThreadPoolExecutor(max_workers=min(METRIC_REQUEST_WORKERS, len(batches))) as executor:
+        for activity in executor.map(fetch, batches):
+            yield from activity.items()
+
+def load_load_balancers(client, loaded):
+    return ((lb['LoadBalancerArn'], lb) for lb in paginate(client, 'describe_load_balancers', 'LoadBalancers'))
+
+def load_target_groups(client, loaded):
+    return ((group['TargetGroupArn'], group) for group in paginate(client, 'describe_target_groups', 'TargetGroups'))
+
+def load_target_health(client, loaded):
+    """
+    Describe the targets of every target group attached to a load balancer.
+
+    There is no bulk call, so this costs one request per target group.
+    """
+    for group_arn, group in loaded['target_groups'].items():
+        if group.get('LoadBalancerArns'):
+            response = client.describe_target_health(TargetGroupArn=group_arn)
+            yield group_arn, response.get('TargetHealthDescriptions', [])
+
+RESOURCE_LOADERS = {
+    'snapshots': load_snapshots,
+    'addresses': load_addresses,
+    'instances': load_instances,
+    'instance_volumes': load_instance_volumes,
+    'in_use_volumes': load_in_use_volumes,
+    'volume_activity': load_volume_activity,
+    'load_balancers': load_load_balancers,
+    'target_groups': load_target_groups,
+    'target_health': load_target_health
+}
+
+class ResourceInventory:
+    """
+    Resources of every account and region, described once and indexed by ID.
+
+    load() runs one describe pass per resource type per account and region,
+    all at the same time through run_scheduled, and skips types that are
+    already loaded, so detectors that share a resource type share its API
+    calls. Types whose loader reads other types are loaded in a later wave.
+    """
+
+    def __init__(self, account_clients, accounts, regions, max_workers=8, max_per_account=2, deadline=None):
+        self.account_clients = account_clients
+        self.targets = [(account_id, region) for account_id in accounts for region in regions]
+        self.max_workers = max_workers
+        self.max_per_account = max_per_account
+        self.deadline = deadline
+        self.index = {target: {} for target in self.targets}
+        self.locations = {}
+        self.failed = {}
+
+    def load(self, resource_types):
+        """
+        Load the resource types, and the types they depend on, for every account and region.
+        """
+        needed = set()
+
+        def add(resource_type):
+            if resource_type not in needed:
+                needed.add(resource_type)
+                for dependency in RESOURCE_TYPES[resource_type][1]:
+                    add(dependency)
+
+        def level(resource_type):
+            return max((level(dependency) + 1 for dependency in RESOURCE_TYPES[resource_type][1]), default=0)
+
+        for resource_type in resource_types:
+            add(resource_type)
+
+        # Load in waves, so every loader runs after the types it reads
+        for wave in sorted({level(resource_type) for resource_type in needed}):
+            tasks = [
+                (account_id, region, resource_type)
+                for resource_type in sorted(needed) if level(resource_type) == wave
+                for account_id, region in self.targets
+                if resource_type not in self.index[(account_id, region)]
+                and (account_id, region, resource_type) not in self.failed
+                and all(dependency in self.index[(account_id, region)] for dependency in RESOURCE_TYPES[resource_type][1])
+            ]
+            results, errors = run_scheduled(tasks, self._describe, self.max_workers, self.max_per_account, self.deadline)
+
+            for (account_id, region, resource_type), resources in results.items():
+                self.index[(account_id, region)][resource_type] = resources
+                for resource_id in resources:
+                    self.locations[(resource_type, resource_id)] = (account_id, region)
+            for task, error in errors.items():
+                print(f"Skipping {task[2]} of {task[0] or 'local account'} in {task[1]}: {error}")
+                self.failed[task] = error
+
+    def _describe(self, account_id, region, resource_type):
+        client = self.account_clients.get_client(account_id, RESOURCE_TYPES[resource_type][0], region)
+        return dict(RESOURCE_LOADERS[resource_type](client, self.index[(account_id, region)]))
+
+    def resources(self, resource_type):
+        """
+        Yield (account_id, region, resource_id, resource) for every loaded resource of a type.
+        """
+        for (account_id, region), loaded in self.index.items():
+            for resource_id, resource in loaded.get(resource_type, {}).items():
+                yield account_id, region, resource_id, resource
+
+    def get(self, resource_type, resource_id):
+        """
+        Return a loaded resource by type and ID, or None.
+        """
+        location = self.locations.get((resource_type, resource_id))
+        if location is None:
+            return None
+        return self.index[location][resource_type][resource_id]
+
+    def run(self, detector_names, settings):
+        """
+        Load what the detectors need and run them, returning their findings sorted by cost.
+        """
+        detectors = [DETECTORS[name] for name in detector_names]
+        self.load({resource_type for resource_types, _ in detectors for resource_type in resource_types})
+
+        findings = []
+        for _, detect in detectors:
+            findings.extend(detect(self, settings))
+
+        findings.sort(key=lambda finding: finding['EstimatedMonthlyCost'], reverse=True)
+        return findings
+
+    def failed_scans(self):
+        """
+        Return the describe passes that failed, in the failed_scans format of the volume report.
+        """
+        return [
+            {'AccountId': account_id, 'Region': region, 'Error': f"{resource_type}: {error}"}
+            for (account_id, region, resource_type), error in self.failed.items()
+        ]
@@ -0,0 +1,173 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from botocore.hooks import HierarchicalEmitter
+
+from aws_common import (API_RATE_LIMITS, AccountClients, AdaptiveTokenBucket, ApiThrottle, DeadlineExceeded,
+                        InvocationMetrics, TtlCache, run_task_graph)
+
+def make_client():
+    # Only the client's own event system, so the hooks run without botocore's retry handler
+    return SimpleNamespace(meta=SimpleNamespace(region_name='us-east-1', events=HierarchicalEmitter()))
+
+def test_throttled_bucket_below_one_request_per_second_still_hands_out_tokens():
+    bucket = AdaptiveTokenBucket(5)
+    for _ in range(4):
+        bucket.on_throttle()
+    assert bucket.rate < 1
+
+    # Let the bucket refill for longer than one token takes at the throttled rate
+    bucket.updated -= 10
+    bucket.acquire(deadline=time.monotonic() + 0.1)
+    assert bucket.tokens < 1
+
+def test_throttled_bucket_recovers_on_success():
+    bucket = AdaptiveTokenBucket(5)
+    for _ in range(4):
+        bucket.on_throttle()
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rate == 5
+
+def test_throttle_keeps_separate_buckets_per_account_and_region():
+    throttle = ApiThrottle()
+    local = throttle._bucket(None, 'us-east-1', 'ec2', 'DescribeVolumes')
+    assert throttle._bucket(None, 'us-east-1', 'ec2', 'DescribeVolumes') is local
+    assert throttle._bucket('111111111111', 'us-east-1', 'ec2', 'DescribeVolumes') is not local
+    assert throttle._bucket(None, 'eu-west-1', 'ec2', 'DescribeVolumes') is not local
+
+    local.on_throttle()
+    assert throttle._bucket('111111111111', 'us-east-1', 'ec2', 'DescribeVolumes').rate == API_RATE_LIMITS['ec2']
+
+def test_throttling_errors_slow_down_the_bucket_of_the_operation():
+    throttle = ApiThrottle()
+    client = throttle.attach(make_client(), 'ec2')
+    bucket = throttle._bucket(None, 'us-east-1', 'ec2', 'DescribeVolumes')
+
+    throttled = (SimpleNamespace(status_code=400), {'Error': {'Code': 'RequestLimitExceeded'}})
+    client.meta.events.emit('needs-retry.ec2.DescribeVolumes', response=throttled)
+    assert bucket.rate == API_RATE_LIMITS['ec2'] / 2
+    assert throttle._bucket(None, 'us-east-1', 'ec2', 'DescribeSnapshots').rate == API_RATE_LIMITS['ec2']
+
+    succeeded = (SimpleNamespace(status_code=200), {})
+    client.meta.events.emit('needs-retry.ec2.DescribeVolumes', response=succeeded)
+    assert bucket.rate > API_RATE_LIMITS['ec2'] / 2
+
+def test_attempts_after_the_deadline_are_not_sent():
+    throttle = ApiThrottle(deadline=time.monotonic() - 1)
+    client = throttle.attach(make_client(), 'ec2')
+
+    with pytest.raises(DeadlineExceeded):
+        client.meta.events.emit('before-send.ec2.DescribeVolumes', request=None)
+
+class FakeSts:
+    """
+    STS client handing out credentials that expire after the given number of seconds.
+    """
+
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+
+    def assume_role(self, **kwargs):
+        return {'Credentials': {
+            'AccessKeyId': 'test',
+            'SecretAccessKey': 'test',
+            'SessionToken': 'test',
+            'Expiration': datetime.now(timezone.utc) + timedelta(seconds=self.lifetime)
+        }}
+
+def test_clients_of_many_accounts_are_created_concurrently():
+    account_clients = AccountClients('read-role')
+    account_clients._sts_client = FakeSts()
+    accounts = [f'{index:012d}' for index in range(12)]
+
+    def get_clients(account_id):
+        return [account_clients.get_client(account_id, 'ec2', region) for region in ('us-east-1',)]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        clients = list(executor.map(get_clients, accounts))
+
+    assert get_clients(accounts[0]) == clients[0]
+    assert len({id(client) for account in clients for client in account}) == 12
+
+def test_refreshing_credentials_only_replaces_that_accounts_clients():
+    account_clients = AccountClients('read-role')
+    account_clients._sts_client = FakeSts()
+    kept = account_clients.get_client('111111111111', 'ec2', 'us-east-1')
+
+    # Credentials inside the refresh margin are renewed on the next call
+    account_clients._sts_client = FakeSts(lifetime=60)
+    expiring = account_clients.get_client('222222222222', 'ec2', 'us-east-1')
+    assert account_clients.get_client('222222222222', 'ec2', 'us-east-1') is not expiring
+    assert account_clients.get_client('111111111111', 'ec2', 'us-east-1') is kept
+
+def test_concurrent_phases_count_wall_clock_time_once():
+    invocation = InvocationMetrics()
+
+    def fetch():
+        with invocation.phase('fetch'):
+            time.sleep(0.2)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for _ in range(4):
+            executor.submit(fetch)
+    elapsed = (time.monotonic() - started) * 1000
+
+    assert 200 <= invocation.phases['fetch'] <= elapsed
+
+def test_separate_runs_of_a_phase_add_up():
+    invocation = InvocationMetrics()
+    for _ in range(2):
+        with invocation.phase('render'):
+            time.sleep(0.05)
+
+    assert invocation.phases['render'] >= 100
+
+def test_cache_drops_expired_keys_that_are_not_read_again():
+    cache = TtlCache(60)
+    assert cache.get_or_load('page-1', lambda: 'first') == 'first'
+    assert cache.get_or_load('page-1', lambda: 'reloaded') == 'first'
+
+    # Expire the entry, then store another key
+    cache._entries['page-1'] = (time.monotonic() - 1, 'first')
+    cache.get_or_load('page-2', lambda: 'second')
+
+    assert 'page-1' not in cache._entries
+    assert cache.get_or_load('page-2', lambda: 'reloaded') == 'second'
+
+def test_task_graph_passes_results_to_dependents():
+    results = run_task_graph({
+        'costs': (lambda: 10, ()),
+        'cube': (lambda: 3, ()),
+        'forecast': (lambda costs: costs * 2, ('costs',)),
+        'report': (lambda costs, cube, forecast: (costs, cube, forecast), ('costs', 'cube', 'forecast'))
+    })
+
+    assert results['report'] == (10, 3, 20)
+
+def test_independent_tasks_run_concurrently():
+    def fetch():
+        time.sleep(0.2)
+
+    started = time.monotonic()
+    run_task_graph({name: (fetch, ()) for name in ('costs', 'cube', 'hourly')}, max_workers=3)
+
+    assert time.monotonic() - started < 0.5
+
+def test_task_graph_failure_skips_dependents():
+    ran = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        run_task_graph({'costs': (fail, ()), 'report': (lambda costs: ran.append(costs), ('costs',))})
+    assert ran == []
+
+def test_task_graph_rejects_unmet_dependencies():
+    with pytest.raises(ValueError):
+        run_task_graph({'report': (lambda costs: costs, ('costs',))})
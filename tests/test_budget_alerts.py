@@ -0,0 +1,27 @@
+from cost_explorer_dashboard import check_budget_alerts
+
+def make_cost_data(current_total):
+    return {'current_total': current_total, 'trend_percentage': 0}
+
+def make_forecast(month_end, month='2026-01'):
+    return {'month': month, 'month_end': month_end, 'month_end_low': month_end, 'month_end_high': month_end}
+
+def alert_types(alerts):
+    return [alert['type'] for alert in alerts]
+
+def test_forecast_threshold_is_scaled_from_a_short_period_to_the_month():
+    # $100 a week is about $443 over the 31 days of January
+    alerts = check_budget_alerts(make_cost_data(80), 100, make_forecast(400), report_period_days=7)
+    assert alert_types(alerts) == []
+
+    alerts = check_budget_alerts(make_cost_data(80), 100, make_forecast(450), report_period_days=7)
+    assert alert_types(alerts) == ['Budget Forecast']
+
+def test_forecast_threshold_is_scaled_from_a_long_period_to_the_month():
+    # $900 over 90 days is $280 over the 28 days of February
+    alerts = check_budget_alerts(make_cost_data(800), 900, make_forecast(300, '2026-02'), report_period_days=90)
+    assert alert_types(alerts) == ['Budget Forecast']
+
+def test_exceeded_period_budget_takes_precedence_over_the_forecast():
+    alerts = check_budget_alerts(make_cost_data(120), 100, make_forecast(1000), report_period_days=30)
+    assert alert_types(alerts) == ['Budget Exceeded']
@@ -0,0 +1,181 @@
+import time
+
+import pytest
+
+import aws_common
+import detached_ebs_monitor
+from aws_common import DeadlineExceeded, get_continuation
+from cost_explorer_dashboard import get_cost_data, open_cost_store
+from detached_ebs_monitor import ScanCheckpoint, scan_for_detached_volumes
+from fake_aws import FakeAws
+
+REGIONS = ['us-east-1', 'eu-west-1']
+
+class SlowFakeAws(FakeAws):
+    """
+    FakeAws whose slow_call-th call of an operation takes a second, to cut a run short at a deadline.
+    """
+
+    def __init__(self, operation, slow_call, **kwargs):
+        super().__init__(**kwargs)
+        handler = getattr(self, f'_{operation}')
+        count = [0]
+
+        def slow(body):
+            count[0] += 1
+            if count[0] == slow_call:
+                time.sleep(1.0)
+            return handler(body)
+
+        setattr(self, f'_{operation}', slow)
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    aws_common.api_cache.clear()
+    yield
+    aws_common.api_cache.clear()
+
+def volume_ids(detached_volumes):
+    return [volume['VolumeId'] for volume in detached_volumes]
+
+def test_continuation_event_carries_the_run():
+    run_id, count, state = get_continuation({})
+    assert count == 0 and state == {}
+
+    event = {'continuation': {'run_id': run_id, 'count': 2, 'state': {'stage': 'send'}}}
+    assert get_continuation(event) == (run_id, 2, {'stage': 'send'})
+
+def test_volume_scan_resumes_from_its_checkpoint_after_the_cut_off(tmp_path):
+    path = str(tmp_path / 'scan.checkpoint.gz')
+    fake = SlowFakeAws('DescribeVolumes', 3, volume_count=3000)
+    # Clients are created up front, so only the slow call decides where the scan stops
+    for region in REGIONS:
+        fake.get_client(None, 'ec2', region)
+
+    checkpoint = ScanCheckpoint(path, 'run-1')
+    detached_volumes, failed_scans = scan_for_detached_volumes(
+        fake, [None], REGIONS, 7, 2, 2, include_snapshots=False, checkpoint=checkpoint, stop_at=time.monotonic() + 0.5
+    )
+    assert detached_volumes is None and failed_scans == []
+    checkpoint.save()
+    calls_before = fake.calls['DescribeVolumes']
+    assert calls_before < 2 * 6
+
+    checkpoint = ScanCheckpoint(path, 'run-1', resume=True)
+    detached_volumes, failed_scans = scan_for_detached_volumes(
+        fake, [None], REGIONS, 7, 2, 2, include_snapshots=False, checkpoint=checkpoint
+    )
+    assert failed_scans == []
+
+    # Every page is described once across both invocations
+    assert fake.calls['DescribeVolumes'] == 2 * 6
+    reference, _ = scan_for_detached_volumes(FakeAws(volume_count=3000), [None], REGIONS, 7, 2, 2, include_snapshots=False)
+    assert volume_ids(detached_volumes) == volume_ids(reference)
+
+def test_volume_scan_cut_off_after_its_last_page_is_not_described_again(tmp_path, monkeypatch):
+    path = str(tmp_path / 'scan.checkpoint.gz')
+    fake = FakeAws(volume_count=3000)
+    get_snapshot_sizes = detached_ebs_monitor.get_snapshot_sizes
+    count = [0]
+
+    def cut_off_snapshot_sizes(ec2_client):
+        count[0] += 1
+        if count[0] == 1:
+            raise DeadlineExceeded('Deadline exceeded before calling DescribeSnapshots')
+        return get_snapshot_sizes(ec2_client)
+
+    monkeypatch.setattr(detached_ebs_monitor, 'get_snapshot_sizes', cut_off_snapshot_sizes)
+
+    checkpoint = ScanCheckpoint(path, 'run-1')
+    detached_volumes, _ = scan_for_detached_volumes(
+        fake, [None], REGIONS[:1], 7, 2, 2, checkpoint=checkpoint, stop_at=time.monotonic() + 60
+    )
+    assert detached_volumes is None
+    checkpoint.save()
+
+    checkpoint = ScanCheckpoint(path, 'run-1', resume=True)
+    detached_volumes, failed_scans = scan_for_detached_volumes(fake, [None], REGIONS[:1], 7, 2, 2, checkpoint=checkpoint)
+    assert failed_scans == []
+
+    # The pages read before the cut-off are priced, not described and added again
+    assert fake.calls['DescribeVolumes'] == 6
+    reference, _ = scan_for_detached_volumes(FakeAws(volume_count=3000), [None], REGIONS[:1], 7, 2, 2)
+    assert len(set(volume_ids(detached_volumes))) == len(detached_volumes)
+    assert volume_ids(detached_volumes) == volume_ids(reference)
+    assert detached_volumes.total_cost() == pytest.approx(reference.total_cost())
+
+def test_volume_scan_killed_before_its_soft_stop_resumes_from_the_last_save(tmp_path):
+    class Killed(Exception):
+        pass
+
+    class KilledFakeAws(FakeAws):
+        killed = True
+
+        def _DescribeVolumes(self, body):
+            if self.killed and self.calls['DescribeVolumes'] == 4:
+                raise Killed('Task timed out')
+            return super()._DescribeVolumes(body)
+
+    path = str(tmp_path / 'scan.checkpoint.gz')
+    fake = KilledFakeAws(volume_count=3000)
+    checkpoint = ScanCheckpoint(path, 'run-1', save_interval=0)
+    # The invocation dies on its fourth page, so the checkpoint is never saved at the soft stop
+    scan_for_detached_volumes(fake, [None], REGIONS[:1], 7, 2, 2, include_snapshots=False,
+                              checkpoint=checkpoint, stop_at=time.monotonic() + 60)
+
+    fake.killed = False
+    checkpoint = ScanCheckpoint(path, 'run-1', resume=True)
+    assert checkpoint.progress(None, REGIONS[0])['next_token']
+    detached_volumes, failed_scans = scan_for_detached_volumes(fake, [None], REGIONS[:1], 7, 2, 2, include_snapshots=False,
+                                                               checkpoint=checkpoint)
+    assert failed_scans == []
+
+    # Only the pages after the last save are described again
+    assert fake.calls['DescribeVolumes'] == 4 + 3
+    reference, _ = scan_for_detached_volumes(FakeAws(volume_count=3000), [None], REGIONS[:1], 7, 2, 2, include_snapshots=False)
+    assert volume_ids(detached_volumes) == volume_ids(reference)
+
+def test_scan_failing_without_a_message_is_reported_as_failed(tmp_path):
+    class FailingFakeAws(FakeAws):
+        def _DescribeVolumes(self, body):
+            if self.calls['DescribeVolumes'] == 2:
+                raise RuntimeError()
+            return super()._DescribeVolumes(body)
+
+    checkpoint = ScanCheckpoint(str(tmp_path / 'scan.checkpoint.gz'), 'run-1')
+    detached_volumes, failed_scans = scan_for_detached_volumes(
+        FailingFakeAws(volume_count=3000), [None], REGIONS[:1], 7, 2, 2, include_snapshots=False, checkpoint=checkpoint
+    )
+
+    assert len(detached_volumes) == 0
+    assert failed_scans == [{'AccountId': None, 'Region': REGIONS[0], 'Error': 'RuntimeError'}]
+
+def test_checkpoint_of_another_run_is_ignored(tmp_path):
+    path = str(tmp_path / 'scan.checkpoint.gz')
+    checkpoint = ScanCheckpoint(path, 'run-1')
+    scan_for_detached_volumes(FakeAws(volume_count=100), [None], REGIONS, 7, 2, 2, include_snapshots=False,
+                              checkpoint=checkpoint, stop_at=time.monotonic() + 60)
+    checkpoint.save()
+
+    assert ScanCheckpoint(path, 'run-1', resume=True).targets
+    assert ScanCheckpoint(path, 'run-2', resume=True).targets == {}
+
+def test_cost_fetch_resumes_from_its_cursor_after_the_cut_off(tmp_path):
+    fake = SlowFakeAws('GetCostAndUsage', 3, service_count=10, cost_pages=4)
+    ce_client = fake.client('ce')
+    cost_store = open_cost_store(str(tmp_path / 'cost_history.db'))
+
+    cost_data = get_cost_data(ce_client, 30, cost_store, stop_at=time.monotonic() + 0.5, run_id='run-1')
+    assert cost_data['incomplete']
+    assert cost_store.execute("SELECT 1 FROM store_meta WHERE key = 'fetch_cursor'").fetchone() is not None
+
+    cost_data = get_cost_data(ce_client, 30, cost_store, run_id='run-1')
+    assert not cost_data['incomplete']
+    assert cost_store.execute("SELECT 1 FROM store_meta WHERE key = 'fetch_cursor'").fetchone() is None
+
+    reference_fake = FakeAws(service_count=10, cost_pages=4)
+    reference = get_cost_data(reference_fake.client('ce'), 30, open_cost_store(str(tmp_path / 'reference.db')))
+    assert cost_data['service_totals'] == pytest.approx(reference['service_totals'])
+    assert cost_data['current_total'] == pytest.approx(reference['current_total'])
+    # Pages fetched before the cut-off are not requested again
+    assert fake.calls['GetCostAndUsage'] == reference_fake.calls['GetCostAndUsage']
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import aws_common
+from cost_explorer_dashboard import find_missing_ranges, get_cost_data, open_cost_store, plan_cost_queries
+from fake_aws import FakeAws
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    aws_common.api_cache.clear()
+    yield
+    aws_common.api_cache.clear()
+
+def test_second_report_only_fetches_the_open_days(tmp_path):
+    fake = FakeAws(service_count=5)
+    ce_client = fake.client('ce')
+    cost_store = open_cost_store(str(tmp_path / 'cost_history.db'))
+
+    first = get_cost_data(ce_client, 30, cost_store)
+    assert first['api_calls'] == 1
+
+    plan = plan_cost_queries(30)
+    assert find_missing_ranges(cost_store, plan['history_start'], plan['end_date']) == [(plan['open_from'], plan['end_date'])]
+
+    # Cached pages would hide the requests, so fetch them again
+    aws_common.api_cache.clear()
+    second = get_cost_data(ce_client, 30, cost_store)
+    assert second['api_calls'] == 1
+    assert fake.calls['GetCostAndUsage'] == 2
+    assert sorted(second['service_totals']) == sorted(first['service_totals'])
+
+def test_estimated_days_are_fetched_again(tmp_path):
+    cost_store = open_cost_store(str(tmp_path / 'cost_history.db'))
+    get_cost_data(FakeAws(service_count=5).client('ce'), 30, cost_store)
+
+    plan = plan_cost_queries(30)
+    day = (datetime.strptime(plan['start_date'], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    cost_store.execute("UPDATE fetched_days SET estimated = 1 WHERE day = ?", (day,))
+
+    missing_ranges = find_missing_ranges(cost_store, plan['history_start'], plan['end_date'])
+    assert missing_ranges == [(day, next_day), (plan['open_from'], plan['end_date'])]
@@ -0,0 +1,93 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from cost_explorer_dashboard import CostIndex, CostMatrix, compare_periods, merge_cost_page, plan_comparisons
+
+def make_page(day, costs):
+    return [{
+        'TimePeriod': {'Start': day},
+        'Groups': [
+            {'Keys': [service_name], 'Metrics': {'UnblendedCost': {'Amount': str(amount)}}}
+            for service_name, amount in costs.items()
+        ]
+    }]
+
+def make_matrix():
+    cost_matrix = CostMatrix('2026-01-30', '2026-02-03')
+    merge_cost_page(cost_matrix, make_page('2026-01-30', {'EC2': 10.0, 'S3': 1.0}))
+    merge_cost_page(cost_matrix, make_page('2026-01-31', {'EC2': 12.0}))
+    # A day split across pages adds services to the same row
+    merge_cost_page(cost_matrix, make_page('2026-01-31', {'S3': 2.0}))
+    merge_cost_page(cost_matrix, make_page('2026-02-01', {'EC2': 5.0, 'Lambda': 0.5}))
+    return cost_matrix
+
+def test_pages_are_merged_into_dense_columns():
+    cost_matrix = make_matrix()
+
+    assert cost_matrix.dates == ['2026-01-30', '2026-01-31', '2026-02-01', '2026-02-02']
+    assert cost_matrix.services == ['EC2', 'S3', 'Lambda']
+    assert list(cost_matrix.column('S3')) == [1.0, 2.0, 0.0, 0.0]
+    assert cost_matrix.day_totals() == pytest.approx([11.0, 14.0, 5.5, 0.0])
+
+def test_days_outside_the_matrix_are_ignored():
+    cost_matrix = make_matrix()
+    merge_cost_page(cost_matrix, make_page('2026-02-03', {'EC2': 100.0}))
+
+    assert cost_matrix.total() == pytest.approx(30.5)
+
+def test_window_totals_and_top_services():
+    cost_matrix = make_matrix()
+
+    assert cost_matrix.service_totals('2026-01-31', '2026-02-02') == pytest.approx([17.0, 2.0, 0.5])
+    assert cost_matrix.total('2026-01-30', '2026-01-31') == pytest.approx(11.0)
+    assert cost_matrix.top_services(2) == [('EC2', 27.0), ('S3', 3.0)]
+
+def test_matrices_over_the_same_dates_add_up():
+    cost_matrix = make_matrix()
+    other = CostMatrix('2026-01-30', '2026-02-03')
+    merge_cost_page(other, make_page('2026-02-02', {'EC2': 1.0, 'RDS': 4.0}))
+    cost_matrix.add_matrix(other)
+
+    assert cost_matrix.services == ['EC2', 'S3', 'Lambda', 'RDS']
+    assert cost_matrix.service_totals() == pytest.approx([28.0, 3.0, 0.5, 4.0])
+
+def test_index_windows_match_matrix_windows():
+    cost_matrix = CostMatrix('2026-01-01', '2026-03-01')
+    rng = random.Random(7)
+    for day in cost_matrix.dates:
+        merge_cost_page(cost_matrix, make_page(day, {f'Service {index}': rng.uniform(0, 10) for index in range(5)}))
+    cost_index = CostIndex(cost_matrix)
+
+    for _ in range(50):
+        start, end = sorted(rng.sample(cost_matrix.dates, 2))
+        assert cost_index.service_totals(start, end) == pytest.approx(cost_matrix.service_totals(start, end))
+        assert cost_index.total(start, end) == pytest.approx(cost_matrix.total(start, end))
+
+def test_period_windows_end_today():
+    periods = {period['name']: period for period in plan_comparisons(datetime(2026, 3, 18, 9), 30, ['wow', 'mom', 'yoy', '10'])}
+
+    assert periods['wow']['current'] == ('2026-03-11', '2026-03-18')
+    assert periods['wow']['previous'] == ('2026-03-04', '2026-03-11')
+    assert periods['mom']['current'] == ('2026-03-01', '2026-03-18')
+    assert periods['mom']['previous'] == ('2026-02-01', '2026-02-18')
+    assert periods['yoy']['previous'] == ('2025-02-17', '2025-03-19')
+    assert periods['10']['label'] == '10 Days'
+    assert periods['10']['previous'] == ('2026-02-26', '2026-03-08')
+
+def test_month_over_month_on_the_first_compares_full_months():
+    (period,) = plan_comparisons(datetime(2026, 3, 1), 30, ['mom'])
+
+    assert period['current'] == ('2026-02-01', '2026-03-01')
+    assert period['previous'] == ('2026-01-01', '2026-02-01')
+
+def test_comparisons_total_both_windows():
+    cost_index = CostIndex(make_matrix())
+    period = {'name': '2', 'current': ('2026-02-01', '2026-02-03'), 'previous': ('2026-01-30', '2026-02-01')}
+    (comparison,) = compare_periods(cost_index, [period])
+
+    assert comparison['current_totals'] == pytest.approx([5.0, 0.0, 0.5])
+    assert comparison['previous_totals'] == pytest.approx([22.0, 3.0, 0.0])
+    assert comparison['current_total'] == pytest.approx(5.5)
+    assert comparison['previous_total'] == pytest.approx(25.0)
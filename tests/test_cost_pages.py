@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+import aws_common
+from cost_explorer_dashboard import MAX_HOURLY_DAYS, get_hourly_costs, iter_cost_pages, plan_window_queries
+from fake_aws import FakeAws
+
+def make_queries():
+    return plan_window_queries('2026-01-01', '2026-03-01', 'DAILY', 10)
+
+def count_groups(pages):
+    return sum(len(entry['Groups']) for page in pages for entry in page)
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    aws_common.api_cache.clear()
+    yield
+    aws_common.api_cache.clear()
+
+def test_concurrent_pages_match_sequential_pages():
+    fake = FakeAws(service_count=5, cost_pages=3)
+    ce_client = fake.client('ce')
+    queries = make_queries()
+
+    stats = {'api_calls': 0}
+    sequential = count_groups(iter_cost_pages(ce_client, queries, stats))
+    aws_common.api_cache.clear()
+    concurrent_stats = {'api_calls': 0}
+    concurrent = count_groups(iter_cost_pages(ce_client, queries, concurrent_stats, max_workers=4))
+
+    assert sequential == concurrent == 59 * 5
+    assert stats['api_calls'] == concurrent_stats['api_calls'] == len(queries) * 3
+
+def test_closing_the_page_stream_stops_the_workers():
+    fake = FakeAws(service_count=5, cost_pages=3)
+    pages = iter_cost_pages(fake.client('ce'), make_queries(), {'api_calls': 0}, max_workers=2)
+    next(pages)
+    # Returns only once every worker has given up on the full queue
+    pages.close()
+
+def test_worker_errors_are_raised_to_the_consumer():
+    class FailingClient:
+        def get_cost_and_usage(self, **kwargs):
+            raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        list(iter_cost_pages(FailingClient(), make_queries(), {'api_calls': 0}, max_workers=4))
+
+def test_queries_cut_off_at_stop_at_are_left_pending():
+    fake = FakeAws(service_count=5, cost_pages=3)
+    queries = make_queries()
+    pending = []
+
+    pages = list(iter_cost_pages(fake.client('ce'), queries, {'api_calls': 0}, stop_at=time.monotonic(), pending=pending))
+    assert pages == []
+    assert pending == queries
+
+def test_stop_at_without_pending_is_rejected():
+    with pytest.raises(ValueError):
+        next(iter_cost_pages(FakeAws().client('ce'), make_queries(), {'api_calls': 0}, stop_at=time.monotonic()))
+
+def test_hourly_costs_start_inside_the_hourly_limit():
+    fake = FakeAws(service_count=5)
+    hourly_costs = get_hourly_costs(fake.client('ce'), MAX_HOURLY_DAYS, {'api_calls': 0}, max_workers=4)
+
+    assert len(hourly_costs.dates) == MAX_HOURLY_DAYS * 24 - 1
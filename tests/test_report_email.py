@@ -0,0 +1,94 @@
+import csv
+import email
+import gzip
+import io
+import threading
+
+import pytest
+
+import aws_common
+from report_email import CsvAttachment, build_raw_message, deliver_reports, fit_attachments, html_row_template, render_rows
+
+class RecordingSes:
+    """
+    SES client that keeps every raw email it is asked to send.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def get_send_quota(self):
+        return {'MaxSendRate': 100.0}
+
+    def send_raw_email(self, **kwargs):
+        with self._lock:
+            self.sent.append(kwargs)
+            return {'MessageId': f'message-{len(self.sent)}'}
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    aws_common.api_cache.clear()
+    yield
+    aws_common.api_cache.clear()
+
+def read_csv(attachment):
+    return list(csv.reader(io.StringIO(gzip.decompress(attachment.data).decode('utf-8'))))
+
+def test_rows_are_escaped_before_they_are_formatted():
+    template = html_row_template('{name}', '${cost:.2f}')
+    html = render_rows(template, [{'name': '<EC2>', 'cost': 1.5}, {'name': 'S3 & Glacier', 'cost': 0.25}])
+
+    assert html == '<tr><td>&lt;EC2&gt;</td><td>$1.50</td></tr>\n<tr><td>S3 &amp; Glacier</td><td>$0.25</td></tr>\n'
+
+def test_csv_attachment_streams_rows_into_gzip():
+    attachment = CsvAttachment('costs.csv.gz', ['Service', 'Cost'], ([f'Service {index}', index] for index in range(3)))
+
+    assert read_csv(attachment) == [['Service', 'Cost'], ['Service 0', '0'], ['Service 1', '1'], ['Service 2', '2']]
+    assert not attachment.truncated
+
+def test_attachments_are_truncated_to_fit_the_message_limit():
+    html_body = '<html><body>Volumes</body></html>'
+    specs = [('volumes.csv.gz', ['VolumeId', 'Size'], lambda: ([f'vol-{index:017x}', index] for index in range(20000)))]
+
+    attachments, fitted_body = fit_attachments(html_body, specs, max_bytes=64 * 1024)
+    (attachment,) = attachments
+    assert attachment.truncated and 0 < attachment.row_count < 20000
+    assert len(read_csv(attachment)) == attachment.row_count + 1
+    assert 'volumes.csv.gz was truncated' in fitted_body
+
+    message = build_raw_message('sender@example.com', ['a@example.com'], 'Volumes', fitted_body, attachments)
+    assert len(message) <= 64 * 1024
+    part = email.message_from_bytes(message).get_payload()[1]
+    assert part.get_filename() == 'volumes.csv.gz'
+    assert part.get_payload(decode=True) == attachment.data
+
+def test_messages_within_the_limit_are_not_truncated():
+    specs = [('volumes.csv.gz', ['VolumeId'], lambda: ([f'vol-{index}'] for index in range(10)))]
+    (attachment,), html_body = fit_attachments('<html><body></body></html>', specs)
+
+    assert attachment.row_count == 10
+    assert 'truncated' not in html_body
+
+def make_report(recipients, body='<html><body>Costs</body></html>'):
+    return {'recipients': recipients, 'subject': 'Cost report', 'html_body': body}
+
+def test_identical_reports_are_sent_once_without_sharing_addresses():
+    ses = RecordingSes()
+    deliver_reports(ses, 'sender@example.com', [make_report(['a@example.com']), make_report(['b@example.com'])])
+
+    assert len(ses.sent) == 1
+    assert ses.sent[0]['Destinations'] == ['a@example.com', 'b@example.com']
+    message = email.message_from_bytes(ses.sent[0]['RawMessage']['Data'])
+    assert message['To'] is None
+
+def test_a_report_of_its_own_is_addressed_to_its_recipients():
+    ses = RecordingSes()
+    deliver_reports(ses, 'sender@example.com', [
+        make_report(['a@example.com', 'b@example.com']),
+        make_report(['c@example.com'], '<html><body>Team costs</body></html>')
+    ])
+
+    assert len(ses.sent) == 2
+    headers = sorted(email.message_from_bytes(sent['RawMessage']['Data'])['To'] for sent in ses.sent)
+    assert headers == ['a@example.com, b@example.com', 'c@example.com']
@@ -0,0 +1,124 @@
+from cost_explorer_dashboard import cost_report_records, diff_cost_report
+import detached_ebs_monitor
+from detached_ebs_monitor import diff_volume_report, scan_for_detached_volumes, snapshot_order, volume_report_records
+from fake_aws import FakeAws
+from report_email import ReportSnapshot, fingerprint_records
+
+def scan(fake):
+    detached_volumes, failed_scans = scan_for_detached_volumes(fake, [None], ['us-east-1'], 7, 2, 2, include_snapshots=False)
+    assert failed_scans == []
+    return detached_volumes
+
+def save_volume_report(path, detached_volumes):
+    snapshot = ReportSnapshot(path, order=snapshot_order)
+    snapshot.save(lambda: volume_report_records(detached_volumes, []))
+    return ReportSnapshot(path, order=snapshot_order)
+
+def test_saved_snapshot_is_read_back_unchanged(tmp_path):
+    records = [(('service', 'Amazon EC2'), 12.5), (('service', 'Amazon S3'), 3.0), (('alert', 'Budget Exceeded'), None)]
+    records.sort(key=lambda record: record[0])
+    path = str(tmp_path / 'report.snapshot.gz')
+    ReportSnapshot(path).save(lambda: iter(records))
+
+    snapshot = ReportSnapshot(path)
+    assert snapshot.fingerprint == fingerprint_records(records)
+    assert list(snapshot.records()) == records
+    assert list(snapshot.diff(iter(records))) == []
+
+def test_diff_reports_added_removed_and_changed_records(tmp_path):
+    path = str(tmp_path / 'report.snapshot.gz')
+    ReportSnapshot(path).save(lambda: iter([(('a',), 10.0), (('b',), 10.0), (('c',), 10.0)]))
+
+    diff = list(ReportSnapshot(path).diff(iter([(('a',), 10.5), (('c',), 20.0), (('d',), 1.0)]), tolerance=0.1))
+    assert diff == [
+        ('removed', ('b',), 10.0, None, None),
+        ('changed', ('c',), 10.0, 20.0, 1),
+        ('added', ('d',), None, 1.0, 2)
+    ]
+
+def test_save_keeps_matching_records_of_the_previous_snapshot(tmp_path):
+    path = str(tmp_path / 'report.snapshot.gz')
+    snapshot = ReportSnapshot(path)
+    snapshot.save(lambda: iter([(('eu-west-1', 'vol-1'), None), (('us-east-1', 'vol-2'), None)]))
+    snapshot.save(lambda: iter([(('us-east-1', 'vol-3'), None)]), keep=lambda key: key[0] == 'eu-west-1')
+
+    assert [key for key, _ in ReportSnapshot(path).records()] == [('eu-west-1', 'vol-1'), ('us-east-1', 'vol-3')]
+
+def test_unchanged_volume_scan_is_not_reported_again(tmp_path):
+    fake = FakeAws(volume_count=60)
+    snapshot = save_volume_report(str(tmp_path / 'volumes.snapshot.gz'), scan(fake))
+
+    assert diff_volume_report(snapshot, scan(fake), [], []) is None
+
+def test_volume_diff_lists_only_new_and_resolved_volumes(tmp_path):
+    fake = FakeAws(volume_count=60)
+    first = scan(fake)
+    path = str(tmp_path / 'volumes.snapshot.gz')
+    snapshot = save_volume_report(path, first)
+
+    fake.volume_count = 70
+    added, findings, removed = diff_volume_report(snapshot, scan(fake), [], [])
+    assert [volume['VolumeId'] for volume in added] == [f'vol-{i:017x}' for i in range(60, 70)]
+    assert findings == [] and removed == []
+
+    fake.volume_count = 50
+    added, findings, removed = diff_volume_report(snapshot, scan(fake), [], [])
+    assert len(added) == 0
+    assert [volume['ResourceId'] for volume in removed] == [f'vol-{i:017x}' for i in range(50, 60)]
+
+def test_volumes_of_failed_scans_are_not_reported_as_resolved(tmp_path):
+    fake = FakeAws(volume_count=60)
+    snapshot = save_volume_report(str(tmp_path / 'volumes.snapshot.gz'), scan(fake))
+
+    fake.volume_count = 50
+    failed_scans = [{'AccountId': None, 'Region': 'us-east-1', 'Error': 'AccessDenied'}]
+    assert diff_volume_report(snapshot, scan(fake), [], failed_scans) is None
+
+def make_cost_data(service_totals):
+    return {'service_totals': service_totals, 'anomalies': [], 'start_date': '2026-01-01'}
+
+def test_cost_report_changes_only_list_services_that_moved(tmp_path):
+    path = str(tmp_path / 'cost.snapshot.gz')
+    previous = make_cost_data({'Amazon EC2': 100.0, 'Amazon S3': 50.0, 'AWS Lambda': 5.0})
+    ReportSnapshot(path).save(lambda: cost_report_records(previous, []))
+
+    snapshot = ReportSnapshot(path)
+    assert diff_cost_report(snapshot, previous, [], 0.1) is None
+
+    current = make_cost_data({'Amazon EC2': 104.0, 'Amazon S3': 80.0, 'AWS Lambda': 5.0})
+    assert diff_cost_report(snapshot, current, [], 0.1) == [{'service': 'Amazon S3', 'previous': 50.0, 'cost': 80.0}]
+
+def test_new_cost_alerts_are_a_change(tmp_path):
+    path = str(tmp_path / 'cost.snapshot.gz')
+    cost_data = make_cost_data({'Amazon EC2': 100.0})
+    ReportSnapshot(path).save(lambda: cost_report_records(cost_data, []))
+
+    budget_alerts = [{'type': 'Budget Exceeded', 'message': '', 'severity': 'high'}]
+    assert diff_cost_report(ReportSnapshot(path), cost_data, budget_alerts, 0.1) == []
+
+class Context:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:detached-ebs'
+    function_name = 'detached-ebs'
+
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+def test_unchanged_volume_alert_is_not_sent_again(tmp_path, monkeypatch):
+    fake = FakeAws(volume_count=60)
+    monkeypatch.setattr(detached_ebs_monitor, 'get_account_clients', lambda *args, **kwargs: fake)
+    monkeypatch.setitem(detached_ebs_monitor.CONFIG, 'sender_email', 'sender@example.com')
+    monkeypatch.setitem(detached_ebs_monitor.CONFIG, 'recipient_emails', ['recipient@example.com'])
+    monkeypatch.setitem(detached_ebs_monitor.CONFIG, 'report_changes_only', True)
+    monkeypatch.setitem(detached_ebs_monitor.CONFIG, 'report_snapshot_path', str(tmp_path / 'volumes.snapshot.gz'))
+    monkeypatch.setitem(detached_ebs_monitor.CONFIG, 'state_bucket', '')
+
+    assert detached_ebs_monitor.lambda_handler({}, Context())['statusCode'] == 200
+    assert fake.calls['SendRawEmail'] == 1
+
+    response = detached_ebs_monitor.lambda_handler({}, Context())
+    assert response['statusCode'] == 200
+    assert fake.calls['SendRawEmail'] == 1
+
+    fake.volume_count = 61
+    detached_ebs_monitor.lambda_handler({}, Context())
+    assert fake.calls['SendRawEmail'] == 2
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timezone, timedelta
+
+from detached_ebs_monitor import lookup_volume_events, open_volume_state
+
+NOW = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+class FakeCloudTrail:
+    """
+    Answers LookupEvents from a list of CloudTrail event records, recording every request.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.requests = []
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, LookupAttributes, StartTime, EndTime):
+        self.requests.append((LookupAttributes[0]['AttributeValue'], StartTime))
+        events = [
+            {'CloudTrailEvent': json.dumps(record)} for record in self.records
+            if record['eventName'] == LookupAttributes[0]['AttributeValue']
+        ]
+        return [{'Events': events}]
+
+class FakeClients:
+    def __init__(self, cloudtrail):
+        self.cloudtrail = cloudtrail
+        self.targets = []
+
+    def get_client(self, account_id, service, region):
+        self.targets.append((account_id, service, region))
+        return self.cloudtrail
+
+def volume_record(event_name, volume_id, event_time, account_id='222222222222', region='eu-west-1'):
+    record = {
+        'eventName': event_name,
+        'eventTime': event_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'recipientAccountId': account_id,
+        'awsRegion': region,
+        'requestParameters': {'volumeId': volume_id}
+    }
+    if event_name == 'CreateVolume':
+        record['responseElements'] = {'volumeId': volume_id}
+    return record
+
+def test_looked_up_events_set_detach_times_and_the_next_lookup_starts_where_this_one_ended(tmp_path):
+    conn = open_volume_state(str(tmp_path / 'state.db'))
+    detached_at = NOW - timedelta(days=3)
+    cloudtrail = FakeCloudTrail([
+        volume_record('AttachVolume', 'vol-1', NOW - timedelta(days=10)),
+        volume_record('DetachVolume', 'vol-1', detached_at),
+        volume_record('DetachVolume', 'vol-2', NOW - timedelta(days=5)),
+        volume_record('AttachVolume', 'vol-2', NOW - timedelta(days=1))
+    ])
+    clients = FakeClients(cloudtrail)
+
+    lookup_volume_events(conn, clients, [('222222222222', 'eu-west-1')], NOW, 4, 2)
+
+    states = dict(conn.execute("SELECT volume_id, state FROM volume_state"))
+    assert states == {'vol-1': 'available', 'vol-2': 'in-use'}
+    assert conn.execute("SELECT detached_at FROM volume_state WHERE volume_id = 'vol-1'").fetchone()[0] == \
+        detached_at.strftime('%Y-%m-%dT%H:%M:%SZ')
+    assert clients.targets[0] == ('222222222222', 'cloudtrail', 'eu-west-1')
+    assert {start for _, start in cloudtrail.requests} == {NOW - timedelta(days=90)}
+
+    cloudtrail.requests.clear()
+    later = NOW + timedelta(days=1)
+    lookup_volume_events(conn, clients, [('222222222222', 'eu-west-1')], later, 4, 2)
+    assert {start for _, start in cloudtrail.requests} == {NOW}
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone, timedelta
+
+from detached_ebs_monitor import VolumeTable
+
+NOW = datetime(2026, 1, 31, tzinfo=timezone.utc)
+
+def make_volume(volume_id, size=10, tags=()):
+    return {
+        'VolumeId': volume_id,
+        'Size': size,
+        'VolumeType': 'gp3',
+        'AvailabilityZone': 'us-east-1a',
+        'CreateTime': NOW - timedelta(days=30),
+        'Tags': list(tags)
+    }
+
+def test_full_width_volume_ids_round_trip():
+    ids = ['vol-1234567890abcdef0', 'vol-fffffffffffffffff', 'vol-049df61146c4d7901', 'vol-1a2b3c4d']
+    table = VolumeTable(NOW)
+    for volume_id in ids:
+        table.add_volume(make_volume(volume_id), 'us-east-1')
+
+    assert [table.volume_id(row) for row in range(len(table))] == ids
+    assert [key[2] for key in table.row_keys()] == ids
+
+    table.costs.extend([1.0] * len(table))
+    assert [row[2] for row in table.csv_rows('us-east-1')] == ids
+
+    restored = VolumeTable.from_state(table.to_state(), NOW)
+    assert [restored.volume_id(row) for row in range(len(restored))] == ids
+
+def test_sort_orders_full_width_ids_by_value():
+    ids = ['vol-1234567890abcdef0', 'vol-0234567890abcdef0', 'vol-f000000000000000a', 'vol-0000000000000000b']
+    table = VolumeTable(NOW)
+    for volume_id in ids:
+        table.add_volume(make_volume(volume_id), 'us-east-1')
+    table.costs.extend([1.0] * len(table))
+
+    table.sort()
+    assert [table.volume_id(row) for row in range(len(table))] == sorted(ids)
@@ -32,12 +32,105 @@ variable "days_threshold" {
   default     = 7
 }
 
+variable "volume_types" {
+  description = "Only report detached volumes of these types, filtered by EC2 (empty for all types)"
+  type        = list(string)
+  default     = []
+}
+
+variable "volume_tag_keys" {
+  description = "Only report detached volumes carrying one of these tag keys, filtered by EC2 (empty for all volumes)"
+  type        = list(string)
+  default     = []
+}
+
+variable "waste_detectors" {
+  description = "Other idle resources to report (old_snapshots, unassociated_addresses, idle_load_balancers, stopped_instances, idle_volumes)"
+  type        = list(string)
+  default     = []
+}
+
+variable "snapshot_age_days" {
+  description = "Age in days after which the old_snapshots detector reports a snapshot"
+  type        = number
+  default     = 90
+}
+
+variable "include_snapshot_costs" {
+  description = "Whether to include the cost of each volume's snapshots in its estimated monthly cost"
+  type        = bool
+  default     = true
+}
+
+variable "scan_regions" {
+  description = "Regions to scan for detached volumes ([\"all\"] for every enabled region, empty for the deployment region only)"
+  type        = list(string)
+  default     = []
+}
+
+variable "track_detach_events" {
+  description = "Whether to track volume detach times from EC2 CloudTrail events instead of volume creation times"
+  type        = bool
+  default     = false
+}
+
+variable "reconcile_days" {
+  description = "Days between full volume scans that correct the tracked detach times"
+  type        = number
+  default     = 7
+}
+
 variable "schedule_expression" {
   description = "CloudWatch Events schedule expression for running the Lambda"
   type        = string
   default     = "cron(0 9 ? * MON *)" # Run every Monday at 9:00 AM UTC
 }
 
+# Multi-account configuration
+variable "target_accounts" {
+  description = "Member account IDs to scan through an assumed role ([\"organization\"] for every active account, empty for this account only)"
+  type        = list(string)
+  default     = []
+}
+
+variable "assume_role_name" {
+  description = "Name of the read-only role assumed in each target account"
+  type        = string
+  default     = "aws-cost-optimization-read"
+}
+
+# Owner routing configuration
+variable "owner_tag_keys" {
+  description = "Tag keys that name the owner of a resource, checked in order (the first is used for Cost Explorer)"
+  type        = list(string)
+  default     = ["Team", "Owner"]
+}
+
+variable "owner_recipients" {
+  description = "Email addresses that receive the slice of each report owned by a tag value, keyed by owner"
+  type        = map(list(string))
+  default     = {}
+}
+
+# Cost cube configuration
+variable "cost_cube_dimensions" {
+  description = "Dimensions the cost report breaks costs down by, each with one extra Cost Explorer request (LINKED_ACCOUNT, USAGE_TYPE, TAG)"
+  type        = list(string)
+  default     = []
+}
+
+variable "cost_comparisons" {
+  description = "Period comparisons shown per service in the cost report (wow, mom, yoy, or a number of days)"
+  type        = list(string)
+  default     = ["wow", "mom"]
+}
+
+variable "hourly_cost_days" {
+  description = "Days of hourly costs (up to 14) to show peak hours for in the cost report; needs hourly granularity enabled in Cost Explorer (0 to disable)"
+  type        = number
+  default     = 0
+}
+
 # Test resources configuration
 variable "create_test_resources" {
   description = "Whether to create test detached EBS volumes"
@@ -71,7 +164,7 @@ variable "report_period_days" {
 }
 
 variable "budget_threshold" {
-  description = "Budget threshold for alerts (0 to disable)"
+  description = "Budget for one report period of report_period_days days, scaled to the month for forecast alerts (0 to disable)"
   type        = number
   default     = 0
 }
@@ -81,3 +174,27 @@ variable "cost_report_schedule" {
   type        = string
   default     = "cron(0 8 ? * * *)" # Run daily at 8:00 AM UTC
 }
+
+variable "state_bucket" {
+  description = "S3 bucket used to persist the cost history, tracked volume states and report snapshots between runs (empty to keep them in /tmp only)"
+  type        = string
+  default     = ""
+}
+
+variable "report_changes_only" {
+  description = "Skip reports that have not changed since the last one sent, and only report the changes otherwise"
+  type        = bool
+  default     = false
+}
+
+variable "report_change_tolerance" {
+  description = "Percentage a service's cost must move by to count as a change when report_changes_only is set"
+  type        = number
+  default     = 5
+}
+
+variable "max_continuations" {
+  description = "Times a run that is running out of time may checkpoint to the state bucket and re-invoke itself (0 to disable)"
+  type        = number
+  default     = 3
+}